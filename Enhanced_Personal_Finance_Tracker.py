@@ -1,276 +1,178 @@
 import json
-import datetime
-import tkinter as tk
-from tkinter import ttk
-
-# Global dictionary to store transactions
-transactions = {}
+import queue
+import itertools
+import sys
+import threading
+import time
+from array import array
+import instrumentation
+from bulk_import import import_transactions, print_import_summary
+from save_manager import SaveManager
+from storage_backends import JsonBackend, get_backend
+from transaction_batch import BatchError, add_many, delete_many, update_many
+from transaction_store import LOAD_BATCH_SIZE, TransactionStore
+from transaction_validation import (parse_amount, parse_date, validate_category,
+                                    validate_date, validate_transaction_type)
+
+# tkinter is imported by load_tkinter() when the GUI is launched, so the text menu and the
+# command line start without it.
+tk = messagebox = ttk = None
+
+# Global store holding all transactions
+transactions = TransactionStore()
+
+# Where transactions are persisted (transactions.json unless FINANCE_TRACKER_BACKEND says otherwise)
+storage = get_backend()
+
+# Coalesces bursts of changes into one write; anything still queued is written at exit
+saver = SaveManager(storage)
+
+# Set once the full store has been loaded; until then summaries and searches go to the backend
+transactions_loaded = False
+
+@instrumentation.timed("load", rows=lambda result: len(transactions))
+def load_transactions():
+    #Load transaction data from the configured storage backend.
+    global transactions, transactions_loaded
+    transactions = storage.load(on_batch=show_load_progress)
+    transactions_loaded = True
 
-def validate_date(date_text):
-    try:
-        # Attempt to parse the input date and compare it to today's date.
-        input_date = datetime.datetime.strptime(date_text, '%Y-%m-%d').date()
-        current_date = datetime.date.today()
-        if input_date > current_date:
-            # Future dates are not allowed.
-            return False, "Date cannot be in the future."
-        return True, ""
-    except ValueError:
-        # Handle cases where the date format is incorrect.
-        return False, "Invalid date or format. Please enter the date in (YYYY-MM-DD) format."
+def ensure_loaded():
+    #Load the full store the first time something needs it.
+    if not transactions_loaded:
+        load_transactions()
 
-def load_transactions():
-    #Load transaction data from a JSON file.
-    global transactions
-    try:
-        with open('transactions.json', 'r') as file:
-            transactions = json.load(file)
-    except FileNotFoundError:
-        transactions = {}
+def show_load_progress(loaded, progress):
+    #Progress line for files that take more than one batch to load.
+    if loaded > LOAD_BATCH_SIZE:
+        print(f"Loading transactions... {int(progress * 100)}%", end='\r' if progress < 1 else '\n', flush=True)
 
 def save_transactions():
-    #Save the current transactions to a JSON file.
-    with open('transactions.json', 'w') as file:
-        json.dump(transactions, file, indent=4)
+    #Write a full snapshot of the current transactions to the storage backend now.
+    with saver.lock:
+        saver.save(transactions)
+        saver.flush()
 
 def add_transaction():
     #Add a new transaction after collecting input from the user.
     while True: 
         transaction_type = input("Enter the transaction type (Income/Expense): ").lower().strip()
-        if not transaction_type:
-            print("Transaction type cannot be empty.")
-            continue
-        if transaction_type not in ['income', 'expense']:
-            print("Invalid transaction type. Please enter 'Income' or 'Expense'.")
+        is_valid, message = validate_transaction_type(transaction_type)
+        if not is_valid:
+            print(message)
             continue
         break
 
     while True:
         category = input("Enter the transaction category: ").lower().strip()
-        if not category:
-            print("Category cannot be empty.")
-            continue
-        if not category.isalpha():
-            print("Category name must consist of alphabetic characters only.")
+        is_valid, message = validate_category(category)
+        if not is_valid:
+            print(message)
             continue
         break
 
     while True:
-        input_str = input("Enter the transaction amount: ").strip()
-        if not input_str:
-            print("Amount cannot be empty.")
+        amount, message = parse_amount(input("Enter the transaction amount: ").strip())
+        if amount is None:
+            print(message)
             continue
-        try:
-            amount = float(input_str)
-            if amount <= 0:
-                print("Amount must be greater than 0. Please try again.")
-                continue
-            break
-        except ValueError:
-            print("Invalid amount. Please enter a numerical value.")
+        break
 
     while True:
         date = input("Please enter the transaction date in the format (YYYY-MM-DD): ").strip()
         if not date:
             print("Date cannot be empty.")
             continue
-        is_valid, message = validate_date(date)
-        if not is_valid:
-            print(message)  # Print the error message returned from validate_date
+        date, message = parse_date(date)
+        if date is None:
+            print(message)  # Print the error message returned from parse_date
             continue
         break  # If is_valid is True, break out of the loop
 
-    # Initialize the transaction_type key if it doesn't exist
-    if transaction_type not in transactions:
-        transactions[transaction_type] = {}
-    if category not in transactions[transaction_type]:
-        transactions[transaction_type][category] = []
-
-    transaction = {"amount": amount, "date": date}
-    transactions[transaction_type][category].append(transaction)
-
-    save_transactions()
+    ensure_loaded()
+    add_many(transactions, saver, [(transaction_type, category, amount, date)], flush=False)
     print("Transaction added successfully.")
 
 
 def view_transactions():
     #Display all stored transactions.
+    ensure_loaded()
     if not transactions:
         print("No transactions available to view.")
         return
-    for transaction_type, categories in transactions.items():
+    for transaction_type in transactions.types():
         print(f"Transaction type: {transaction_type.capitalize()}")
-        if isinstance(categories, dict):  # Check if categories is a dictionary
-            for category, transaction_list in categories.items():
-                print(f"\tCategory: {category}")
-                for transaction in transaction_list:
-                    print(f"\t\tAmount: {transaction['amount']}, Date: {transaction['date']}")
-        elif isinstance(categories, list):  # Check if categories is a list
-            for transaction in categories:
-                print(f"\tAmount: {transaction['amount']}, Date: {transaction['date']}")
-
-def delete_transaction():
-    #Allow the user to delete a transaction.
-    if not transactions:
-        print("No transactions available to delete.")
-        return
-    
-    view_transactions()
-    
+        for category in transactions.categories(transaction_type):
+            print(f"\tCategory: {category}")
+            for row in transactions.group_rows(transaction_type, category):
+                print(f"\t\tID: {transactions.ids[row]}, Amount: {transactions.amounts[row]}, "
+                      f"Date: {transactions.date(row)}")
+
+def prompt_transaction_id(action):
+    #Ask for the ID of an existing transaction, as shown by view_transactions().
     while True:
-        transaction_type = input("Enter the transaction type of the transaction you want to delete: ").lower().strip()
-        
-        if not transaction_type:
-            print("Transaction type cannot be empty.")
+        input_str = input(f"Enter the ID of the transaction you want to {action}: ").strip()
+        if not input_str:
+            print("Transaction ID cannot be empty.")
             continue
-        
-        if transaction_type not in transactions:
-            print("Transaction type does not exist.")
+        try:
+            transaction_id = int(input_str)
+        except ValueError:
+            print("Invalid ID. Please enter a whole number.")
             continue
-        
-        if not transaction_type.isalpha():
-            print("Transaction type must consist of alphabetic characters only.")
+        if not transactions.has_id(transaction_id):
+            print("No transaction has that ID.")
             continue
-        break
-    while True:
-    
-        category = input("Enter the category of the transaction you want to delete: ").lower().strip()
-        if not category:
-            print("Category cannot be empty.")
-            continue 
-        if category not in transactions[transaction_type]:
-            print("Category does not exist.")
-            continue 
-        if not category.isalpha():
-            print("Invalid category. Please use only letters.")
-            continue
-        break 
+        return transaction_id
 
-        # Print the transactions in the selected category for debugging
-        
-    list_transactions_in_category(transaction_type, category)
 
-   
-    while True:
-        input_str = input("Enter the index of the transaction you want to delete: ").strip()
-        if not input_str:
-            print("Transaction index cannot be empty.")
-            continue 
-        try:
-            transaction_index = int(input_str)
-            if transaction_index < 0 or transaction_index >= len(transactions[transaction_type][category]):
-                print("Invalid transaction index.")
-                continue 
-        except ValueError:
-            print("Invalid index. Please enter a numerical value.")
-            continue
-        break 
+def delete_transaction():
+    #Allow the user to delete a transaction.
+    ensure_loaded()
+    if not transactions:
+        print("No transactions available to delete.")
+        return
 
-    del transactions[transaction_type][category][transaction_index]
+    view_transactions()
+    transaction_id = prompt_transaction_id("delete")
     try:
-        if not transactions[transaction_type][category]:
-            del transactions[transaction_type][category]
-    
-                
-        if not transactions[transaction_type]:
-            del transactions[transaction_type]
-
-        save_transactions()
-        print("Transaction deleted successfully.")
-        return  # Exit the function after successful deletion
-    except ValueError:
-        print("Please enter a valid index.")
-    
-
-def list_transactions_in_category(transaction_type, category):
-    print(f"Transactions in '{category}' under '{transaction_type.capitalize()}':")
-    for i, transaction in enumerate(transactions[transaction_type][category]):
-        print(f"{i}. Amount: {transaction['amount']}, Date: {transaction['date']}")
+        delete_many(transactions, saver, [transaction_id])
+    except BatchError as e:
+        # Another process may have deleted it since it was listed.
+        print(e)
+        return
+    print("Transaction deleted successfully.")
 
 
 def update_transaction():
     #Allow the user to update details of a specific transaction.
+    ensure_loaded()
     if not transactions:
         print("No transactions available to update.")
         return
     view_transactions()
-    while True:
-    
-        transaction_type = input("Enter the type of the transaction you want to update (Income/Expense): ").lower().strip()
-        if not transaction_type:
-            print("Transaction type cannot be empty.")
-            continue 
-        if transaction_type not in transactions:
-            print("Transaction type does not exist.")
-            continue 
-        if not transaction_type.isalpha():
-            print("Invalid transaction type. Please use only letters.")
-        break
-
-    while True:
-    
-        category = input("Enter the category of the transaction you want to update: ").lower().strip()
-        if not category:
-            print("Category cannot be empty.")
-            continue 
-        if category not in transactions[transaction_type]:
-            print("Category does not exist.")
-            continue 
-        if not category.isalpha():
-            print("Invalid category. Please use only letters.")
-            continue
-        break 
-    
-    list_transactions_in_category(transaction_type, category)
-    while True:
-        input_str = input("Enter the index of the transaction you want to update: ").strip()
-        if not input_str:
-            print("Transaction index cannot be empty.")
-            continue
-        
-        try:
-            transaction_index = int(input_str)
-            if transaction_index < 0 or transaction_index >= len(transactions[transaction_type][category]):
-                print("Invalid transaction index.")
-                continue
-        except ValueError:
-            print("Invalid index. Please enter a numerical value.")
-            continue
-
-        break  # If all checks pass, break out of the loop
+    transaction_id = prompt_transaction_id("update")
 
     while True:
         new_transaction_type = input("Enter the new transaction type (Income/Expense): ").lower().strip()
-        if not transaction_type:
-            print("Transaction type cannot be empty.")
+        is_valid, message = validate_transaction_type(new_transaction_type)
+        if not is_valid:
+            print(message)
             continue
-        if new_transaction_type in ['income', 'expense']:
-            break
-        else:
-            print("Invalid transaction type. Please enter 'Income' or 'Expense'.")
+        break
 
     while True:  
         new_category = input("Enter the transaction new category: ").lower().strip()
-        if not new_category:
-            print("Category cannot be empty.")
-            continue
-        if not new_category.isalpha():
-            print("Category name must consist of alphabetic characters only.")
+        is_valid, message = validate_category(new_category)
+        if not is_valid:
+            print(message)
             continue
         break
-   
+
     while True:
-        input_str = input("Enter the transaction new amount: ").strip()
-        if not input_str:
-            print("Amount cannot be empty.")
-            continue 
-        try:
-            amount = float(input_str)
-            if amount <= 0:
-                print("Amount must be greater than 0. Please try again.")
-                continue 
-        except ValueError:
-            print("Invalid amount. Please enter a numerical value.")
+        amount, message = parse_amount(input("Enter the transaction new amount: ").strip())
+        if amount is None:
+            print(message)
             continue
         break
 
@@ -279,8 +181,8 @@ def update_transaction():
         if not date:
             print("Date cannot be empty.")
             continue 
-        is_valid, message = validate_date(date)
-        if not is_valid:
+        date, message = parse_date(date)
+        if date is None:
             print(message)  # Inform the user why the date is invalid
             continue
         break
@@ -288,119 +190,201 @@ def update_transaction():
      # If all inputs are valid, perform the update
     if new_transaction_type and new_category and amount and date:
         # Move the transaction to the new category/type if necessary
-        transaction = transactions[transaction_type][category].pop(transaction_index)
-        if not transactions[transaction_type][category]:
-            del transactions[transaction_type][category]
-
-        # Add the transaction to the new type/category
-        if new_category not in transactions[new_transaction_type]:
-            transactions[new_transaction_type][new_category] = []
-        transactions[new_transaction_type][new_category].append({
-            "amount": amount,
-            "date": date
-        })
+        try:
+            update_many(transactions, saver, [(transaction_id, new_transaction_type, new_category, amount, date)])
+        except BatchError as e:
+            # Another process may have deleted it while the new details were entered.
+            print(e)
+            return
 
     # If all validations pass, then update the transaction
     
     print("Transaction updated successfully.")
 
 
+@instrumentation.timed("summary")
 def total_summary():
     #Calculate and display total income, expenses, and net total.
-    if not transactions:
+    if not storage.queries_without_loading:
+        ensure_loaded()
+    if transactions_loaded:
+        totals = transactions.totals_by_type()
+    else:
+        # Answered by the backend without loading every transaction (a manifest, SQL or a mapped file).
+        totals = {transaction_type: total for transaction_type, (total, _) in storage.summary().items()}
+    if not totals:
         print("No transactions available.")
         return
 
-    total_income = 0
-    total_expense = 0
-
-    for transaction_type, categories in transactions.items():
-        for category, transactions_list in categories.items():
-            for transaction in transactions_list:
-                amount = transaction['amount']
-                if transaction_type == 'income':
-                    total_income += amount
-                elif transaction_type == 'expense':
-                    total_expense += amount
+    total_income = totals.get('income', 0)
+    total_expense = totals.get('expense', 0)
 
     print("Total Income:", total_income)
     print("Total Expense:", total_expense)
     print("Net Total:", total_income - total_expense)
-# The main transactions dictionary to store all data
-transactions = {}
 
-def read_bulk_transactions_from_file(filename):
-    global transactions  # Ensure we are modifying the global dictionary
-    added_transactions = {}
-
-    try:
-        with open(filename, 'r') as file:
-            for line in file:
-                parts = line.strip().split(',')
-                if len(parts) != 4:
-                    print("Skipping invalid entry:", line)
-                    continue
-
-                transaction_type, category, amount, date = parts
-                amount = float(amount)
-
-                if transaction_type not in added_transactions:
-                    added_transactions[transaction_type] = {}
-                if category not in added_transactions[transaction_type]:
-                    added_transactions[transaction_type][category] = []
-
-                transaction = {"amount": amount, "date": date}
-                added_transactions[transaction_type][category].append(transaction)
-
-                if transaction_type not in transactions:
-                    transactions[transaction_type] = {}
-                if category not in transactions[transaction_type]:
-                    transactions[transaction_type][category] = []
-                transactions[transaction_type][category].append(transaction)
-
-        print("Bulk transactions read and displayed below:")
-        display_transactions(added_transactions)
-        print("Now saving transactions...")
-        save_transactions()  # Ensure this is called to save changes
-    except FileNotFoundError:
-        print("File not found.")
-    except ValueError:
-        print("Error processing a line. Check file format.")
-    except Exception as e:
-        print(f"An error occurred: {e}")
-
-
-def display_transactions(transactions):
+def verify_totals():
+    #Recount the summary totals from every transaction and report any drift in the running totals.
+    ensure_loaded()
+    problems = transactions.verify_totals()
+    if not problems:
+        print("Running totals match a full recount.")
+        return
+    print("Running totals have drifted:")
+    for problem in problems:
+        print(" ", problem)
+    transactions.rebuild_totals()
+    print("Totals have been rebuilt from the transactions.")
+
+def monthly_report():
+    #Show totals per month, type and category, read from the store's rollups.
+    ensure_loaded()
     if not transactions:
-        print("No transactions available to display.")
+        print("No transactions available.")
         return
-    
-    for transaction_type, categories in transactions.items():
-        print(f"\nTransaction type: {transaction_type.capitalize()}")
-        for category, transaction_list in categories.items():
-            print(f"  Category: {category.capitalize()}")
-            for transaction in transaction_list:
-                print(f"    Amount: {transaction['amount']}, Date: {transaction['date']}")
+    transaction_type = input("Enter the transaction type (Income/Expense, leave blank for both): ").lower().strip()
+    while True:
+        month_from = input("Enter the first month (YYYY-MM, leave blank for no limit): ").strip()
+        month_to = input("Enter the last month (YYYY-MM, leave blank for no limit): ").strip()
+        try:
+            lines = transactions.rollups(transaction_type, month_from, month_to)
+            break
+        except ValueError as e:
+            print(e)
+    if not lines:
+        print("No transactions found for that selection.")
+        return
+    print(f"{'Category':<20} {'Total':>14} {'Count':>7} {'Min':>12} {'Max':>12}")
+    for month, month_lines in itertools.groupby(lines, key=lambda line: line[0]):
+        print(f"\n{month}")
+        for transaction_type, type_lines in itertools.groupby(month_lines, key=lambda line: line[1]):
+            type_total = 0
+            print(f"  {transaction_type.capitalize()}")
+            for _, _, category, total, count, smallest, largest in type_lines:
+                type_total += total
+                print(f"    {category:<18} {total:>14.2f} {count:>7} {smallest:>12.2f} {largest:>12.2f}")
+            print(f"    {'Total':<18} {type_total:>14.2f}")
+
+def search_transactions():
+    #Find transactions by type and an optional date range.
+    if not storage.queries_without_loading:
+        ensure_loaded()
+    if transactions_loaded and not transactions:
+        print("No transactions available to search.")
+        return
+    transaction_type = input("Enter the transaction type (Income/Expense, leave blank for any): ").lower().strip()
+    while True:
+        date_from = input("Enter the start date (YYYY-MM-DD, leave blank for no limit): ").strip()
+        date_to = input("Enter the end date (YYYY-MM-DD, leave blank for no limit): ").strip()
+        try:
+            if transactions_loaded:
+                matches = [transactions.row(row) for row in transactions.search(transaction_type, date_from, date_to)]
+            else:
+                # The backend only reads what the filters need (e.g. the months in the date range).
+                with instrumentation.measure("search (backend)") as sample:
+                    matches = storage.search(transaction_type, date_from, date_to)
+                    sample.rows = len(matches)
+        except ValueError as e:
+            print(e)
+            continue
+        break
+    if not matches:
+        print("No matching transactions found.")
+        return
+    for row_type, category, amount, date in matches:
+        print(f"{date}  {row_type.capitalize()}  {category}  Amount: {amount}")
+    print(f"{len(matches)} matching transaction(s).")
+# The main transaction store holding all data
+transactions = TransactionStore()
+
+# Extra rows rendered below the visible part of the GUI table.
+VIEW_BUFFER_ROWS = 5
+
+# How often the GUI checks for rows parsed by the background loader (milliseconds).
+LOAD_POLL_MS = 50
+
+def read_bulk_transactions_from_file(filename, parallel=None, workers=None):
+    #Stream "type,category,amount,date" lines from a file into the store and commit them once.
+    #Large files are parsed by several worker processes unless parallel is set explicitly.
+    ensure_loaded()
+    with saver.lock:
+        first_new_row = len(transactions.amounts)
+        try:
+            result = import_transactions(filename, transactions, parallel, workers)
+        except FileNotFoundError:
+            print("File not found.")
+            return
+        except Exception as e:
+            print(f"An error occurred: {e}")
+            return
+
+        print_import_summary(result)
+        if result["imported"]:
+            print("Now saving transactions...")
+            commit_new_rows(first_new_row)
+
+def commit_new_rows(first_new_row):
+    #Persist rows that were added straight to the store (e.g. by a bulk import) as one commit.
+    saver.commit_rows(transactions, first_new_row)
 
 
 class FinanceTrackerApp:
         def __init__(self, root):
+            load_tkinter()
             self.root = root
             self.root.title('Enhanced Personal Finance Tracker')
             self.root.geometry('800x600')
 
-            self.data = self.load_data("transactions.json")
+            # Filled in batches by the background loader started below
+            self.data = TransactionStore()
+            # The table is a virtual list: view_rows holds every row of the current
+            # result, but only page_size rows from view_offset are in the Treeview.
+            self.view_rows = array('I')
+            self.view_offset = 0
+            self.page_size = 20
+            # Treeview items are reused as the window scrolls, so selections are kept as
+            # transaction ids; item_ids says which transaction each item shows right now
+            self.selected_ids = set()
+            self.item_ids = {}
+            # Remembered so the view can be rebuilt when loading finishes
+            self.current_search = None
+            self.sort_state = None
+            self.loading = False
+            self.load_progress = 0.0
             self.create_widgets()
             self.display_data()
+            self.start_loading()
 
         def create_widgets(self):
-            # Treeview for displaying transactions
-            self.tree = ttk.Treeview(self.root, columns=("Date", "Type", "Category", "Amount"), show='headings')
+            # Treeview for displaying transactions, scrolled by our own scrollbar
+            self.tree_frame = tk.Frame(self.root)
+            self.tree_frame.pack(fill=tk.BOTH, expand=True)
+            self.tree = ttk.Treeview(self.tree_frame, columns=("Date", "Type", "Category", "Amount"),
+                                     show='headings', height=self.page_size)
             self.tree.heading("Date", text="Date", command=lambda: self.treeview_sort_column("Date", False))
             self.tree.heading("Type", text="Type", command=lambda: self.treeview_sort_column("Type", False))
             self.tree.heading("Category", text="Category", command=lambda: self.treeview_sort_column("Category", False))
             self.tree.heading("Amount", text="Amount", command=lambda: self.treeview_sort_column("Amount", False))
-            self.tree.pack(fill=tk.BOTH, expand=True)
+            self.scrollbar = ttk.Scrollbar(self.tree_frame, orient=tk.VERTICAL, command=self.on_scroll)
+            self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+            self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+            self.tree.bind("<Configure>", self.on_tree_resize)
+            self.tree.bind("<<TreeviewSelect>>", self.on_select)
+            self.tree.bind("<MouseWheel>", self.on_mouse_wheel)
+            self.tree.bind("<Button-4>", self.on_mouse_wheel)
+            self.tree.bind("<Button-5>", self.on_mouse_wheel)
+            for key, step in (("<Up>", -1), ("<Down>", 1)):
+                self.tree.bind(key, lambda event, step=step: self.scroll_to(self.view_offset + step) or "break")
+            for key, pages in (("<Prior>", -1), ("<Next>", 1)):
+                self.tree.bind(key, lambda event, pages=pages:
+                               self.scroll_to(self.view_offset + pages * self.page_size) or "break")
+            self.tree.bind("<Home>", lambda event: self.scroll_to(0) or "break")
+            self.tree.bind("<End>", lambda event: self.scroll_to(len(self.view_rows)) or "break")
+
+            self.status_var = tk.StringVar()
+            tk.Label(self.root, textvariable=self.status_var, anchor=tk.W).pack(fill=tk.X, padx=6)
+            self.progress = ttk.Progressbar(self.root, mode='determinate', maximum=100)
 
             # Search fields and button
             self.search_frame = tk.Frame(self.root)
@@ -427,63 +411,230 @@ class FinanceTrackerApp:
             self.reset_button = ttk.Button(self.search_frame, text="Reset", command=self.reset_search)
             self.reset_button.pack(side=tk.LEFT, padx=6)
 
-        def display_data(self, data=None):
-            if data is None:
-                data = self.data
-            self.tree.delete(*self.tree.get_children())
-            for transaction_type, categories in data.items():
-                for category, transactions in categories.items():
-                    for transaction in transactions:
-                        # Assuming transaction is a dictionary with 'date' and 'amount'
-                        if all(key in transaction for key in ['date', 'amount']):
-                            self.tree.insert('', 'end', values=(
-                                transaction["date"],
-                                transaction_type.capitalize(),
-                                category.capitalize(),
-                                transaction["amount"]
-                            ))
-
-        def load_data(self, filepath):
+            self.report_button = ttk.Button(self.search_frame, text="Monthly Report", command=self.show_monthly_report)
+            self.report_button.pack(side=tk.LEFT, padx=6)
+
+            # Date and amount range filters, answered from the store's sorted indexes
+            self.range_frame = tk.Frame(self.root)
+            self.range_frame.pack(pady=(0, 20))
+
+            tk.Label(self.range_frame, text="From (YYYY-MM-DD):").pack(side=tk.LEFT, padx=6)
+            self.search_from_var = tk.StringVar()
+            self.search_from_entry = ttk.Entry(self.range_frame, textvariable=self.search_from_var)
+            self.search_from_entry.pack(side=tk.LEFT, padx=6)
+
+            tk.Label(self.range_frame, text="To (YYYY-MM-DD):").pack(side=tk.LEFT, padx=6)
+            self.search_to_var = tk.StringVar()
+            self.search_to_entry = ttk.Entry(self.range_frame, textvariable=self.search_to_var)
+            self.search_to_entry.pack(side=tk.LEFT, padx=6)
+
+            tk.Label(self.range_frame, text="Min amount:").pack(side=tk.LEFT, padx=6)
+            self.search_min_var = tk.StringVar()
+            self.search_min_entry = ttk.Entry(self.range_frame, textvariable=self.search_min_var, width=10)
+            self.search_min_entry.pack(side=tk.LEFT, padx=6)
+
+            tk.Label(self.range_frame, text="Max amount:").pack(side=tk.LEFT, padx=6)
+            self.search_max_var = tk.StringVar()
+            self.search_max_entry = ttk.Entry(self.range_frame, textvariable=self.search_max_var, width=10)
+            self.search_max_entry.pack(side=tk.LEFT, padx=6)
+
+        def display_data(self, rows=None):
+            # rows are row positions in self.data; None shows every transaction
+            if rows is None:
+                self.current_search = None
+                rows = self.data.ordered_rows()
+            self.view_rows = array('I', rows)
+            self.view_offset = 0
+            self.sort_state = None
+            self.render_rows()
+
+        def refresh_view(self):
+            # Rebuild the view from self.data, keeping the active search, sort and scroll position
+            offset, sort_state = self.view_offset, self.sort_state
+            if self.current_search is None:
+                self.display_data()
+            else:
+                self.display_data(self.data.search(*self.current_search))
+            if sort_state is not None:
+                self.sort_view(*sort_state)
+            self.scroll_to(offset)
+
+        def row_values(self, row):
+            transaction_type, category, amount, date = self.data.row(row)
+            return (date, transaction_type.capitalize(), category.capitalize(), amount)
+
+        @instrumentation.timed("gui render", rows=lambda result, self: len(self.tree.get_children()))
+        def render_rows(self):
+            # Refill the Treeview with the visible window of view_rows, reusing existing items
+            window = self.view_rows[self.view_offset:self.view_offset + self.page_size + VIEW_BUFFER_ROWS]
+            items = self.tree.get_children()
+            ids = self.data.ids
+            self.item_ids = {}
+            for item, row in zip(items, window):
+                self.tree.item(item, values=self.row_values(row))
+                self.item_ids[item] = ids[row]
+            if len(items) > len(window):
+                self.tree.delete(*items[len(window):])
+            for row in window[len(items):]:
+                self.item_ids[self.tree.insert('', 'end', values=self.row_values(row))] = ids[row]
+            self.tree.selection_set([item for item, transaction_id in self.item_ids.items()
+                                     if transaction_id in self.selected_ids])
+            self.tree.yview_moveto(0)
+
+            total = len(self.view_rows)
+            if total:
+                last = min(total, self.view_offset + self.page_size)
+                self.scrollbar.set(self.view_offset / total, last / total)
+                self.status_var.set(f"Showing {self.view_offset + 1}-{last} of {total} transactions")
+            else:
+                self.scrollbar.set(0, 1)
+                self.status_var.set("No transactions to show")
+            if self.selected_ids:
+                self.status_var.set(f"{self.status_var.get()}, {len(self.selected_ids)} selected")
+            if self.loading:
+                self.status_var.set(f"{self.status_var.get()} (loading {self.load_progress:.0%})")
+
+        def on_select(self, event=None):
+            # Selections outside the visible window are kept; the visible ones follow the Treeview
+            selected = set(self.tree.selection())
+            for item, transaction_id in self.item_ids.items():
+                if item in selected:
+                    self.selected_ids.add(transaction_id)
+                else:
+                    self.selected_ids.discard(transaction_id)
+
+        def scroll_to(self, offset):
+            offset = max(0, min(offset, len(self.view_rows) - self.page_size))
+            if offset != self.view_offset:
+                self.view_offset = offset
+                self.render_rows()
+
+        def on_scroll(self, action, amount, unit=None):
+            # Scrollbar callback: ("moveto", fraction) or ("scroll", count, "units"/"pages")
+            if action == "moveto":
+                self.scroll_to(int(float(amount) * len(self.view_rows)))
+            elif action == "scroll":
+                step = self.page_size if unit == "pages" else 1
+                self.scroll_to(self.view_offset + int(amount) * step)
+
+        def on_mouse_wheel(self, event):
+            if event.num == 4:
+                delta = -3
+            elif event.num == 5:
+                delta = 3
+            else:
+                delta = -3 if event.delta > 0 else 3
+            self.scroll_to(self.view_offset + delta)
+            return "break"  # The Treeview only holds the visible rows, so don't let it scroll itself
+
+        def on_tree_resize(self, event):
+            # Work out how many rows fit now; the header takes roughly one row
+            row_height = int(ttk.Style(self.root).lookup("Treeview", "rowheight") or 20)
+            page_size = max(1, event.height // row_height - 1)
+            if page_size != self.page_size:
+                self.page_size = page_size
+                self.view_offset = max(0, min(self.view_offset, len(self.view_rows) - page_size))
+                self.render_rows()
+
+        def start_loading(self):
+            # Parse on a worker thread; rows only reach self.data through poll_loader on the Tk thread
+            self.loading = True
+            self.load_started = time.perf_counter()
+            self.load_failed = False
+            self.load_queue = queue.Queue(maxsize=4)
+            self.progress.pack(fill=tk.X, padx=6, pady=(0, 6))
+            threading.Thread(target=self.load_worker, daemon=True).start()
+            self.root.after(LOAD_POLL_MS, self.poll_loader)
+
+        def load_worker(self):
+            # Runs on the background thread: only parses and queues, never touches Tk or self.data
+            try:
+                for rows, progress in storage.read_batches():
+                    self.load_queue.put(("rows", rows, progress))
+            except (json.JSONDecodeError, ValueError) as e:
+                self.load_queue.put(("error", f"Error loading data: {e}", 1.0))
+            except Exception as e:
+                self.load_queue.put(("error", f"Unexpected error: {e}", 1.0))
+            self.load_queue.put(("done", None, 1.0))
+
+        def poll_loader(self):
+            try:
+                kind, payload, progress = self.load_queue.get_nowait()
+            except queue.Empty:
+                self.root.after(LOAD_POLL_MS, self.poll_loader)
+                return
+
+            self.load_progress = progress
+            self.progress['value'] = progress * 100
+            if kind == "rows":
+                first_row = len(self.data)
+                self.data.extend_rows(payload)
+                if self.current_search is None and self.sort_state is None:
+                    # Still showing everything in load order, so the new rows simply go on the end
+                    self.view_rows.extend(range(first_row, len(self.data)))
+                self.render_rows()
+            elif kind == "error":
+                print(payload)
+                self.load_failed = True
+                self.data = TransactionStore()
+            elif kind == "done":
+                self.finish_loading()
+                return
+            # Let Tk handle pending events before taking the next batch
+            self.root.after(1, self.poll_loader)
+
+        def finish_loading(self):
+            if not self.load_failed:
+                storage.finish_load(self.data)
+            instrumentation.record("gui load", time.perf_counter() - self.load_started, len(self.data))
+            self.loading = False
+            self.progress.pack_forget()
+            self.refresh_view()
+
+        def load_data(self, filepath=None):
+            # Synchronous load from the configured backend, or from a specific JSON file
+            backend = storage if filepath is None else JsonBackend(filepath)
             try:
-                with open(filepath, 'r') as file:
-                    data = json.load(file)
-                    # Ensure that the data is a dictionary
-                    if isinstance(data, dict):
-                        self.data = data
-                        return data
-                    else:
-                        raise ValueError("Data loaded is not a dictionary.")
-            except (FileNotFoundError, json.JSONDecodeError, ValueError) as e:
+                store = backend.load()
+            except (json.JSONDecodeError, ValueError) as e:
                 print(f"Error loading data: {e}")
-                self.data = {} 
-                return {}  # Return an empty dictionary on error
+                self.data = TransactionStore()
+                return self.data  # Return an empty store on error
             except Exception as e:
                 print(f"Unexpected error: {e}")
-                self.data = {}
-                return {}
+                self.data = TransactionStore()
+                return self.data
+            self.data = store
+            return store
             
         def search_transactions(self):
             search_date = self.search_date_var.get().strip()
             search_type = self.search_type_var.get().strip().lower()
             search_amount = self.search_amount_var.get().strip()
 
-            filtered_data = {}
-            for t_type, categories in self.data.items():
-                if search_type and t_type.lower() != search_type:
-                    continue
-                filtered_categories = {}
-                for category, transactions in categories.items():
-                    filtered_transactions = [
-                        transaction for transaction in transactions
-                        if (search_date == "" or transaction["date"] == search_date) and
-                           (search_amount == "" or str(transaction["amount"]) == search_amount)
-                    ]
-                    if filtered_transactions:
-                        filtered_categories[category] = filtered_transactions
-                if filtered_categories:
-                    filtered_data[t_type] = filtered_categories
-
-            self.display_data(filtered_data)
+            search_from = self.search_from_var.get().strip()
+            search_to = self.search_to_var.get().strip()
+            if search_date:
+                # An exact date is just a one-day range
+                search_from = search_to = search_date
+
+            try:
+                # Compare amounts as numbers so that 50 and 50.0 match
+                amounts = [float(value) if value else None for value in (
+                    search_amount, self.search_min_var.get().strip(), self.search_max_var.get().strip())]
+            except ValueError:
+                messagebox.showerror("Invalid search", "Amounts must be numerical values.")
+                return
+
+            search = (search_type, search_from, search_to, *amounts)
+            try:
+                filtered_rows = self.data.search(*search)
+            except ValueError as e:
+                messagebox.showerror("Invalid search", str(e))
+                return
+
+            self.current_search = search
+            self.display_data(filtered_rows)
 
        
         def reset_search(self):
@@ -491,29 +642,77 @@ class FinanceTrackerApp:
             self.search_date_var.set("")
             self.search_type_var.set("")
             self.search_amount_var.set("")
+            self.search_from_var.set("")
+            self.search_to_var.set("")
+            self.search_min_var.set("")
+            self.search_max_var.set("")
 
             # After resetting the fields, display all transactions again
             self.display_data()  # Call display_data without arguments to use self.data
 
 
+        def show_monthly_report(self):
+            # Totals per month, type and category for the Type and From/To fields, read from
+            # the store's rollups, so the report is as quick for ten years as for one month
+            search_type = self.search_type_var.get().strip().lower()
+            month_from = self.search_from_var.get().strip()[:7]
+            month_to = self.search_to_var.get().strip()[:7]
+            try:
+                lines = self.data.rollups(search_type, month_from, month_to)
+            except ValueError as e:
+                messagebox.showerror("Invalid report", str(e))
+                return
+
+            window = tk.Toplevel(self.root)
+            window.title('Monthly Report (still loading)' if self.loading else 'Monthly Report')
+            columns = ("Month", "Type", "Category", "Total", "Count", "Min", "Max")
+            tree = ttk.Treeview(window, columns=columns, show='headings')
+            for column in columns:
+                tree.heading(column, text=column)
+            scrollbar = ttk.Scrollbar(window, orient=tk.VERTICAL, command=tree.yview)
+            tree.configure(yscrollcommand=scrollbar.set)
+            scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+            tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+            for month, transaction_type, category, total, count, smallest, largest in lines:
+                tree.insert('', tk.END, values=(month, transaction_type.capitalize(), category.capitalize(),
+                                                f"{total:.2f}", count, f"{smallest:.2f}", f"{largest:.2f}"))
+
         def treeview_sort_column(self, col, reverse):
-            l = [(self.tree.set(k, col), k) for k in self.tree.get_children('')]
-            if col == "Amount":
-                l.sort(key=lambda t: float(t[0]), reverse=reverse)
-            else:
-                l.sort(reverse=reverse)
-            for index, (val, k) in enumerate(l):
-                self.tree.move(k, '', index)
+            self.sort_view(col, reverse)
             self.tree.heading(col, command=lambda: self.treeview_sort_column(col, not reverse))
 
+        def sort_view(self, col, reverse):
+            # Sort the model, not the widget: the store keeps a cached ordering per column
+            # and only the visible window is re-rendered afterwards
+            self.view_rows = self.data.sort_rows(self.view_rows, col.lower(), reverse)
+            self.sort_state = (col, reverse)
+            self.view_offset = 0
+            self.render_rows()
+
+
+def load_tkinter():
+    global tk, messagebox, ttk
+    if tk is None:
+        import tkinter as tk
+        from tkinter import messagebox, ttk
 
 def launch_gui():
+    load_tkinter()
     root = tk.Tk()
     app = FinanceTrackerApp(root)
     root.mainloop()
 
 
 
+def show_diagnostics():
+    #Print the live instrumentation counters and what saving has cost so far.
+    print("\nDiagnostics")
+    print(f"Storage backend: {storage.name}")
+    print(f"Transactions loaded: {len(transactions) if transactions_loaded else 'not yet'}")
+    print(f"Changes waiting to be saved: {saver.pending()}")
+    for line in instrumentation.report_lines():
+        print(line)
+
 def main_menu():
     #Handle the main menu interactions for the finance tracker.
     while True:
@@ -525,6 +724,10 @@ def main_menu():
         print("5. Total Summary")
         print("6. Read Bulk Transactions From File")
         print("7. Launch the GUI")
+        print("8. Verify Summary Totals")
+        print("9. Search Transactions")
+        print("10. Diagnostics")
+        print("11. Monthly Report")
         print("0. Exit")
 
         choice = input("Enter your choice: ").strip()
@@ -546,11 +749,27 @@ def main_menu():
             read_bulk_transactions_from_file(filename)
         elif choice == "7":
             launch_gui()
+        elif choice == "8":
+            verify_totals()
+        elif choice == "9":
+            search_transactions()
+        elif choice == "10":
+            show_diagnostics()
+        elif choice == "11":
+            monthly_report()
         elif choice == "0":
             break
         else:
             print("Invalid choice, please try again.")
 
 if __name__ == "__main__":
-    load_transactions()
+    args = instrumentation.configure_from_environment(sys.argv[1:])
+    if args:
+        # A subcommand (add, import, summary, search, export) runs without the menu.
+        import tracker_cli
+        sys.exit(tracker_cli.main(args))
+    instrumentation.add_section("Saving", saver.metrics.report)
+    instrumentation.add_section("Locking", storage.lock.report)
     main_menu()
+    # Write anything still queued before the diagnostics report is produced.
+    saver.flush()
@@ -0,0 +1,292 @@
+import argparse
+import datetime
+import sys
+import time
+
+from storage_backends import get_backend
+from transaction_store import UNDATED_MONTH
+
+# NumPy is optional: without it every analysis runs the same arithmetic in plain Python.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+ROLLING_WINDOWS = (30, 90)
+DEFAULT_PERCENTILES = (50, 90, 99)
+GROUP_FIELDS = ('type', 'category', 'month', 'year')
+
+# Date ordinal of 1970-01-01, where NumPy's datetime64 counts days from.
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+
+def month_label(month_index):
+    #"YYYY-MM" for a count of months since 1970-01.
+    year, month = divmod(int(month_index), 12)
+    return f"{1970 + year:04d}-{month + 1:02d}"
+
+
+def percentile_of_sorted(values, percent):
+    #Linear interpolation between closest ranks, the same rule as numpy.percentile's default.
+    position = (len(values) - 1) * percent / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    low_value = int(values[lower])
+    return low_value + (int(values[upper]) - low_value) * (position - lower)
+
+
+class Analytics:
+    #Grouped sums, rolling averages, percentiles and year-over-year changes over a store.
+    #Amounts are converted to whole cents once, so every sum is exact and the NumPy and
+    #plain Python paths give identical results; amounts come back in currency units.
+    #Rows whose date is not a valid date are left out of anything grouped by date.
+    #Deleted rows (tombstones) are skipped rather than compacted away, so row positions the
+    #caller holds stay valid.
+    def __init__(self, store, use_numpy=None):
+        if use_numpy and numpy is None:
+            raise ValueError("NumPy is not installed.")
+        self.store = store
+        self.use_numpy = numpy is not None if use_numpy is None else use_numpy
+        if self.use_numpy:
+            self.cents = numpy.rint(numpy.frombuffer(store.amounts, dtype=numpy.float64) * 100).astype(numpy.int64)
+            self.dates = numpy.frombuffer(store.dates, dtype=numpy.int32).astype(numpy.int64)
+            self.type_codes = numpy.frombuffer(store.type_codes, dtype=numpy.uint16).astype(numpy.int64)
+            self.category_codes = numpy.frombuffer(store.category_codes, dtype=numpy.uint32).astype(numpy.int64)
+            self.alive = numpy.frombuffer(store.alive, dtype=numpy.uint8).astype(bool)
+            self.dated = (self.dates > 0) & self.alive
+            days = (self.dates - EPOCH_ORDINAL).astype('datetime64[D]')
+            self.months = days.astype('datetime64[M]').astype(numpy.int64)
+        else:
+            self.cents = [round(amount * 100) for amount in store.amounts]
+
+    def _type_codes(self, transaction_type):
+        # Type matching ignores case, as in search.
+        return [code for code, name in enumerate(self.store.type_names)
+                if name.lower() == transaction_type.lower()]
+
+    def _category_code(self, category):
+        names = self.store.category_names
+        return names.index(category) if category in names else -1
+
+    def _mask(self, transaction_type=None, category=None, dated=False):
+        #Boolean array of rows passing the filters (NumPy path only).
+        mask = (self.dated if dated else self.alive).copy()
+        if transaction_type:
+            mask &= numpy.isin(self.type_codes, self._type_codes(transaction_type))
+        if category:
+            mask &= self.category_codes == self._category_code(category)
+        return mask
+
+    def _rows(self, transaction_type=None, category=None, dated=False):
+        #Positions of rows passing the filters (plain Python path only).
+        wanted = set(self._type_codes(transaction_type)) if transaction_type else None
+        category_code = self._category_code(category) if category else None
+        store = self.store
+        for row in store.live_rows():
+            if wanted is not None and store.type_codes[row] not in wanted:
+                continue
+            if category_code is not None and store.category_codes[row] != category_code:
+                continue
+            if dated and store.dates[row] <= 0:
+                continue
+            yield row
+
+    def _grouped_cents(self, fields, transaction_type=None):
+        #{labels: [cents, count]}, labels being one value per field.
+        unknown = set(fields) - set(GROUP_FIELDS)
+        if unknown:
+            raise ValueError(f"Cannot group by {', '.join(sorted(unknown))}. Choose from: {', '.join(GROUP_FIELDS)}.")
+        dated = 'month' in fields or 'year' in fields
+        if not self.use_numpy:
+            store = self.store
+            groups = {}
+            for row in self._rows(transaction_type, dated=dated):
+                month = store.month(row)
+                labels = {'type': store.type_names[store.type_codes[row]],
+                          'category': store.category_names[store.category_codes[row]],
+                          'month': month,
+                          'year': int(month[:4]) if month != UNDATED_MONTH else None}
+                group = groups.setdefault(tuple(labels[field] for field in fields), [0, 0])
+                group[0] += self.cents[row]
+                group[1] += 1
+            return groups
+
+        mask = self._mask(transaction_type, dated=dated)
+        columns = {'type': self.type_codes[mask], 'category': self.category_codes[mask],
+                   'month': self.months[mask]}
+        columns['year'] = columns['month'] // 12
+        # Pack every field into one integer key (mixed radix) and group on that.
+        keys = numpy.zeros(int(mask.sum()), dtype=numpy.int64)
+        radixes = []
+        for field in fields:
+            column = columns[field]
+            low = int(column.min()) if len(column) else 0
+            radix = int(column.max()) - low + 1 if len(column) else 1
+            keys = keys * radix + (column - low)
+            radixes.append((field, low, radix))
+        unique_keys, inverse = numpy.unique(keys, return_inverse=True)
+        # Float weights are exact for integer cents below 2**53.
+        sums = numpy.rint(numpy.bincount(inverse, weights=self.cents[mask])).astype(numpy.int64)
+        counts = numpy.bincount(inverse)
+        names = {'type': self.store.type_names, 'category': self.store.category_names}
+        groups = {}
+        for key, total, count in zip(unique_keys.tolist(), sums.tolist(), counts.tolist()):
+            labels = []
+            for field, low, radix in reversed(radixes):
+                key, value = divmod(key, radix)
+                value += low
+                if field in names:
+                    labels.append(names[field][value])
+                elif field == 'month':
+                    labels.append(month_label(value))
+                else:
+                    labels.append(1970 + value)
+            groups[tuple(reversed(labels))] = [total, count]
+        return groups
+
+    def grouped_sums(self, fields=('type', 'category'), transaction_type=None):
+        #{labels: (total, count)} for every combination of fields that has rows,
+        #e.g. fields=('month', 'category') gives {("2024-03", "rent"): (1200.0, 1), ...}.
+        return {labels: (cents / 100, count)
+                for labels, (cents, count) in sorted(self._grouped_cents(fields, transaction_type).items())}
+
+    def _daily_cents(self, transaction_type=None, category=None):
+        #(first ordinal, cents per day from that day to the last dated row).
+        if self.use_numpy:
+            mask = self._mask(transaction_type, category, dated=True)
+            ordinals = self.dates[mask]
+            if not len(ordinals):
+                return None, []
+            first = int(ordinals.min())
+            daily = numpy.bincount(ordinals - first, weights=self.cents[mask])
+            return first, numpy.rint(daily).astype(numpy.int64).tolist()
+        totals = {}
+        for row in self._rows(transaction_type, category, dated=True):
+            ordinal = self.store.dates[row]
+            totals[ordinal] = totals.get(ordinal, 0) + self.cents[row]
+        if not totals:
+            return None, []
+        first = min(totals)
+        return first, [totals.get(ordinal, 0) for ordinal in range(first, max(totals) + 1)]
+
+    def rolling_averages(self, window=30, transaction_type=None, category=None):
+        #[(date, average per day over the window days ending on date)] for every day from
+        #the first matching transaction to the last. Days before the first one do not count.
+        first, daily = self._daily_cents(transaction_type, category)
+        if first is None:
+            return []
+        if self.use_numpy:
+            running = numpy.concatenate(([0], numpy.cumsum(daily, dtype=numpy.int64)))
+            ends = numpy.arange(1, len(daily) + 1)
+            window_cents = (running[ends] - running[numpy.maximum(ends - window, 0)]).tolist()
+        else:
+            window_cents = []
+            total = 0
+            for day, cents in enumerate(daily):
+                total += cents
+                if day >= window:
+                    total -= daily[day - window]
+                window_cents.append(total)
+        return [(datetime.date.fromordinal(first + day).isoformat(), round(cents / min(day + 1, window) / 100, 2))
+                for day, cents in enumerate(window_cents)]
+
+    def percentiles(self, percents=DEFAULT_PERCENTILES, transaction_type=None):
+        #{(type, category): [amount at each percent]} over individual transaction amounts.
+        store = self.store
+        results = {}
+        if self.use_numpy:
+            mask = self._mask(transaction_type)
+            groups = self.type_codes[mask] * len(store.category_names) + self.category_codes[mask]
+            cents = self.cents[mask]
+            low = int(cents.min()) if len(cents) else 0
+            span = int(cents.max()) - low + 1 if len(cents) else 1
+            if (int(groups.max()) + 1 if len(groups) else 1) * span < 2 ** 62:
+                # One sort of a packed (group, amount) key is several times quicker than lexsort.
+                packed = numpy.sort(groups * span + (cents - low))
+                sorted_groups, sorted_cents = numpy.divmod(packed, span)
+                sorted_cents += low
+            else:
+                order = numpy.lexsort((cents, groups))
+                sorted_groups = groups[order]
+                sorted_cents = cents[order]
+            unique_groups, starts = numpy.unique(sorted_groups, return_index=True)
+            ends = list(starts[1:]) + [len(sorted_groups)]
+            for group, start, end in zip(unique_groups.tolist(), starts.tolist(), ends):
+                type_code, category_code = divmod(group, len(store.category_names))
+                values = sorted_cents[start:end]
+                results[(store.type_names[type_code], store.category_names[category_code])] = values
+        else:
+            values = {}
+            for row in self._rows(transaction_type):
+                key = (store.type_names[store.type_codes[row]], store.category_names[store.category_codes[row]])
+                values.setdefault(key, []).append(self.cents[row])
+            results = {key: sorted(amounts) for key, amounts in values.items()}
+        return {key: [round(percentile_of_sorted(amounts, percent) / 100, 2) for percent in percents]
+                for key, amounts in sorted(results.items())}
+
+    def year_over_year(self, transaction_type=None):
+        #{(type, category): [(year, total, change from the year before, change in percent)]}.
+        #The changes are None for a category's first year; the percent is None after a zero year.
+        by_group = {}
+        for (type_name, category, year), (cents, _) in sorted(
+                self._grouped_cents(('type', 'category', 'year'), transaction_type).items()):
+            by_group.setdefault((type_name, category), {})[year] = cents
+        results = {}
+        for key, years in by_group.items():
+            lines = []
+            for year in range(min(years), max(years) + 1):
+                cents = years.get(year, 0)
+                previous = years.get(year - 1, 0) if year > min(years) else None
+                delta = None if previous is None else cents - previous
+                percent = round(delta / previous * 100, 1) if previous else None
+                lines.append((year, cents / 100, None if delta is None else delta / 100, percent))
+            results[key] = lines
+        return results
+
+
+def print_report(analytics, transaction_type=None, percents=DEFAULT_PERCENTILES):
+    print("Totals by type and category:")
+    for (type_name, category), (total, count) in analytics.grouped_sums(transaction_type=transaction_type).items():
+        print(f"  {type_name.capitalize():<10} {category:<20} {total:>16.2f} {count:>9}")
+
+    print("\nRolling daily averages (as of the last transaction):")
+    for window in ROLLING_WINDOWS:
+        averages = analytics.rolling_averages(window, transaction_type)
+        if averages:
+            date, average = averages[-1]
+            print(f"  {window}-day average to {date}: {average:.2f}")
+
+    print(f"\nPercentiles ({', '.join(f'p{percent:g}' for percent in percents)}):")
+    for (type_name, category), values in analytics.percentiles(percents, transaction_type).items():
+        print(f"  {type_name.capitalize():<10} {category:<20} " + " ".join(f"{value:>12.2f}" for value in values))
+
+    print("\nYear over year:")
+    for (type_name, category), lines in analytics.year_over_year(transaction_type).items():
+        print(f"  {type_name.capitalize()} / {category}")
+        for year, total, delta, percent in lines:
+            change = "" if delta is None else f" {delta:+.2f}"
+            change += "" if percent is None else f" ({percent:+.1f}%)"
+            print(f"    {year}: {total:.2f}{change}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyse the saved transactions.")
+    parser.add_argument('--backend', help="storage backend to read (default: the configured one)")
+    parser.add_argument('--type', help="only analyse this transaction type")
+    parser.add_argument('--percentiles', type=float, nargs='+', default=DEFAULT_PERCENTILES)
+    parser.add_argument('--pure-python', action='store_true', help="do not use NumPy even if it is installed")
+    options = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    store = get_backend(options.backend).load()
+    loaded = time.perf_counter()
+    analytics = Analytics(store, use_numpy=False if options.pure_python else None)
+    print_report(analytics, options.type, options.percentiles)
+    print(f"\nLoaded {len(store)} transaction(s) in {loaded - started:.2f}s, analysed in "
+          f"{time.perf_counter() - loaded:.2f}s ({'NumPy' if analytics.use_numpy else 'pure Python'}).",
+          file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,311 @@
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from array import array
+
+from save_manager import SaveManager
+from storage_backends import get_backend
+from transaction_store import TransactionStore
+
+# Names the generator draws categories from; more are made up by adding letter suffixes.
+INCOME_CATEGORIES = ['salary', 'freelance', 'interest', 'dividends', 'refunds', 'gifts']
+EXPENSE_CATEGORIES = ['groceries', 'rent', 'utilities', 'transport', 'dining', 'health',
+                      'insurance', 'entertainment', 'clothing', 'travel', 'education', 'subscriptions']
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+# A benchmark counts as a regression when its best time gets this much slower than the
+# baseline's, and by more than the noise floor (fsync latency alone varies by milliseconds).
+REGRESSION_RATIO = 1.25
+REGRESSION_NOISE_SECONDS = 0.005
+
+# The scripting command line, timed as a fresh process to catch start-up regressions.
+CLI_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tracker_cli.py')
+
+def category_names(pool, count):
+    #count alphabetic category names, starting with the realistic ones in pool.
+    names = list(pool[:count])
+    suffix = 0
+    while len(names) < count:
+        suffix += 1
+        letters = ''
+        number = suffix
+        while number:
+            number, remainder = divmod(number - 1, 26)
+            letters = chr(ord('a') + remainder) + letters
+        names.extend(name + letters for name in pool[:count - len(names)])
+    return names
+
+
+def generate_transactions(count, categories=12, days=3650, end=None, income_share=0.3, seed=1):
+    #Return count synthetic (type, category, amount, date) rows in date order.
+    #Income is rarer and larger than expenses; amounts are whole cents.
+    rng = random.Random(seed)
+    end = end or datetime.date.today() - datetime.timedelta(days=1)
+    start = end.toordinal() - days + 1
+    income_names = category_names(INCOME_CATEGORIES, max(1, categories // 4))
+    expense_names = category_names(EXPENSE_CATEGORIES, max(1, categories - len(income_names)))
+    rows = []
+    for _ in range(count):
+        date = datetime.date.fromordinal(rng.randint(start, end.toordinal())).isoformat()
+        if rng.random() < income_share:
+            rows.append(('income', rng.choice(income_names), round(rng.lognormvariate(7, 0.8), 2), date))
+        else:
+            rows.append(('expense', rng.choice(expense_names), round(rng.lognormvariate(3.5, 1.1), 2) or 0.01, date))
+    rows.sort(key=lambda row: row[3])
+    return rows
+
+
+def write_json_dataset(rows, filepath):
+    #Write rows in the nested transactions.json layout.
+    nested = {}
+    for transaction_type, category, amount, date in rows:
+        nested.setdefault(transaction_type, {}).setdefault(category, []).append({"amount": amount, "date": date})
+    with open(filepath, 'w') as file:
+        json.dump(nested, file, indent=4)
+
+
+def write_csv_dataset(rows, filepath):
+    #Write rows as "type,category,amount,date" lines for Read Bulk Transactions From File.
+    with open(filepath, 'w') as file:
+        for transaction_type, category, amount, date in rows:
+            file.write(f"{transaction_type},{category},{amount},{date}\n")
+
+
+class HeadlessTree:
+    #Just enough of ttk.Treeview for FinanceTrackerApp to render into without a display.
+    def __init__(self):
+        self.items = {}
+        self.next_id = 0
+        self.selected = ()
+
+    def get_children(self, item=''):
+        return tuple(self.items)
+
+    def insert(self, parent, index, values=()):
+        self.next_id += 1
+        item = f"I{self.next_id}"
+        self.items[item] = tuple(values)
+        return item
+
+    def item(self, item, values=None):
+        if values is not None:
+            self.items[item] = tuple(values)
+        return {'values': self.items[item]}
+
+    def delete(self, *items):
+        for item in items:
+            del self.items[item]
+
+    def heading(self, *args, **kwargs):
+        pass
+
+    def selection(self):
+        return self.selected
+
+    def selection_set(self, items):
+        self.selected = tuple(items)
+
+    def yview_moveto(self, fraction):
+        pass
+
+
+class HeadlessVar:
+    def __init__(self, value=''):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+    def set(self, value):
+        self.value = value
+
+
+class HeadlessScrollbar:
+    def set(self, first, last):
+        pass
+
+
+def headless_app(tracker, store):
+    #A FinanceTrackerApp wired to stand-in widgets, showing store.
+    app = object.__new__(tracker.FinanceTrackerApp)
+    app.root = None
+    app.data = store
+    app.tree = HeadlessTree()
+    app.scrollbar = HeadlessScrollbar()
+    app.status_var = HeadlessVar()
+    for name in ('date', 'type', 'amount', 'from', 'to', 'min', 'max'):
+        setattr(app, f"search_{name}_var", HeadlessVar())
+    app.view_rows = array('I')
+    app.view_offset = 0
+    app.page_size = 20
+    app.selected_ids = set()
+    app.item_ids = {}
+    app.current_search = None
+    app.sort_state = None
+    app.loading = False
+    app.load_progress = 0.0
+    return app
+
+
+def time_call(function, repeat, setup=None):
+    #Run function repeat times (after setup, which is not timed) and return the durations.
+    durations = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        with contextlib.redirect_stdout(io.StringIO()):
+            started = time.perf_counter()
+            function()
+            durations.append(time.perf_counter() - started)
+    return durations
+
+
+def run_size(tracker, size, options):
+    #Run every benchmark against a fresh size-row dataset in a scratch directory.
+    rows = generate_transactions(size, options.categories, options.days, None, options.income_share, options.seed)
+    import_rows = generate_transactions(max(1, size // 10), options.categories, options.days, None,
+                                        options.income_share, options.seed + 1)
+    timings = {}
+    with tempfile.TemporaryDirectory() as directory:
+        previous = os.getcwd()
+        os.chdir(directory)
+        try:
+            write_csv_dataset(import_rows, 'import.csv')
+            tracker.storage = get_backend(options.backend)
+            # Saves are timed synchronously rather than coalesced in the background.
+            tracker.saver = SaveManager(tracker.storage, quiet_period=0)
+
+            def reset():
+                # Put back the generated dataset, undoing anything an earlier run imported.
+                store = TransactionStore()
+                store.extend_rows(rows)
+                tracker.storage.save(store)
+                tracker.load_transactions()
+
+            reset()
+            timings['load_transactions'] = time_call(tracker.load_transactions, options.repeat)
+            timings['save_transactions'] = time_call(tracker.save_transactions, options.repeat)
+            timings['read_bulk_transactions_from_file'] = time_call(
+                lambda: tracker.read_bulk_transactions_from_file('import.csv', parallel=False),
+                options.repeat, setup=reset)
+            reset()
+            timings['total_summary'] = time_call(tracker.total_summary, options.repeat)
+            # Start-up included: interpreter, imports and whatever the backend reads for a summary.
+            timings['cli_summary_cold_start'] = time_call(
+                lambda: subprocess.run([sys.executable, CLI_SCRIPT, '--backend', options.backend, 'summary'],
+                                       check=True, capture_output=True), options.repeat)
+
+            app = headless_app(tracker, tracker.transactions)
+            month_start = rows[len(rows) // 2][3][:8] + '01'
+            month_end = (datetime.date.fromisoformat(month_start) + datetime.timedelta(days=30)).isoformat()
+
+            def gui_search():
+                app.search_type_var.set('expense')
+                app.search_from_var.set(month_start)
+                app.search_to_var.set(month_end)
+                app.search_min_var.set('10')
+                app.search_max_var.set('500')
+                app.search_transactions()
+
+            timings['gui_search_transactions'] = time_call(gui_search, options.repeat)
+            timings['gui_display_data'] = time_call(app.display_data, options.repeat)
+        finally:
+            os.chdir(previous)
+    return [{"benchmark": name, "size": size, "seconds": durations,
+             "min": min(durations), "median": statistics.median(durations)}
+            for name, durations in timings.items()]
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_results(baseline, current, ratio=REGRESSION_RATIO):
+    #Lines comparing best timings with a baseline run, and whether any regressed past ratio.
+    previous = {(result["benchmark"], result["size"]): result["min"] for result in baseline["results"]}
+    lines = []
+    regressed = False
+    for result in current["results"]:
+        before = previous.get((result["benchmark"], result["size"]))
+        if not before:
+            continue
+        change = result["min"] / before
+        flag = ''
+        if change > ratio and result["min"] - before > REGRESSION_NOISE_SECONDS:
+            flag = '  REGRESSION'
+            regressed = True
+        lines.append(f"{result['benchmark']:<34} {result['size']:>9} {before * 1000:>10.1f} ms "
+                     f"-> {result['min'] * 1000:>10.1f} ms  x{change:.2f}{flag}")
+    return lines, regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the finance tracker on synthetic datasets.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="transactions per dataset")
+    parser.add_argument('--categories', type=int, default=12, help="number of categories")
+    parser.add_argument('--days', type=int, default=3650, help="date span in days, ending yesterday")
+    parser.add_argument('--income-share', type=float, default=0.3, help="fraction of income transactions")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per benchmark")
+    parser.add_argument('--backend', default='json', help="storage backend to benchmark")
+    parser.add_argument('--output', help="write results JSON here (default: stdout)")
+    parser.add_argument('--compare', help="baseline results JSON to compare against")
+    parser.add_argument('--generate', metavar='PREFIX',
+                        help="only write PREFIX.json and PREFIX.csv datasets of the first size")
+    options = parser.parse_args(argv)
+
+    if options.generate:
+        rows = generate_transactions(options.sizes[0], options.categories, options.days, None,
+                                     options.income_share, options.seed)
+        write_json_dataset(rows, options.generate + '.json')
+        write_csv_dataset(rows, options.generate + '.csv')
+        return 0
+
+    import Enhanced_Personal_Finance_Tracker as tracker
+
+    results = []
+    for size in options.sizes:
+        print(f"Benchmarking {size} transactions...", file=sys.stderr)
+        results.extend(run_size(tracker, size, options))
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": datetime.datetime.now().isoformat(timespec='seconds'),
+        "parameters": {"categories": options.categories, "days": options.days,
+                       "income_share": options.income_share, "seed": options.seed,
+                       "repeat": options.repeat, "backend": options.backend},
+        "results": results,
+    }
+    text = json.dumps(report, indent=4)
+    if options.output:
+        with open(options.output, 'w') as file:
+            file.write(text + '\n')
+    else:
+        print(text)
+
+    if options.compare:
+        with open(options.compare, 'r') as file:
+            lines, regressed = compare_results(json.load(file), report)
+        print('\n'.join(lines), file=sys.stderr)
+        return 1 if regressed else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,257 @@
+import contextlib
+import io
+import itertools
+import locale
+import math
+import os
+import time
+from array import array
+
+from instrumentation import timed
+from transaction_validation import (parse_amount, parse_date, validate_category,
+                                    validate_transaction_type)
+
+# Number of lines parsed and added to the store per chunk.
+CHUNK_SIZE = 10000
+
+# Files at least this large are imported with several worker processes by default.
+PARALLEL_THRESHOLD_BYTES = 64 * 1024 * 1024
+
+# Upper bound on the bytes one worker parses at a time in parallel mode.
+RANGE_BYTES = 32 * 1024 * 1024
+
+
+def parse_transaction_line(line):
+    #Parse one "type,category,amount,date" line with the same rules as add_transaction.
+    #Returns ((type, category, amount, date), "") or (None, reason).
+    parts = line.strip().split(',')
+    if len(parts) != 4:
+        return None, "Expected 4 comma-separated fields: type,category,amount,date."
+
+    transaction_type = parts[0].strip().lower()
+    is_valid, message = validate_transaction_type(transaction_type)
+    if not is_valid:
+        return None, message
+
+    category = parts[1].strip().lower()
+    is_valid, message = validate_category(category)
+    if not is_valid:
+        return None, message
+
+    amount, message = parse_amount(parts[2].strip())
+    if amount is None:
+        return None, message
+
+    date, message = parse_date(parts[3].strip())
+    if date is None:
+        return None, message
+
+    return (transaction_type, category, amount, date), ""
+
+
+def parse_lines(lines, first_line_number):
+    #Parse a chunk of lines. Blank lines are ignored.
+    #Returns (rows, errors) where errors are (line number, reason, line text).
+    rows = []
+    errors = []
+    for line_number, line in enumerate(lines, first_line_number):
+        if not line.strip():
+            continue
+        row, message = parse_transaction_line(line)
+        if row is None:
+            errors.append((line_number, message, line.strip()))
+        else:
+            rows.append(row)
+    return rows, errors
+
+
+def encode_rows(rows):
+    #Pack parsed rows into compact columns with chunk-local name and date tables, plus each
+    #type/category group's rows and sum, so merging a batch does not have to visit every row.
+    #This is what worker processes send back, so it has to be cheap to pickle.
+    batch = {
+        "amounts": array('d'),
+        "type_codes": array('H'), "type_names": [],
+        "category_codes": array('I'), "category_names": [],
+        "date_codes": array('I'), "date_texts": [],
+        "group_rows": {}, "group_sums": {},
+    }
+    lookups = {"type": {}, "category": {}, "date": {}}
+
+    def code_for(kind, names, value):
+        code = lookups[kind].get(value)
+        if code is None:
+            code = len(names)
+            names.append(value)
+            lookups[kind][value] = code
+        return code
+
+    group_rows = batch["group_rows"]
+    for row, (transaction_type, category, amount, date) in enumerate(rows):
+        batch["amounts"].append(amount)
+        key = (code_for("type", batch["type_names"], transaction_type),
+               code_for("category", batch["category_names"], category))
+        batch["type_codes"].append(key[0])
+        batch["category_codes"].append(key[1])
+        batch["date_codes"].append(code_for("date", batch["date_texts"], date))
+        if key not in group_rows:
+            group_rows[key] = array('I')
+        group_rows[key].append(row)
+    amounts = batch["amounts"]
+    for key, group in group_rows.items():
+        batch["group_sums"][key] = math.fsum(amounts[row] for row in group)
+    return batch
+
+
+def split_file(filename, parts):
+    #Split a file into up to `parts` byte ranges whose boundaries fall just after a newline.
+    size = os.path.getsize(filename)
+    offsets = [0]
+    with open(filename, 'rb') as file:
+        for i in range(1, parts):
+            target = size * i // parts
+            if target <= offsets[-1]:
+                continue
+            file.seek(target - 1)
+            file.readline()  # Finish the line the target falls in
+            position = file.tell()
+            if position >= size:
+                break
+            if position > offsets[-1]:
+                offsets.append(position)
+    offsets.append(size)
+    return list(zip(offsets, offsets[1:]))
+
+
+def parse_range(filename, start, end):
+    #Worker entry point: parse the lines between two newline-aligned byte offsets.
+    #Line numbers in the returned errors are relative to the start of the range.
+    with open(filename, 'rb') as file:
+        file.seek(start)
+        data = file.read(end - start)
+    # Decode and split lines exactly as the serial path's text-mode open() would.
+    text = io.StringIO(data.decode(locale.getpreferredencoding(False)), newline=None)
+    lines = text.readlines()
+    rows, errors = parse_lines(lines, 1)
+    return encode_rows(rows), errors, len(lines)
+
+
+def error_report_path(filename):
+    return filename + '.errors.txt'
+
+
+class ErrorReport:
+    #Writes rejected lines next to the input file as they are found.
+    #The report file is only created once there is something to put in it, and a report
+    #left by an earlier import of the same file is removed when this one rejects nothing.
+    def __init__(self, filename):
+        self.path = error_report_path(filename)
+        self.count = 0
+        self._file = None
+
+    def write(self, errors):
+        if not errors:
+            return
+        if self._file is None:
+            self._file = open(self.path, 'w')
+        for line_number, message, text in errors:
+            self._file.write(f"line {line_number}: {message} | {text}\n")
+        self.count += len(errors)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        else:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self.path)
+
+
+@timed("import", rows=lambda result, *args, **kwargs: result["imported"])
+def import_transactions(filename, store, parallel=None, workers=None, chunk_size=CHUNK_SIZE):
+    #Import a bulk file into the store. parallel=None picks worker processes for large files.
+    if parallel is None:
+        parallel = os.path.getsize(filename) >= PARALLEL_THRESHOLD_BYTES
+    if parallel:
+        return import_transactions_parallel(filename, store, workers)
+    return import_transactions_serial(filename, store, chunk_size)
+
+
+def import_transactions_serial(filename, store, chunk_size=CHUNK_SIZE):
+    #Stream a bulk file into the store chunk by chunk.
+    #Nothing is persisted here; on an unexpected error the store is rolled back.
+    started = time.perf_counter()
+    first_row = len(store.amounts)
+    lines = 0
+    report = ErrorReport(filename)
+    try:
+        with open(filename, 'r') as file:
+            while True:
+                chunk = list(itertools.islice(file, chunk_size))
+                if not chunk:
+                    break
+                rows, errors = parse_lines(chunk, lines + 1)
+                lines += len(chunk)
+                report.write(errors)
+                # Indexes are rebuilt once on next use rather than taking an insert per row.
+                store.extend_rows(rows)
+        # Recount the totals exactly, as loading does, so both import paths agree to the last bit.
+        store.rebuild_totals()
+    except Exception:
+        store.truncate(first_row)
+        raise
+    finally:
+        report.close()
+    return import_result(filename, store, first_row, lines, report, started)
+
+
+def import_transactions_parallel(filename, store, workers=None):
+    #Parse newline-aligned byte ranges of the file in worker processes and merge
+    #the results in file order, so the store ends up exactly as the serial import leaves it.
+    started = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    size = os.path.getsize(filename)
+    parts = max(workers, -(-size // RANGE_BYTES))
+    ranges = split_file(filename, parts)
+
+    first_row = len(store.amounts)
+    lines = 0
+    report = ErrorReport(filename)
+    # concurrent.futures is slow to import, so only parallel imports load it.
+    from concurrent.futures import ProcessPoolExecutor
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(parse_range, [filename] * len(ranges),
+                                   [start for start, _ in ranges], [end for _, end in ranges])
+            for batch, errors, line_count in results:
+                report.write([(lines + line_number, message, text)
+                              for line_number, message, text in errors])
+                lines += line_count
+                store.extend_encoded(**batch)
+        store.rebuild_totals()
+    except Exception:
+        store.truncate(first_row)
+        raise
+    finally:
+        report.close()
+    return import_result(filename, store, first_row, lines, report, started)
+
+
+def import_result(filename, store, first_row, lines, report, started):
+    seconds = time.perf_counter() - started
+    return {
+        "file": filename,
+        "lines": lines,
+        "imported": len(store.amounts) - first_row,
+        "rejected": report.count,
+        "seconds": seconds,
+        "rows_per_second": lines / seconds if seconds > 0 else 0.0,
+        "error_report": report.path if report.count else None,
+    }
+
+
+def print_import_summary(result):
+    print(f"Read {result['lines']} line(s) from {result['file']} in {result['seconds']:.2f}s "
+          f"({result['rows_per_second']:,.0f} rows/s).")
+    print(f"Imported: {result['imported']}, Rejected: {result['rejected']}")
+    if result['error_report']:
+        print(f"Rejected lines were written to {result['error_report']}")
@@ -0,0 +1,192 @@
+import atexit
+import contextlib
+import datetime
+import functools
+import io
+import os
+import threading
+import time
+
+# cProfile, pstats and tracemalloc are only imported once a mode asks for them, so the
+# tracker starts as quickly with this module loaded as without it.
+
+# Turns instrumentation on, e.g. FINANCE_TRACKER_PROFILE=1 or =cprofile,tracemalloc.
+PROFILE_ENV_VAR = 'FINANCE_TRACKER_PROFILE'
+# Where the report is written at exit (override with FINANCE_TRACKER_PROFILE_REPORT).
+REPORT_ENV_VAR = 'FINANCE_TRACKER_PROFILE_REPORT'
+REPORT_FILE = 'finance_tracker_report.txt'
+
+# "timing" collects the counters; the other modes add a profiler on top.
+MODES = ('timing', 'cprofile', 'tracemalloc')
+
+# Rows of profiler and allocation output included in the report.
+REPORT_TOP_FUNCTIONS = 30
+REPORT_TOP_ALLOCATIONS = 15
+
+enabled = False
+modes = set()
+counters = {}
+_lock = threading.Lock()
+_profiler = None
+_sections = []
+_report_file = REPORT_FILE
+
+
+class Counter:
+    #Calls, time and rows handled for one instrumented operation.
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.rows = 0
+
+
+class Sample:
+    #Handed out by measure(); set rows to record how many rows the block handled.
+    rows = None
+
+
+def record(name, seconds, rows=None):
+    if not enabled:
+        return
+    with _lock:
+        counter = counters.get(name)
+        if counter is None:
+            counter = counters[name] = Counter()
+        counter.calls += 1
+        counter.seconds += seconds
+        counter.max_seconds = max(counter.max_seconds, seconds)
+        if rows:
+            counter.rows += rows
+
+
+def timed(name, rows=None):
+    #Decorator counting calls to a function and the time spent in it under name.
+    #rows(result, *args, **kwargs) returns the number of rows the call handled.
+    #Costs one flag check per call while instrumentation is off.
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            started = time.perf_counter()
+            result = function(*args, **kwargs)
+            record(name, time.perf_counter() - started, rows(result, *args, **kwargs) if rows else None)
+            return result
+        return wrapper
+    return decorate
+
+
+@contextlib.contextmanager
+def measure(name):
+    #Time a block under name.
+    sample = Sample()
+    if not enabled:
+        yield sample
+        return
+    started = time.perf_counter()
+    yield sample
+    record(name, time.perf_counter() - started, sample.rows)
+
+
+def add_section(title, lines):
+    #Include lines() (a list of strings) under title in reports and Diagnostics.
+    _sections.append((title, lines))
+
+
+def configure(requested_modes=('timing',), report_file=None):
+    #Switch instrumentation on for the rest of the run and write a report at exit.
+    global enabled, _profiler, _report_file
+    unknown = set(requested_modes) - set(MODES)
+    if unknown:
+        raise ValueError(f"Unknown profiling mode(s): {', '.join(sorted(unknown))}. "
+                         f"Choose from: {', '.join(MODES)}.")
+    if enabled:
+        return
+    enabled = True
+    modes.update(requested_modes)
+    modes.add('timing')
+    _report_file = report_file or os.environ.get(REPORT_ENV_VAR) or REPORT_FILE
+    if 'tracemalloc' in modes:
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+    if 'cprofile' in modes:
+        import cProfile
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+    atexit.register(write_report)
+
+
+def configure_from_environment(argv=()):
+    #Turn instrumentation on if --profile[=modes] is in argv or the environment variable is set.
+    #Returns argv without the flag.
+    spec = os.environ.get(PROFILE_ENV_VAR)
+    remaining = []
+    for arg in argv:
+        if arg == '--profile':
+            spec = 'timing'
+        elif arg.startswith('--profile='):
+            spec = arg.split('=', 1)[1]
+        else:
+            remaining.append(arg)
+    if spec and spec.lower() not in ('0', 'false', 'no', 'off'):
+        requested = [mode.strip().lower() for mode in spec.split(',') if mode.strip()]
+        configure([mode for mode in requested if mode not in ('1', 'true', 'yes', 'on')] or ['timing'])
+    return remaining
+
+
+def counter_lines():
+    if not enabled:
+        return [f"Instrumentation is off. Start with --profile or set {PROFILE_ENV_VAR}=1."]
+    with _lock:
+        snapshot = sorted(counters.items())
+    if not snapshot:
+        return ["Nothing has been measured yet."]
+    lines = [f"{'operation':<22} {'calls':>7} {'total ms':>11} {'avg ms':>9} {'max ms':>9} {'rows':>10}"]
+    for name, counter in snapshot:
+        lines.append(f"{name:<22} {counter.calls:>7} {counter.seconds * 1000:>11.1f} "
+                     f"{counter.seconds / counter.calls * 1000:>9.2f} {counter.max_seconds * 1000:>9.2f} "
+                     f"{counter.rows:>10}")
+    return lines
+
+
+def memory_lines():
+    if 'tracemalloc' not in modes:
+        return []
+    import tracemalloc
+    current, peak = tracemalloc.get_traced_memory()
+    return [f"Traced memory: current {current / 1024 / 1024:.1f} MiB, peak {peak / 1024 / 1024:.1f} MiB"]
+
+
+def report_lines():
+    #Live counters and registered sections, as shown by the Diagnostics menu entry.
+    lines = ["Operation counters:"] + ["  " + line for line in counter_lines()]
+    for title, section in _sections:
+        lines.append(f"{title}:")
+        lines.extend("  " + line for line in section())
+    lines.extend(memory_lines())
+    return lines
+
+
+def write_report(path=None):
+    #Write the counters plus any profiler and allocation statistics to the report file.
+    path = path or _report_file
+    lines = [f"Finance tracker diagnostics, {datetime.datetime.now().isoformat(timespec='seconds')}",
+             f"Modes: {', '.join(sorted(modes)) or 'off'}", ""]
+    lines.extend(report_lines())
+    if _profiler is not None:
+        _profiler.disable()
+        import pstats
+        output = io.StringIO()
+        pstats.Stats(_profiler, stream=output).sort_stats('cumulative').print_stats(REPORT_TOP_FUNCTIONS)
+        lines.extend(["", "cProfile (by cumulative time):", output.getvalue()])
+    if 'tracemalloc' in modes:
+        import tracemalloc
+        lines.extend(["", "Top allocation sites:"])
+        for statistic in tracemalloc.take_snapshot().statistics('lineno')[:REPORT_TOP_ALLOCATIONS]:
+            lines.append(f"  {statistic}")
+    with open(path, 'w') as file:
+        file.write('\n'.join(lines) + '\n')
+    print(f"Diagnostics report written to {path}")
+    return path
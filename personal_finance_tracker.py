@@ -1,276 +1,173 @@
-import json
-import datetime
+import itertools
+import sys
+import instrumentation
+from bulk_import import import_transactions, print_import_summary
+from save_manager import SaveManager
+from storage_backends import get_backend
+from transaction_batch import BatchError, add_many, delete_many, update_many
+from transaction_store import LOAD_BATCH_SIZE, TransactionStore
+from transaction_validation import (parse_amount, parse_date, validate_category,
+                                    validate_date, validate_transaction_type)
 
 
 
-# Global dictionary to store transactions
-transactions = {}
+# Global store holding all transactions
+transactions = TransactionStore()
 
-def validate_date(date_text):
-    try:
-        # Attempt to parse the input date and compare it to today's date.
-        input_date = datetime.datetime.strptime(date_text, '%Y-%m-%d').date()
-        current_date = datetime.date.today()
-        if input_date > current_date:
-            # Future dates are not allowed.
-            return False, "Date cannot be in the future."
-        return True, ""
-    except ValueError:
-        # Handle cases where the date format is incorrect.
-        return False, "Invalid date or format. Please enter the date in (YYYY-MM-DD) format."
+# Where transactions are persisted (transactions.json unless FINANCE_TRACKER_BACKEND says otherwise)
+storage = get_backend()
+
+# Coalesces bursts of changes into one write; anything still queued is written at exit
+saver = SaveManager(storage)
 
+# Set once the full store has been loaded; until then summaries and searches go to the backend
+transactions_loaded = False
+
+@instrumentation.timed("load", rows=lambda result: len(transactions))
 def load_transactions():
-    #Load transaction data from a JSON file.
-    global transactions
-    try:
-        with open('transactions.json', 'r') as file:
-            transactions = json.load(file)
-    except FileNotFoundError:
-        transactions = {}
+    #Load transaction data from the configured storage backend.
+    global transactions, transactions_loaded
+    transactions = storage.load(on_batch=show_load_progress)
+    transactions_loaded = True
+
+def ensure_loaded():
+    #Load the full store the first time something needs it.
+    if not transactions_loaded:
+        load_transactions()
+
+def show_load_progress(loaded, progress):
+    #Progress line for files that take more than one batch to load.
+    if loaded > LOAD_BATCH_SIZE:
+        print(f"Loading transactions... {int(progress * 100)}%", end='\r' if progress < 1 else '\n', flush=True)
 
 def save_transactions():
-    #Save the current transactions to a JSON file.
-    with open('transactions.json', 'w') as file:
-        json.dump(transactions, file, indent=4)
+    #Write a full snapshot of the current transactions to the storage backend now.
+    with saver.lock:
+        saver.save(transactions)
+        saver.flush()
 
 def add_transaction():
     #Add a new transaction after collecting input from the user.
     while True:
         transaction_type = input("Enter the transaction type (Income/Expense): ").lower().strip()
-        if not transaction_type:
-            print("Transaction type cannot be empty.")
-            continue
-        if transaction_type not in ['income', 'expense']:
-            print("Invalid transaction type. Please enter 'Income' or 'Expense'.")
+        is_valid, message = validate_transaction_type(transaction_type)
+        if not is_valid:
+            print(message)
             continue
         break
 
     while True:
         category = input("Enter the transaction category: ").lower().strip()
-        if not category:
-            print("Category cannot be empty.")
-            continue
-        if not category.isalpha():
-            print("Category name must consist of alphabetic characters only.")
+        is_valid, message = validate_category(category)
+        if not is_valid:
+            print(message)
             continue
         break
 
     while True:
-        input_str = input("Enter the transaction amount: ").strip()
-        if not input_str:
-            print("Amount cannot be empty.")
+        amount, message = parse_amount(input("Enter the transaction amount: ").strip())
+        if amount is None:
+            print(message)
             continue
-        try:
-            amount = float(input_str)
-            if amount <= 0:
-                print("Amount must be greater than 0. Please try again.")
-                continue
-            break
-        except ValueError:
-            print("Invalid amount. Please enter a numerical value.")
+        break
 
     while True:
         date = input("Please enter the transaction date in the format (YYYY-MM-DD): ").strip()
         if not date:
             print("Date cannot be empty.")
             continue
-        is_valid, message = validate_date(date)
-        if not is_valid:
-            print(message)  # Print the error message returned from validate_date
+        date, message = parse_date(date)
+        if date is None:
+            print(message)  # Print the error message returned from parse_date
             continue
         break  # If is_valid is True, break out of the loop
 
-    # Initialize the transaction_type key if it doesn't exist
-    if transaction_type not in transactions:
-        transactions[transaction_type] = {}
-
-    transaction = {"amount": amount, "date": date}
-
-    if category in transactions[transaction_type]:
-        transactions[transaction_type][category].append(transaction)
-    else:
-        transactions[transaction_type][category] = [transaction]
-
-    save_transactions()
+    ensure_loaded()
+    add_many(transactions, saver, [(transaction_type, category, amount, date)], flush=False)
     print("Transaction added successfully.")
 
 
 def view_transactions():
     #Display all stored transactions.
+    ensure_loaded()
     if not transactions:
         print("No transactions available to view.")
         return
-    for transaction_type, categories in transactions.items():
+    for transaction_type in transactions.types():
         print(f"Transaction type: {transaction_type.capitalize()}")
-        if isinstance(categories, dict):  # Check if categories is a dictionary
-            for category, transaction_list in categories.items():
-                print(f"\tCategory: {category}")
-                for transaction in transaction_list:
-                    print(f"\t\tAmount: {transaction['amount']}, Date: {transaction['date']}")
-        elif isinstance(categories, list):  # Check if categories is a list
-            for transaction in categories:
-                print(f"\tAmount: {transaction['amount']}, Date: {transaction['date']}")
-def delete_transaction():
-    #Allow the user to delete a transaction.
-    if not transactions:
-        print("No transactions available to delete.")
-        return
-    
-    view_transactions()
-    
-    while True:
-        transaction_type = input("Enter the transaction type of the transaction you want to delete: ").lower().strip()
-        
-        if not transaction_type:
-            print("Transaction type cannot be empty.")
-            continue
-        
-        if transaction_type not in transactions:
-            print("Transaction type does not exist.")
-            continue
-        
-        if not transaction_type.isalpha():
-            print("Transaction type must consist of alphabetic characters only.")
-            continue
-        break
+        for category in transactions.categories(transaction_type):
+            print(f"\tCategory: {category}")
+            for row in transactions.group_rows(transaction_type, category):
+                print(f"\t\tID: {transactions.ids[row]}, Amount: {transactions.amounts[row]}, "
+                      f"Date: {transactions.date(row)}")
+def prompt_transaction_id(action):
+    #Ask for the ID of an existing transaction, as shown by view_transactions().
     while True:
-    
-        category = input("Enter the category of the transaction you want to delete: ").lower().strip()
-        if not category:
-            print("Category cannot be empty.")
-            continue 
-        if category not in transactions[transaction_type]:
-            print("Category does not exist.")
-            continue 
-        if not category.isalpha():
-            print("Invalid category. Please use only letters.")
+        input_str = input(f"Enter the ID of the transaction you want to {action}: ").strip()
+        if not input_str:
+            print("Transaction ID cannot be empty.")
             continue
-        break 
-
-        # Print the transactions in the selected category for debugging
-        
-
-    list_transactions_in_category(transaction_type, category)
-    
-
-    while True:
-        
         try:
-            transaction_index = int(input("Enter the index of the transaction you want to delete: "))
-            if transaction_index < 0 or transaction_index >= len(transactions[transaction_type][category]):
-                print("Invalid transaction index.")
-                continue 
+            transaction_id = int(input_str)
         except ValueError:
-            print("Invalid index. Please enter a numerical value.")
+            print("Invalid ID. Please enter a whole number.")
+            continue
+        if not transactions.has_id(transaction_id):
+            print("No transaction has that ID.")
             continue
-        break 
+        return transaction_id
 
-    del transactions[transaction_type][category][transaction_index]
-    try:
-        if not transactions[transaction_type][category]:
-            del transactions[transaction_type][category]
-    
-                
-        if not transactions[transaction_type]:
-            del transactions[transaction_type]
 
-        
-    
-                
-        save_transactions()
-        print("Transaction deleted successfully.")
-        return  # Exit the function after successful deletion
-    except ValueError:
-        print("Please enter a valid index.")
-    
+def delete_transaction():
+    #Allow the user to delete a transaction.
+    ensure_loaded()
+    if not transactions:
+        print("No transactions available to delete.")
+        return
 
-def list_transactions_in_category(transaction_type, category):
-    print(f"Transactions in '{category}' under '{transaction_type.capitalize()}':")
-    for i, transaction in enumerate(transactions[transaction_type][category]):
-        print(f"{i}. Amount: {transaction['amount']}, Date: {transaction['date']}")
+    view_transactions()
+    transaction_id = prompt_transaction_id("delete")
+    try:
+        delete_many(transactions, saver, [transaction_id])
+    except BatchError as e:
+        # Another process may have deleted it since it was listed.
+        print(e)
+        return
+    print("Transaction deleted successfully.")
 
 
 def update_transaction():
     #Allow the user to update details of a specific transaction.
+    ensure_loaded()
     if not transactions:
         print("No transactions available to update.")
         return
     view_transactions()
-    while True:
-    
-        transaction_type = input("Enter the type of the transaction you want to update (Income/Expense): ").lower().strip()
-        if not transaction_type:
-            print("Transaction type cannot be empty.")
-            continue 
-        if transaction_type not in transactions:
-            print("Transaction type does not exist.")
-            continue 
-        if not transaction_type.isalpha():
-            print("Invalid transaction type. Please use only letters.")
-        break
+    transaction_id = prompt_transaction_id("update")
 
-    while True:
-    
-        category = input("Enter the category of the transaction you want to update: ").lower().strip()
-        if not category:
-            print("Category cannot be empty.")
-            continue 
-        if category not in transactions[transaction_type]:
-            print("Category does not exist.")
-            continue 
-        if not category.isalpha():
-            print("Invalid category. Please use only letters.")
-            continue
-        break 
-    
-    list_transactions_in_category(transaction_type, category)
-    while True:
-        
-        try:
-            transaction_index = int(input("Enter the index of the transaction you want to update: "))
-            if transaction_index < 0 or transaction_index >= len(transactions[transaction_type][category]):
-                print("Invalid transaction index.")
-                continue 
-        except ValueError:
-            print("Invalid index. Please enter a numerical value.")
-            continue
-        break 
-    
     while True:
         new_transaction_type = input("Enter the new transaction type (Income/Expense): ").lower().strip()
-        if not transaction_type:
-            print("Transaction type cannot be empty.")
+        is_valid, message = validate_transaction_type(new_transaction_type)
+        if not is_valid:
+            print(message)
             continue
-        if new_transaction_type in ['income', 'expense']:
-            break
-        else:
-            print("Invalid transaction type. Please enter 'Income' or 'Expense'.")
+        break
 
     while True:  
         new_category = input("Enter the transaction new category: ").lower().strip()
-        if not new_category:
-            print("Category cannot be empty.")
-            continue
-        if not new_category.isalpha():
-            print("Category name must consist of alphabetic characters only.")
+        is_valid, message = validate_category(new_category)
+        if not is_valid:
+            print(message)
             continue
         break
-   
+
 
     while True:
         
     
-        input_str = input("Enter the transaction new amount: ").strip()
-        if not input_str:
-            print("Amount cannot be empty.")
-            continue 
-        try:
-            amount = float(input_str)
-            if amount <= 0:
-                print("Amount must be greater than 0. Please try again.")
-                continue 
-        except ValueError:
-            print("Invalid amount. Please enter a numerical value.")
+        amount, message = parse_amount(input("Enter the transaction new amount: ").strip())
+        if amount is None:
+            print(message)
             continue
         break
     while True:
@@ -280,8 +177,8 @@ def update_transaction():
         if not date:
             print("Date cannot be empty.")
             continue 
-        is_valid, message = validate_date(date)
-        if not is_valid:
+        date, message = parse_date(date)
+        if date is None:
             print(message)  # Inform the user why the date is invalid
             continue
         break
@@ -289,102 +186,140 @@ def update_transaction():
      # If all inputs are valid, perform the update
     if new_transaction_type and new_category and amount and date:
         # Move the transaction to the new category/type if necessary
-        transaction = transactions[transaction_type][category].pop(transaction_index)
-        if not transactions[transaction_type][category]:
-            del transactions[transaction_type][category]
-
-        # Add the transaction to the new type/category
-        if new_category not in transactions[new_transaction_type]:
-            transactions[new_transaction_type][new_category] = []
-        transactions[new_transaction_type][new_category].append({
-            "amount": amount,
-            "date": date
-        })
+        try:
+            update_many(transactions, saver, [(transaction_id, new_transaction_type, new_category, amount, date)])
+        except BatchError as e:
+            # Another process may have deleted it while the new details were entered.
+            print(e)
+            return
 
     # If all validations pass, then update the transaction
     
     print("Transaction updated successfully.")
 
 
+@instrumentation.timed("summary")
 def total_summary():
     #Calculate and display total income, expenses, and net total.
-    if not transactions:
+    if not storage.queries_without_loading:
+        ensure_loaded()
+    if transactions_loaded:
+        totals = transactions.totals_by_type()
+    else:
+        # Answered by the backend without loading every transaction (a manifest, SQL or a mapped file).
+        totals = {transaction_type: total for transaction_type, (total, _) in storage.summary().items()}
+    if not totals:
         print("No transactions available.")
         return
 
-    total_income = 0
-    total_expense = 0
-
-    for transaction_type, categories in transactions.items():
-        for category, transactions_list in categories.items():
-            for transaction in transactions_list:
-                amount = transaction['amount']
-                if transaction_type == 'income':
-                    total_income += amount
-                elif transaction_type == 'expense':
-                    total_expense += amount
+    total_income = totals.get('income', 0)
+    total_expense = totals.get('expense', 0)
 
     print("Total Income:", total_income)
     print("Total Expense:", total_expense)
     print("Net Total:", total_income - total_expense)
-# The main transactions dictionary to store all data
-transactions = {}
-
-def read_bulk_transactions_from_file(filename):
-    global transactions  # Ensure we are modifying the global dictionary
-    added_transactions = {}
 
-    try:
-        with open(filename, 'r') as file:
-            for line in file:
-                parts = line.strip().split(',')
-                if len(parts) != 4:
-                    print("Skipping invalid entry:", line)
-                    continue
-
-                transaction_type, category, amount, date = parts
-                amount = float(amount)
-
-                if transaction_type not in added_transactions:
-                    added_transactions[transaction_type] = {}
-                if category not in added_transactions[transaction_type]:
-                    added_transactions[transaction_type][category] = []
-
-                transaction = {"amount": amount, "date": date}
-                added_transactions[transaction_type][category].append(transaction)
-
-                if transaction_type not in transactions:
-                    transactions[transaction_type] = {}
-                if category not in transactions[transaction_type]:
-                    transactions[transaction_type][category] = []
-                transactions[transaction_type][category].append(transaction)
-
-        print("Bulk transactions read and displayed below:")
-        display_transactions(added_transactions)
-        print("Now saving transactions...")
-        save_transactions()  # Ensure this is called to save changes
-    except FileNotFoundError:
-        print("File not found.")
-    except ValueError:
-        print("Error processing a line. Check file format.")
-    except Exception as e:
-        print(f"An error occurred: {e}")
+def verify_totals():
+    #Recount the summary totals from every transaction and report any drift in the running totals.
+    ensure_loaded()
+    problems = transactions.verify_totals()
+    if not problems:
+        print("Running totals match a full recount.")
+        return
+    print("Running totals have drifted:")
+    for problem in problems:
+        print(" ", problem)
+    transactions.rebuild_totals()
+    print("Totals have been rebuilt from the transactions.")
+
+def monthly_report():
+    #Show totals per month, type and category, read from the store's rollups.
+    ensure_loaded()
+    if not transactions:
+        print("No transactions available.")
+        return
+    transaction_type = input("Enter the transaction type (Income/Expense, leave blank for both): ").lower().strip()
+    while True:
+        month_from = input("Enter the first month (YYYY-MM, leave blank for no limit): ").strip()
+        month_to = input("Enter the last month (YYYY-MM, leave blank for no limit): ").strip()
+        try:
+            lines = transactions.rollups(transaction_type, month_from, month_to)
+            break
+        except ValueError as e:
+            print(e)
+    if not lines:
+        print("No transactions found for that selection.")
+        return
+    print(f"{'Category':<20} {'Total':>14} {'Count':>7} {'Min':>12} {'Max':>12}")
+    for month, month_lines in itertools.groupby(lines, key=lambda line: line[0]):
+        print(f"\n{month}")
+        for transaction_type, type_lines in itertools.groupby(month_lines, key=lambda line: line[1]):
+            type_total = 0
+            print(f"  {transaction_type.capitalize()}")
+            for _, _, category, total, count, smallest, largest in type_lines:
+                type_total += total
+                print(f"    {category:<18} {total:>14.2f} {count:>7} {smallest:>12.2f} {largest:>12.2f}")
+            print(f"    {'Total':<18} {type_total:>14.2f}")
+
+def search_transactions():
+    #Find transactions by type and an optional date range.
+    if not storage.queries_without_loading:
+        ensure_loaded()
+    if transactions_loaded and not transactions:
+        print("No transactions available to search.")
+        return
+    transaction_type = input("Enter the transaction type (Income/Expense, leave blank for any): ").lower().strip()
+    while True:
+        date_from = input("Enter the start date (YYYY-MM-DD, leave blank for no limit): ").strip()
+        date_to = input("Enter the end date (YYYY-MM-DD, leave blank for no limit): ").strip()
+        try:
+            if transactions_loaded:
+                matches = [transactions.row(row) for row in transactions.search(transaction_type, date_from, date_to)]
+            else:
+                # The backend only reads what the filters need (e.g. the months in the date range).
+                with instrumentation.measure("search (backend)") as sample:
+                    matches = storage.search(transaction_type, date_from, date_to)
+                    sample.rows = len(matches)
+        except ValueError as e:
+            print(e)
+            continue
+        break
+    if not matches:
+        print("No matching transactions found.")
+        return
+    for row_type, category, amount, date in matches:
+        print(f"{date}  {row_type.capitalize()}  {category}  Amount: {amount}")
+    print(f"{len(matches)} matching transaction(s).")
+# The main transaction store holding all data
+transactions = TransactionStore()
+
+def read_bulk_transactions_from_file(filename, parallel=None, workers=None):
+    #Stream "type,category,amount,date" lines from a file into the store and commit them once.
+    #Large files are parsed by several worker processes unless parallel is set explicitly.
+    ensure_loaded()
+    with saver.lock:
+        first_new_row = len(transactions.amounts)
+        try:
+            result = import_transactions(filename, transactions, parallel, workers)
+        except FileNotFoundError:
+            print("File not found.")
+            return
+        except Exception as e:
+            print(f"An error occurred: {e}")
+            return
+
+        print_import_summary(result)
+        if result["imported"]:
+            print("Now saving transactions...")
+            commit_new_rows(first_new_row)
+
+def commit_new_rows(first_new_row):
+    #Persist rows that were added straight to the store (e.g. by a bulk import) as one commit.
+    saver.commit_rows(transactions, first_new_row)
 
 # Ensure this is called in your application flow
 # read_bulk_transactions_from_file('path_to_your_file.txt')
 
-def display_transactions(transactions):
-    if not transactions:
-        print("No transactions available to display.")
-        return
-    
-    for transaction_type, categories in transactions.items():
-        print(f"\nTransaction type: {transaction_type.capitalize()}")
-        for category, transaction_list in categories.items():
-            print(f"  Category: {category.capitalize()}")
-            for transaction in transaction_list:
-                print(f"    Amount: {transaction['amount']}, Date: {transaction['date']}")
-
 # Simulated function call (assuming `file_like` is your file-like object with transaction data)
 # read_bulk_transactions_from_file(file_like)
 
@@ -392,6 +327,15 @@ def display_transactions(transactions):
 
 
 
+def show_diagnostics():
+    #Print the live instrumentation counters and what saving has cost so far.
+    print("\nDiagnostics")
+    print(f"Storage backend: {storage.name}")
+    print(f"Transactions loaded: {len(transactions) if transactions_loaded else 'not yet'}")
+    print(f"Changes waiting to be saved: {saver.pending()}")
+    for line in instrumentation.report_lines():
+        print(line)
+
 def main_menu():
     #Handle the main menu interactions for the finance tracker.
     while True:
@@ -402,6 +346,10 @@ def main_menu():
         print("4. Delete Transaction")
         print("5. Total Summary")
         print("6. Read Bulk Transactions From File")
+        print("7. Verify Summary Totals")
+        print("8. Search Transactions")
+        print("9. Diagnostics")
+        print("10. Monthly Report")
         print("0. Exit")
 
         choice = input("Enter your choice: ").strip()
@@ -421,6 +369,14 @@ def main_menu():
         elif choice == "6":
             filename = input("Enter filename: ")
             read_bulk_transactions_from_file(filename)
+        elif choice == "7":
+            verify_totals()
+        elif choice == "8":
+            search_transactions()
+        elif choice == "9":
+            show_diagnostics()
+        elif choice == "10":
+            monthly_report()
         elif choice == "0":
             break
         else:
@@ -431,5 +387,13 @@ def main_menu():
         
 
 if __name__ == "__main__":
-    load_transactions()
+    args = instrumentation.configure_from_environment(sys.argv[1:])
+    if args:
+        # A subcommand (add, import, summary, search, export) runs without the menu.
+        import tracker_cli
+        sys.exit(tracker_cli.main(args))
+    instrumentation.add_section("Saving", saver.metrics.report)
+    instrumentation.add_section("Locking", storage.lock.report)
     main_menu()
+    # Write anything still queued before the diagnostics report is produced.
+    saver.flush()
@@ -0,0 +1,293 @@
+import atexit
+import contextlib
+import os
+import threading
+import time
+
+import instrumentation
+from transaction_journal import add_records
+
+try:
+    import fcntl
+except ImportError:
+    # Windows locks a byte of the lock file through msvcrt instead.
+    fcntl = None
+    import msvcrt
+
+# Changes are written once nothing new has arrived for this many seconds.
+SAVE_QUIET_PERIOD = 0.5
+
+# Environment variable overriding SAVE_QUIET_PERIOD; 0 writes every change straight away.
+QUIET_PERIOD_ENV_VAR = 'FINANCE_TRACKER_SAVE_DELAY'
+
+
+def fsync_directory(directory):
+    #Make a rename inside directory durable. Not every platform can open a directory.
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+@contextlib.contextmanager
+def atomic_write(filepath, mode='w'):
+    #Write to a temporary file next to filepath, fsync it and rename it over filepath, so a
+    #crash leaves either the old file or the new one, never a truncated mix.
+    temp_path = f"{filepath}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, mode) as file:
+            yield file
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, filepath)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temp_path)
+        raise
+    fsync_directory(os.path.dirname(os.path.abspath(filepath)))
+
+
+def _lock_file(file, blocking):
+    #Take the OS-level lock on an open lock file; returns False if blocking is off and it is taken.
+    if fcntl is not None:
+        try:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            return False
+        return True
+    file.seek(0)
+    while True:
+        try:
+            msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            if not blocking:
+                return False
+            time.sleep(0.01)
+
+
+def _unlock_file(file):
+    if fcntl is not None:
+        fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+    else:
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class FileLock:
+    #Advisory exclusive lock on a lock file, shared by every process that uses the same storage
+    #files. It is re-entrant within a process, and threads of one process queue for it too.
+    #Time spent waiting is counted so contention between writers shows up in Diagnostics.
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+        self.acquisitions = 0
+        self.contended = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def __enter__(self):
+        started = time.perf_counter()
+        contended = not self._thread_lock.acquire(blocking=False)
+        if contended:
+            self._thread_lock.acquire()
+        if self._depth == 0:
+            try:
+                self._file = open(self.path, 'a+b')
+                if not _lock_file(self._file, blocking=False):
+                    contended = True
+                    _lock_file(self._file, blocking=True)
+            except BaseException:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                self._thread_lock.release()
+                raise
+            waited = time.perf_counter() - started
+            self.acquisitions += 1
+            self.contended += contended
+            self.wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+            instrumentation.record("lock wait", waited)
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self._depth -= 1
+        if self._depth == 0:
+            _unlock_file(self._file)
+            self._file.close()
+            self._file = None
+        self._thread_lock.release()
+
+    def report(self):
+        #Lines describing how long this process has waited for the lock, for printing.
+        average = self.wait_seconds / self.acquisitions if self.acquisitions else 0.0
+        return [f"Lock file: {self.path}",
+                f"Acquired: {self.acquisitions} time(s), {self.contended} after waiting",
+                f"Lock wait: total {self.wait_seconds * 1000:.1f} ms, average {average * 1000:.2f} ms, "
+                f"max {self.max_wait_seconds * 1000:.1f} ms"]
+
+
+# One FileLock per lock file, so every backend object in a process shares it.
+_file_locks = {}
+_file_locks_guard = threading.Lock()
+
+
+def file_lock(path):
+    with _file_locks_guard:
+        key = os.path.abspath(path)
+        if key not in _file_locks:
+            _file_locks[key] = FileLock(path)
+        return _file_locks[key]
+
+
+class SaveMetrics:
+    #What persistence has cost so far in this process.
+    def __init__(self):
+        self.requests = 0
+        self.writes = 0
+        self.changes_written = 0
+        self.bytes_written = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.last_seconds = 0.0
+
+    def record_write(self, seconds, changes, written):
+        self.writes += 1
+        self.changes_written += changes
+        # Backends that cannot tell how much they wrote (SQLite) return None.
+        self.bytes_written += written or 0
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.last_seconds = seconds
+
+    def report(self):
+        #Lines describing the metrics, for printing.
+        average = self.total_seconds / self.writes if self.writes else 0.0
+        return [f"Save requests: {self.requests}",
+                f"Writes: {self.writes} ({self.changes_written} change(s))",
+                f"Bytes written: {self.bytes_written}",
+                f"Save latency: last {self.last_seconds * 1000:.1f} ms, "
+                f"average {average * 1000:.1f} ms, max {self.max_seconds * 1000:.1f} ms"]
+
+
+class SaveManager:
+    #Sits between the app and a storage backend and coalesces bursts of changes into one
+    #write, made once quiet_period seconds pass without a new change, or by flush().
+    #flush() also runs at exit. Mutate the store and call record()/save() while holding
+    #lock, so a background write never sees a half-applied change.
+    #Each write holds the backend's file lock and first merges in whatever other processes
+    #wrote since (backend.merge), so concurrent writers do not overwrite each other.
+    #Merging changes the store. merge_runner, if set, is called as
+    #merge_runner(merge, store, records, everything=...) to run it somewhere readers of the
+    #store cannot see it half-done, e.g. on an event loop while the write happens elsewhere.
+    def __init__(self, backend, quiet_period=None):
+        if quiet_period is None:
+            quiet_period = float(os.environ.get(QUIET_PERIOD_ENV_VAR, SAVE_QUIET_PERIOD))
+        self.backend = backend
+        self.quiet_period = quiet_period
+        self.lock = threading.RLock()
+        self.metrics = SaveMetrics()
+        self._store = None
+        self._pending = []
+        self._snapshot = False
+        self._timer = None
+        self.merge_runner = None
+        atexit.register(self.flush)
+
+    def record(self, store, records):
+        #Queue change records that have already been applied to store.
+        with self.lock:
+            self.metrics.requests += 1
+            self._store = store
+            # Kept even when a snapshot is pending: merging needs to know which changes are ours.
+            self._pending.extend(records)
+            self._schedule()
+
+    def save(self, store):
+        #Queue a full snapshot of store.
+        with self.lock:
+            self.metrics.requests += 1
+            self._store = store
+            self._snapshot = True
+            self._schedule()
+
+    def commit_rows(self, store, first_row):
+        #Persist rows bulk-appended to store from first_row onwards. This is already one
+        #write, so it is made straight away after anything still queued.
+        with self.lock:
+            self.metrics.requests += 1
+            self.flush()
+            records = add_records(store, range(first_row, len(store.amounts)))
+            started = time.perf_counter()
+            with self.backend.lock:
+                self._merge(store, records)
+                written = self.backend.commit_adds(store, records)
+            seconds = time.perf_counter() - started
+            self.metrics.record_write(seconds, len(records), written)
+            instrumentation.record("save", seconds, len(records))
+
+    def _merge(self, store, records, everything=False):
+        if self.merge_runner is None:
+            return self.backend.merge(store, records, everything=everything)
+        return self.merge_runner(self.backend.merge, store, records, everything=everything)
+
+    def discard(self, records):
+        #Stop retrying queued records whose changes were rolled back out of the store after a
+        #failed write.
+        with self.lock:
+            dropped = {id(record) for record in records}
+            self._pending = [record for record in self._pending if id(record) not in dropped]
+
+    def pending(self):
+        with self.lock:
+            return 1 if self._snapshot else len(self._pending)
+
+    def _schedule(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self.quiet_period <= 0:
+            self.flush()
+            return
+        self._timer = threading.Timer(self.quiet_period, self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def flush(self):
+        #Write whatever is queued now.
+        with self.lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._pending and not self._snapshot:
+                return
+            store, pending, snapshot = self._store, self._pending, self._snapshot
+            self._pending = []
+            self._snapshot = False
+            started = time.perf_counter()
+            try:
+                with self.backend.lock:
+                    self._merge(store, pending, everything=snapshot)
+                    if snapshot:
+                        written = self.backend.save(store)
+                    else:
+                        written = self.backend.record(store, pending)
+            except Exception:
+                # Keep the changes queued so the next flush tries again.
+                self._pending = pending + self._pending
+                self._snapshot = self._snapshot or snapshot
+                raise
+            seconds = time.perf_counter() - started
+            changes = len(store) if snapshot else len(pending)
+            self.metrics.record_write(seconds, changes, written)
+            instrumentation.record("save", seconds, changes)
@@ -0,0 +1,770 @@
+import contextlib
+import datetime
+import json
+import math
+import os
+import re
+import sys
+
+from save_manager import atomic_write, file_lock
+from transaction_binary import MappedTransactions, read_binary, write_binary
+from transaction_journal import (JOURNAL_FILE, append_records, clear_journal, journal_size, merge_records,
+                                 needs_compaction, read_journal, reapply_records, renumber_pending,
+                                 replay_journal)
+from transaction_store import (LOAD_BATCH_SIZE, TransactionStore, parse_date_bound,
+                               read_transaction_batches)
+from transaction_validation import date_ordinal
+
+# Environment variable that picks the storage backend ("json", "sqlite", "binary" or "sharded").
+BACKEND_ENV_VAR = 'FINANCE_TRACKER_BACKEND'
+
+JSON_FILE = 'transactions.json'
+SQLITE_FILE = 'transactions.db'
+BINARY_FILE = 'transactions.bin'
+SHARD_DIRECTORY = 'transactions_shards'
+
+# Shard for transactions whose date is not a valid YYYY-MM-DD date.
+UNDATED_SHARD = 'undated'
+SHARD_FILE_PATTERN = re.compile(r'^(\d{4}-\d{2}|' + UNDATED_SHARD + r')\.json$')
+
+# Bulk imports larger than this are committed as a fresh snapshot instead of journal records.
+BULK_JOURNAL_LIMIT = 10000
+
+
+class StorageBackend:
+    #Where transactions live on disk. The TransactionStore stays the in-memory working copy;
+    #a backend loads it, persists change records that were already applied to it, and can
+    #answer summaries and searches without loading everything.
+    #Several processes may use the same files. Loads and writes hold lock, and a writer calls
+    #merge() under the same lock first, so it never overwrites what another process wrote.
+    name = None
+
+    # Whether summary() and search() are cheaper than loading the whole store.
+    queries_without_loading = False
+
+    @property
+    def lock(self):
+        #Advisory lock on "<path>.lock", shared with every other process using these files.
+        return file_lock(self.path + '.lock')
+
+    def load(self, on_batch=None):
+        #Return a fully loaded TransactionStore. on_batch(rows loaded, progress from 0 to 1)
+        #is called after each batch so callers can show progress.
+        with self.lock:
+            store = TransactionStore()
+            for rows, progress in self.read_batches():
+                store.extend_rows(rows)
+                if on_batch:
+                    on_batch(len(store), progress)
+            self.finish_load(store)
+        return store
+
+    def read_batches(self, batch_size=LOAD_BATCH_SIZE):
+        #Yield (rows, progress) batches of (type, category, amount, date, id) tuples.
+        #Must not touch shared state so the GUI can run it on a worker thread.
+        raise NotImplementedError
+
+    def finish_load(self, store):
+        #Called once all batches are in the store.
+        store.rebuild_totals()
+
+    def record(self, store, records):
+        #Persist journal-style change records that have already been applied to store.
+        #Write methods return the number of bytes written, or None if the backend cannot tell.
+        raise NotImplementedError
+
+    def merge(self, store, records, everything=False):
+        #Called under lock before a write: bring store up to date with what other processes
+        #wrote since it was loaded or last written, keeping records (our changes, already
+        #applied to store and about to be written) on top. Ids of transactions we added may
+        #change if another process used them first; records are updated to match.
+        #everything is set before a full save(), which rewrites more than records touch.
+        pass
+
+    def commit_adds(self, store, records):
+        #Persist a large batch of "add" records (e.g. from a bulk import).
+        return self.record(store, records)
+
+    def save(self, store):
+        #Write the whole store, replacing whatever is stored.
+        raise NotImplementedError
+
+    def summary(self):
+        #{type: (total, count)}
+        totals = self.load()
+        counts = totals.counts_by_type()
+        return {name: (total, counts[name]) for name, total in totals.totals_by_type().items()}
+
+    def search(self, transaction_type=None, date_from=None, date_to=None,
+               amount=None, amount_min=None, amount_max=None):
+        #Matching (type, category, amount, date) tuples in the order they were added.
+        store = self.load()
+        rows = store.search(transaction_type, date_from, date_to, amount, amount_min, amount_max)
+        return [store.row(row) for row in rows]
+
+
+class JsonBackend(StorageBackend):
+    #The original transactions.json layout plus the append-only change journal next to it.
+    #A store remembers which snapshot file it came from and how far into the journal it has
+    #read (store.disk_version). Before writing, a process applies the journal records other
+    #processes appended since; if one of them compacted the journal into a new snapshot, it
+    #reloads and applies its own pending records again on top.
+    name = 'json'
+
+    def __init__(self, path=JSON_FILE, journal_file=None):
+        self.path = path
+        if journal_file is None:
+            journal_file = JOURNAL_FILE if path == JSON_FILE else os.path.splitext(path)[0] + '.journal'
+        self.journal_file = journal_file
+        self._read_identity = None
+
+    def snapshot_identity(self):
+        #Changes whenever the snapshot file is replaced; None while there is none.
+        try:
+            status = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return [status.st_ino, status.st_size, status.st_mtime_ns]
+
+    def read_batches(self, batch_size=LOAD_BATCH_SIZE):
+        # Checked again by finish_load, in case the GUI's unlocked read raced a compaction.
+        self._read_identity = self.snapshot_identity()
+        try:
+            yield from read_transaction_batches(self.path, batch_size)
+        except FileNotFoundError:
+            # Nothing has been snapshotted yet; the journal may still hold transactions.
+            return
+
+    def finish_load(self, store):
+        with self.lock:
+            if self.snapshot_identity() != self._read_identity:
+                # The snapshot was replaced while it was being read; load the new one instead.
+                store.replace_with(self.load())
+                return
+            # Bring the snapshot up to date with changes recorded since it was written.
+            replay_journal(store, self.journal_file)
+            store.rebuild_totals()
+            store.disk_version = [self._read_identity, journal_size(self.journal_file)]
+
+    def merge(self, store, records, everything=False):
+        if store.disk_version is None:
+            # Not loaded from these files (e.g. a store about to replace them).
+            return
+        identity, offset = store.disk_version
+        if self.snapshot_identity() != identity:
+            fresh = self.load()
+            reapply_records(fresh, records)
+            store.replace_with(fresh)
+            return
+        foreign, offset = read_journal(self.journal_file, offset)
+        merge_records(store, foreign, records)
+        store.disk_version = [identity, offset]
+
+    def record(self, store, records):
+        written = append_records(records, self.journal_file)
+        if needs_compaction(self.journal_file):
+            try:
+                return written + self.save(store)
+            except OSError:
+                # The records are already journalled, so this write succeeded; compacting is
+                # tried again on the next one.
+                pass
+        if store.disk_version is not None:
+            store.disk_version[1] = journal_size(self.journal_file)
+        return written
+
+    def commit_adds(self, store, records):
+        if len(records) > BULK_JOURNAL_LIMIT:
+            # Journalling this many rows would only trigger a compaction anyway.
+            return self.save(store)
+        return self.record(store, records)
+
+    def save(self, store):
+        # The snapshot already contains every journalled change, so the journal is cleared afterwards.
+        with self.lock:
+            with atomic_write(self.path) as file:
+                json.dump(store.to_nested(), file, indent=4)
+            clear_journal(self.journal_file)
+            if store.next_id > max((store.ids[row] for row in store.live_rows()), default=0) + 1:
+                # The newest transactions were deleted; the journal keeps their ids from coming back.
+                append_records([{"op": "reserve", "next_id": store.next_id}], self.journal_file)
+            store.disk_version = [self.snapshot_identity(), journal_size(self.journal_file)]
+        return os.path.getsize(self.path)
+
+
+class BinaryBackend(JsonBackend):
+    #Fixed-width column blocks in transactions.bin (see transaction_binary) instead of JSON,
+    #with the same change journal on top. Start-up maps the file rather than parsing it, and
+    #summaries and searches scan the mapped columns while the journal is empty.
+    name = 'binary'
+    queries_without_loading = True
+
+    def __init__(self, path=BINARY_FILE, journal_file=None):
+        super().__init__(path, journal_file or path + '.journal')
+        self._read_next_id = 1
+
+    def load(self, on_batch=None):
+        # Mapping and copying the columns is fast enough to do in one step.
+        with self.lock:
+            identity = self.snapshot_identity()
+            try:
+                store = read_binary(self.path)
+            except FileNotFoundError:
+                store = TransactionStore()
+            if on_batch:
+                on_batch(len(store), 1.0)
+            # from_columns already summed the file exactly; only journalled changes need a recount.
+            if replay_journal(store, self.journal_file):
+                store.rebuild_totals()
+            store.disk_version = [identity, journal_size(self.journal_file)]
+        return store
+
+    def read_batches(self, batch_size=LOAD_BATCH_SIZE):
+        self._read_identity = self.snapshot_identity()
+        self._read_next_id = 1
+        try:
+            mapped = MappedTransactions(self.path)
+        except FileNotFoundError:
+            return
+        with mapped:
+            self._read_next_id = mapped.next_id
+            for start in range(0, len(mapped), batch_size):
+                rows = mapped.rows(start, start + batch_size)
+                yield rows, (start + len(rows)) / len(mapped)
+
+    def finish_load(self, store):
+        store.next_id = max(store.next_id, self._read_next_id)
+        super().finish_load(store)
+
+    def save(self, store):
+        with self.lock:
+            with atomic_write(self.path, 'wb') as file:
+                write_binary(store, file)
+            clear_journal(self.journal_file)
+            store.disk_version = [self.snapshot_identity(), 0]
+        return os.path.getsize(self.path)
+
+    def summary(self):
+        if journal_size(self.journal_file) or not os.path.exists(self.path):
+            # Journalled changes are not in the file yet.
+            return super().summary()
+        with MappedTransactions(self.path) as mapped:
+            return mapped.totals_by_type()
+
+    def search(self, transaction_type=None, date_from=None, date_to=None,
+               amount=None, amount_min=None, amount_max=None):
+        if journal_size(self.journal_file) or not os.path.exists(self.path):
+            return super().search(transaction_type, date_from, date_to, amount, amount_min, amount_max)
+        with MappedTransactions(self.path) as mapped:
+            rows = mapped.search(transaction_type, date_from, date_to, amount, amount_min, amount_max)
+            return [mapped.row(row) for row in rows]
+
+
+class SqliteBackend(StorageBackend):
+    #One row per transaction in a SQLite table, indexed for the filters the app uses.
+    #The id column is the transaction id. Journals from before ids edit by position in a
+    #type/category, which follows id order.
+    name = 'sqlite'
+    queries_without_loading = True
+
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS transactions (
+               id INTEGER PRIMARY KEY,
+               type TEXT NOT NULL,
+               category TEXT NOT NULL,
+               amount REAL NOT NULL,
+               date TEXT NOT NULL,
+               date_ordinal INTEGER)""",
+        # One row: the next id to hand out, so ids of deleted transactions are not reused.
+        "CREATE TABLE IF NOT EXISTS id_counter (next_id INTEGER NOT NULL)",
+    ]
+
+    # Created after _migrate(), since tables from older versions lack date_ordinal until then.
+    INDEXES = [
+        "CREATE INDEX IF NOT EXISTS idx_transactions_date_ordinal ON transactions (date_ordinal)",
+        "CREATE INDEX IF NOT EXISTS idx_transactions_type_category ON transactions (type, category)",
+        "CREATE INDEX IF NOT EXISTS idx_transactions_category ON transactions (category)",
+        "CREATE INDEX IF NOT EXISTS idx_transactions_amount ON transactions (amount)",
+    ]
+
+    # Types are stored lower-case and dates also as ordinals (NULL when the date is not a
+    # canonical YYYY-MM-DD date), so searches compare indexed columns directly.
+    INSERT_ROW = ("INSERT INTO transactions (type, category, amount, date, date_ordinal, id) "
+                  "VALUES (?, ?, ?, ?, ?, ?)")
+
+    # Row id of the index-th transaction of a type/category.
+    NTH_IN_GROUP = "SELECT id FROM transactions WHERE type = ? AND category = ? ORDER BY id LIMIT 1 OFFSET ?"
+
+    # Highest id any process has handed out, whether or not that transaction still exists.
+    HIGHEST_ID = ("SELECT MAX(COALESCE((SELECT MAX(id) FROM transactions), 0), "
+                  "COALESCE((SELECT next_id FROM id_counter), 1) - 1)")
+
+    def __init__(self, path=SQLITE_FILE):
+        self.path = path
+
+    def connect(self):
+        # Imported here so runs on the other backends do not pay for loading sqlite3.
+        import sqlite3
+        connection = sqlite3.connect(self.path)
+        with connection:
+            for statement in self.SCHEMA:
+                connection.execute(statement)
+            self._migrate(connection)
+            for statement in self.INDEXES:
+                connection.execute(statement)
+        return connection
+
+    def _migrate(self, connection):
+        # Tables written before the date_ordinal column get it filled in and their types
+        # lower-cased, once, under the write lock so two processes do not both do it.
+        def has_ordinals():
+            return any(column[1] == 'date_ordinal'
+                       for column in connection.execute("PRAGMA table_info(transactions)"))
+        if has_ordinals():
+            return
+        connection.execute("BEGIN IMMEDIATE")
+        if has_ordinals():
+            return
+        connection.execute("ALTER TABLE transactions ADD COLUMN date_ordinal INTEGER")
+        connection.create_function('date_ordinal', 1, date_ordinal, deterministic=True)
+        connection.execute("UPDATE transactions SET type = LOWER(type), date_ordinal = date_ordinal(date)")
+        connection.execute("DROP INDEX IF EXISTS idx_transactions_date")
+
+    @staticmethod
+    def _table_row(transaction_type, category, amount, date, transaction_id):
+        #Parameters for INSERT_ROW.
+        return (transaction_type.lower(), category, amount, date, date_ordinal(date), transaction_id)
+
+    def read_batches(self, batch_size=LOAD_BATCH_SIZE):
+        # Opens its own connection, since SQLite connections belong to the thread that made them.
+        connection = self.connect()
+        try:
+            total = connection.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+            cursor = connection.execute("SELECT type, category, amount, date, id FROM transactions ORDER BY id")
+            done = 0
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                done += len(rows)
+                yield rows, done / total
+        finally:
+            connection.close()
+
+    def record(self, store, records):
+        connection = self.connect()
+        try:
+            with connection:
+                for record in records:
+                    self._apply(connection, record)
+                self._reserve(connection, store.next_id)
+        finally:
+            connection.close()
+
+    def _reserve(self, connection, next_id):
+        if not connection.execute("UPDATE id_counter SET next_id = MAX(next_id, ?)", (next_id,)).rowcount:
+            connection.execute("INSERT INTO id_counter (next_id) VALUES (?)", (next_id,))
+
+    def _apply(self, connection, record):
+        op = record['op']
+        if op == 'add':
+            connection.execute(self.INSERT_ROW,
+                               self._table_row(record['type'], record['category'], record['amount'],
+                                               record['date'], record.get('id')))
+        elif op == 'delete' and 'id' in record:
+            connection.execute("DELETE FROM transactions WHERE id = ?", (record['id'],))
+        elif op == 'update' and 'id' in record:
+            connection.execute("UPDATE transactions SET type = ?, category = ?, amount = ?, date = ?, "
+                               "date_ordinal = ? WHERE id = ?",
+                               self._table_row(record['new_type'], record['new_category'], record['amount'],
+                                               record['date'], record['id']))
+        elif op == 'delete':
+            connection.execute(f"DELETE FROM transactions WHERE id = ({self.NTH_IN_GROUP})",
+                               (record['type'].lower(), record['category'], record['index']))
+        elif op == 'update':
+            # An updated transaction moves to the end of its new group, so it also gets a new id.
+            connection.execute(
+                "UPDATE transactions SET id = (SELECT MAX(id) + 1 FROM transactions), "
+                f"type = ?, category = ?, amount = ?, date = ?, date_ordinal = ? WHERE id = ({self.NTH_IN_GROUP})",
+                (record['new_type'].lower(), record['new_category'], record['amount'], record['date'],
+                 date_ordinal(record['date']), record['type'].lower(), record['category'], record['index']))
+        else:
+            raise ValueError(f"Unknown journal operation: {op}")
+
+    def merge(self, store, records, everything=False):
+        # Every change goes straight to the table, so the only clash is two processes adding
+        # under the same id; ours move past the highest id handed out so far. A full save()
+        # rewrites the table from the store, so first everything else in it is merged into the store.
+        if everything:
+            merge_records(store, self._table_changes(store, records), records)
+        added = [record for record in records if record['op'] == 'add']
+        if not added:
+            return
+        connection = self.connect()
+        try:
+            highest = connection.execute(self.HIGHEST_ID).fetchone()[0]
+        finally:
+            connection.close()
+        new_id = max(highest + 1, store.next_id)
+        for record in added:
+            if record['id'] <= highest:
+                renumber_pending(store, records, record['id'], new_id)
+                new_id += 1
+
+    def _table_changes(self, store, records):
+        # The table keeps no log, so what other processes changed is found by comparing every
+        # row with the store, leaving out the rows records already account for.
+        added = {record['id'] for record in records if record['op'] == 'add'}
+        deleted = {record.get('id') for record in records if record['op'] == 'delete'}
+        changes = []
+        in_table = set()
+        connection = self.connect()
+        try:
+            rows = connection.execute("SELECT id, type, category, amount, date FROM transactions")
+            for transaction_id, transaction_type, category, amount, date in rows:
+                in_table.add(transaction_id)
+                if transaction_id in deleted:
+                    continue
+                fields = {"type": transaction_type, "category": category, "amount": amount,
+                          "date": date, "id": transaction_id}
+                if transaction_id in added or not store.has_id(transaction_id):
+                    changes.append(dict(fields, op="add"))
+                elif store.get(transaction_id) != (transaction_type, category, amount, date):
+                    changes.append(dict(op="update", new_type=transaction_type, new_category=category,
+                                        amount=amount, date=date, id=transaction_id))
+        finally:
+            connection.close()
+        for row in store.live_rows():
+            transaction_id = store.ids[row]
+            if transaction_id not in in_table and transaction_id not in added:
+                changes.append({"op": "delete", "id": transaction_id})
+        return changes
+
+    def commit_adds(self, store, records):
+        connection = self.connect()
+        try:
+            with connection:
+                connection.executemany(self.INSERT_ROW,
+                                       (self._table_row(record['type'], record['category'], record['amount'],
+                                                        record['date'], record['id']) for record in records))
+                self._reserve(connection, store.next_id)
+        finally:
+            connection.close()
+
+    def save(self, store):
+        connection = self.connect()
+        try:
+            with connection:
+                connection.execute("DELETE FROM transactions")
+                connection.executemany(self.INSERT_ROW,
+                                       (self._table_row(*store.row(row), store.ids[row])
+                                        for row in store.ordered_rows()))
+                self._reserve(connection, store.next_id)
+        finally:
+            connection.close()
+
+    def summary(self):
+        connection = self.connect()
+        try:
+            rows = connection.execute("SELECT type, SUM(amount), COUNT(*) FROM transactions GROUP BY type")
+            return {transaction_type: (total, count) for transaction_type, total, count in rows}
+        finally:
+            connection.close()
+
+    def search(self, transaction_type=None, date_from=None, date_to=None,
+               amount=None, amount_min=None, amount_max=None):
+        # Rows whose date is not a canonical date have no ordinal, so never match a date filter.
+        low = parse_date_bound(date_from) if date_from else None
+        high = parse_date_bound(date_to) if date_to else None
+        if amount is not None:
+            amount_min = amount_max = amount
+        conditions = []
+        parameters = []
+        for condition, value in (("type = ?", transaction_type.lower() if transaction_type else None),
+                                 ("date_ordinal >= ?", low), ("date_ordinal <= ?", high),
+                                 ("amount >= ?", amount_min), ("amount <= ?", amount_max)):
+            if value not in (None, ""):
+                conditions.append(condition)
+                parameters.append(value)
+        query = "SELECT type, category, amount, date FROM transactions"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        connection = self.connect()
+        try:
+            return connection.execute(query + " ORDER BY id", parameters).fetchall()
+        finally:
+            connection.close()
+
+
+def shard_key(date_text):
+    #Year-month shard ("YYYY-MM") a transaction date belongs to.
+    return date_text[:7] if date_ordinal(date_text) else UNDATED_SHARD
+
+
+def month_bounds(key):
+    #First and last day of a "YYYY-MM" shard, as ISO date strings.
+    year, month = map(int, key.split('-'))
+    first = datetime.date(year, month, 1)
+    following = datetime.date(year + month // 12, month % 12 + 1, 1)
+    return first.isoformat(), (following - datetime.timedelta(days=1)).isoformat()
+
+
+class ShardedBackend(StorageBackend):
+    #One file per year-month in a directory, each in the nested transactions.json layout,
+    #plus manifest.json with every shard's per-type totals and counts. Summaries come from
+    #the manifest, date-bounded searches only open the months they cover, and a change only
+    #rewrites the months it touched.
+    #A store remembers the size and mtime of every month file as it last saw it
+    #(store.disk_version). Before a month is rewritten, a copy another process changed is
+    #merged back in row by row, and the manifest's next_id keeps processes from handing out
+    #the same new id twice.
+    name = 'sharded'
+    queries_without_loading = True
+
+    MANIFEST_FILE = 'manifest.json'
+
+    def __init__(self, path=SHARD_DIRECTORY):
+        self.path = path
+
+    def _shard_path(self, key):
+        return os.path.join(self.path, f"{key}.json")
+
+    def _manifest_path(self):
+        return os.path.join(self.path, self.MANIFEST_FILE)
+
+    def shard_keys(self, date_from=None, date_to=None):
+        #Shards on disk that can hold rows dated within the inclusive bounds, oldest first.
+        #The directory listing is authoritative; the manifest is only a cache of their totals.
+        try:
+            names = os.listdir(self.path)
+        except FileNotFoundError:
+            return []
+        keys = sorted(match.group(1) for match in map(SHARD_FILE_PATTERN.match, names) if match)
+        if not date_from and not date_to:
+            return keys
+        low = parse_date_bound(date_from) if date_from else 1
+        high = parse_date_bound(date_to) if date_to else None
+        selected = []
+        for key in keys:
+            if key == UNDATED_SHARD:
+                # Rows without a valid date never match a date filter.
+                continue
+            first, last = (parse_date_bound(bound) for bound in month_bounds(key))
+            if last >= low and (high is None or first <= high):
+                selected.append(key)
+        return selected
+
+    def read_batches(self, batch_size=LOAD_BATCH_SIZE, date_from=None, date_to=None):
+        keys = self.shard_keys(date_from, date_to)
+        for number, key in enumerate(keys):
+            for rows, progress in read_transaction_batches(self._shard_path(key), batch_size):
+                yield rows, (number + progress) / len(keys)
+
+    def load_range(self, date_from=None, date_to=None):
+        #A store holding just the shards that overlap the date bounds.
+        store = TransactionStore()
+        for rows, _ in self.read_batches(date_from=date_from, date_to=date_to):
+            store.extend_rows(rows)
+        store.rebuild_totals()
+        return store
+
+    def _read_manifest_file(self):
+        try:
+            with open(self._manifest_path(), 'r') as file:
+                manifest = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return {}
+        return manifest if isinstance(manifest, dict) else {}
+
+    def _read_manifest(self):
+        return self._read_manifest_file().get("shards", {})
+
+    def _write_manifest(self, shards, next_id):
+        # next_id never goes down, whichever process writes the manifest.
+        next_id = max(next_id, self._read_manifest_file().get("next_id", 1))
+        with atomic_write(self._manifest_path()) as file:
+            json.dump({"next_id": next_id, "shards": dict(sorted(shards.items()))}, file, indent=4)
+        return os.path.getsize(self._manifest_path())
+
+    def _shard_version(self, key):
+        try:
+            status = os.stat(self._shard_path(key))
+        except FileNotFoundError:
+            return None
+        return [status.st_size, status.st_mtime_ns]
+
+    def finish_load(self, store):
+        store.rebuild_totals()
+        store.disk_version = {key: self._shard_version(key) for key in self.shard_keys()}
+
+    def merge(self, store, records, everything=False):
+        if store.disk_version is None:
+            return
+        added = [record['id'] for record in records if record['op'] == 'add']
+        next_id = self._read_manifest_file().get("next_id", 1)
+        spare_id = max(next_id, store.next_id)
+        for transaction_id in added:
+            if transaction_id < next_id:
+                # Another process may have written a transaction under this id already.
+                renumber_pending(store, records, transaction_id, spare_id)
+                spare_id += 1
+        keys = self._touched_shards(records)
+        if everything or keys is None:
+            keys = set(self.shard_keys()) | set(store.disk_version)
+        for key in sorted(keys):
+            if self._shard_version(key) != store.disk_version.get(key):
+                self._merge_shard(store, key, records)
+                store.disk_version[key] = self._shard_version(key)
+
+    def _merge_shard(self, store, key, records):
+        # Take another process's copy of a month, except where our pending records say otherwise.
+        added = {record['id'] for record in records if record['op'] == 'add'}
+        changed = {record['id'] for record in records if record['op'] != 'add' and 'id' in record}
+        theirs = {}
+        try:
+            for rows, _ in read_transaction_batches(self._shard_path(key)):
+                for transaction_type, category, amount, date, transaction_id in rows:
+                    if transaction_id is not None:
+                        theirs[transaction_id] = (transaction_type, category, amount, date)
+        except FileNotFoundError:
+            pass
+        ours = [store.ids[row] for row in self._rows_in_shard(store, key)]
+        for transaction_id, row in theirs.items():
+            if transaction_id in changed or transaction_id in added:
+                continue
+            if not store.has_id(transaction_id):
+                store.add(*row, transaction_id)
+            elif store.get(transaction_id) != row:
+                store.update(transaction_id, *row)
+        for transaction_id in ours:
+            if transaction_id not in theirs and transaction_id not in added and transaction_id not in changed:
+                # Deleted by the other process, or moved to another month.
+                store.delete(transaction_id)
+
+    def _shard_entry(self, key, totals, counts):
+        # The shard file's size and mtime tell summary() whether this entry is still current.
+        status = os.stat(self._shard_path(key))
+        return {"totals": totals, "counts": counts, "size": status.st_size, "mtime_ns": status.st_mtime_ns}
+
+    def _rows_in_shard(self, store, key):
+        if key == UNDATED_SHARD:
+            return [row for row in store.live_rows() if store.dates[row] < 0]
+        return store.rows_in_date_range(*month_bounds(key))
+
+    def _write_shard(self, store, key, rows, shards):
+        path = self._shard_path(key)
+        if not rows:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+            shards.pop(key, None)
+            return 0
+        os.makedirs(self.path, exist_ok=True)
+        with atomic_write(path) as file:
+            json.dump(store.to_nested(rows), file, indent=4)
+        amounts = {}
+        for row in rows:
+            amounts.setdefault(store.type_names[store.type_codes[row]], []).append(store.amounts[row])
+        shards[key] = self._shard_entry(key, {name: math.fsum(values) for name, values in amounts.items()},
+                                        {name: len(values) for name, values in amounts.items()})
+        return os.path.getsize(path)
+
+    def _touched_shards(self, records):
+        #Months the records change, or None when a record does not say where a transaction was.
+        touched = set()
+        for record in records:
+            if record['op'] == 'add':
+                touched.add(shard_key(record['date']))
+                continue
+            if 'old_date' not in record:
+                # Without the replaced row's date there is no telling which month lost it.
+                return None
+            touched.add(shard_key(record['old_date']))
+            if record['op'] == 'update':
+                touched.add(shard_key(record['date']))
+        return touched
+
+    def record(self, store, records):
+        touched = self._touched_shards(records)
+        if touched is None:
+            return self.save(store)
+        shards = self._read_manifest()
+        written = 0
+        for key in sorted(touched):
+            written += self._write_shard(store, key, self._rows_in_shard(store, key), shards)
+            if store.disk_version is not None:
+                store.disk_version[key] = self._shard_version(key)
+        return written + self._write_manifest(shards, store.next_id)
+
+    def save(self, store):
+        by_shard = {}
+        for row in store.live_rows():
+            code = store.dates[row]
+            key = datetime.date.fromordinal(code).isoformat()[:7] if code > 0 else UNDATED_SHARD
+            by_shard.setdefault(key, []).append(row)
+        shards = {}
+        written = 0
+        with self.lock:
+            for key in set(by_shard) | set(self.shard_keys()):
+                written += self._write_shard(store, key, by_shard.get(key, []), shards)
+            written += self._write_manifest(shards, store.next_id)
+            store.disk_version = {key: self._shard_version(key) for key in shards}
+        return written
+
+    def summary(self):
+        shards = self._read_manifest()
+        totals = {}
+        counts = {}
+        for key in self.shard_keys():
+            entry = shards.get(key)
+            status = os.stat(self._shard_path(key))
+            if entry is None or (entry.get("size"), entry.get("mtime_ns")) != (status.st_size, status.st_mtime_ns):
+                # Written without its manifest entry (e.g. a crash in between); count it the slow way.
+                store = TransactionStore()
+                for rows, _ in read_transaction_batches(self._shard_path(key)):
+                    store.extend_rows(rows)
+                store.rebuild_totals()
+                entry = {"totals": store.totals_by_type(), "counts": store.counts_by_type()}
+            for name, total in entry["totals"].items():
+                totals.setdefault(name, []).append(total)
+                counts[name] = counts.get(name, 0) + entry["counts"][name]
+        return {name: (math.fsum(values), counts[name]) for name, values in totals.items()}
+
+    def search(self, transaction_type=None, date_from=None, date_to=None,
+               amount=None, amount_min=None, amount_max=None):
+        store = self.load_range(date_from, date_to)
+        rows = store.search(transaction_type, date_from, date_to, amount, amount_min, amount_max)
+        return [store.row(row) for row in rows]
+
+
+BACKENDS = {backend.name: backend for backend in (JsonBackend, SqliteBackend, BinaryBackend, ShardedBackend)}
+
+
+def get_backend(name=None):
+    #The configured backend: explicit name, else $FINANCE_TRACKER_BACKEND, else JSON.
+    name = (name or os.environ.get(BACKEND_ENV_VAR) or JsonBackend.name).lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown storage backend '{name}'. Choose one of: {', '.join(BACKENDS)}.")
+    return BACKENDS[name]()
+
+
+def migrate_from_json(backend, json_path=JSON_FILE):
+    #One-shot copy of transactions.json (plus its journal) into another backend.
+    store = JsonBackend(json_path).load()
+    backend.save(store)
+    return len(store)
+
+
+def migrate_json_to_sqlite(json_path=JSON_FILE, sqlite_path=SQLITE_FILE):
+    return migrate_from_json(SqliteBackend(sqlite_path), json_path)
+
+
+if __name__ == "__main__":
+    targets = [name for name in BACKENDS if name != JsonBackend.name]
+    if len(sys.argv) < 3 or sys.argv[1] != "migrate" or sys.argv[2] not in targets:
+        print(f"Usage: python storage_backends.py migrate <{'|'.join(targets)}> [transactions.json]")
+        sys.exit(1)
+    target = get_backend(sys.argv[2])
+    json_path = sys.argv[3] if len(sys.argv) > 3 else JSON_FILE
+    count = migrate_from_json(target, json_path)
+    print(f"Migrated {count} transaction(s) from {json_path} to {target.path}.")
+    print(f"Set {BACKEND_ENV_VAR}={target.name} to use it.")
@@ -0,0 +1,50 @@
+import os
+import tempfile
+import unittest
+
+from bulk_import import import_transactions
+from transaction_store import TransactionStore
+
+# Bulk file imports, serial and with worker processes:
+#   python -m unittest test_bulk_import
+
+
+class BulkImportTests(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.filename = os.path.join(directory.name, 'bulk.csv')
+
+    def write_lines(self, lines):
+        with open(self.filename, 'w') as file:
+            file.writelines(line + '\n' for line in lines)
+
+    def test_serial_and_parallel_imports_give_the_same_totals(self):
+        # Amounts whose row-by-row sum and exact sum differ in the last bits.
+        self.write_lines(f"{kind},{category},{amount},2024-0{month}-1{day}"
+                         for kind, category in (('expense', 'food'), ('income', 'salary'))
+                         for month in range(1, 10) for day in range(10)
+                         for amount in (0.1, 1e6 + 0.07, 33.33))
+        serial, parallel = TransactionStore(), TransactionStore()
+        import_transactions(self.filename, serial, parallel=False, chunk_size=7)
+        import_transactions(self.filename, parallel, parallel=True, workers=2)
+        self.assertEqual(serial.totals_by_type(), parallel.totals_by_type())
+        self.assertEqual(serial.category_totals('income'), parallel.category_totals('income'))
+        for store in (serial, parallel):
+            self.assertEqual(store.verify_totals(tolerance=0), [])
+
+    def test_error_report_is_removed_after_a_clean_import(self):
+        for parallel in (False, True):
+            with self.subTest(parallel=parallel):
+                self.write_lines(['expense,food,12,2024-01-01', 'expense,food,twelve,2024-01-01'])
+                result = import_transactions(self.filename, TransactionStore(), parallel=parallel)
+                with open(result['error_report']) as report:
+                    self.assertIn('line 2:', report.read())
+                self.write_lines(['expense,food,12,2024-01-01'])
+                result = import_transactions(self.filename, TransactionStore(), parallel=parallel)
+                self.assertIsNone(result['error_report'])
+                self.assertFalse(os.path.exists(self.filename + '.errors.txt'))
+
+
+if __name__ == "__main__":
+    unittest.main()
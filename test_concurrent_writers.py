@@ -0,0 +1,183 @@
+import multiprocessing
+import os
+import tempfile
+import unittest
+
+from save_manager import SaveManager, _lock_file, file_lock
+from storage_backends import BACKENDS, get_backend
+from transaction_batch import add_many, delete_many, update_many
+
+# Several processes writing the same storage files at once, for every backend:
+#   python -m unittest test_concurrent_writers
+# Each test runs in its own temporary directory, which the backends' default paths are
+# relative to.
+
+PROCESSES = 4
+ADDS_PER_PROCESS = 12
+
+
+def _rows(store):
+    #{id: (type, category, amount, date)} for every live transaction.
+    return {store.ids[row]: store.row(row) for row in store.live_rows()}
+
+
+def _write_and_edit(args):
+    #Worker: add transactions one at a time, then update every other one and delete every
+    #fourth. With snapshot set the updates and deletes are written by a full save(), like the
+    #menu's save command.
+    directory, name, worker, snapshot = args
+    os.chdir(directory)
+    storage = get_backend(name)
+    store = storage.load()
+    saver = SaveManager(storage, quiet_period=60 if snapshot else 0)
+    # Categories are letters only; the validator rejects digits.
+    category = 'worker' + 'abcdefghij'[worker]
+    ids = []
+    for number in range(ADDS_PER_PROCESS):
+        ids.extend(add_many(store, saver, [('expense', category, number + 1, f'2024-0{number % 3 + 1}-15')]))
+    update_many(store, saver, [(transaction_id, 'income', category, 5000, '2024-04-01')
+                               for transaction_id in ids[::2]])
+    delete_many(store, saver, ids[1::4])
+    if snapshot:
+        with saver.lock:
+            saver.save(store)
+            saver.flush()
+    return category, ids
+
+
+def _try_lock(path):
+    #Worker: whether the lock file can be taken without waiting.
+    with open(path, 'a+b') as file:
+        return _lock_file(file, blocking=False)
+
+
+class ConcurrentWriterTests(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(directory.name)
+        self.directory = directory.name
+
+    def run_workers(self, name, snapshots=()):
+        # Forked so the workers start quickly; the tests only rely on what is on disk.
+        context = multiprocessing.get_context('fork' if hasattr(os, 'fork') else 'spawn')
+        with context.Pool(PROCESSES) as pool:
+            return pool.map(_write_and_edit, [(self.directory, name, worker, worker in snapshots)
+                                              for worker in range(PROCESSES)])
+
+    def check_results(self, name, results):
+        rows = _rows(get_backend(name).load())
+        expected = sum(len(ids) - len(ids[1::4]) for _, ids in results)
+        self.assertEqual(len(rows), expected)
+        for category, ids in results:
+            for position, transaction_id in enumerate(ids):
+                if position % 4 == 1:
+                    self.assertNotIn(transaction_id, rows)
+                elif position % 2 == 0:
+                    self.assertEqual(rows[transaction_id], ('income', category, 5000.0, '2024-04-01'))
+                else:
+                    self.assertEqual(rows[transaction_id][:3], ('expense', category, float(position + 1)))
+
+    def test_recorded_changes_from_every_process_are_kept(self):
+        for name in BACKENDS:
+            with self.subTest(backend=name):
+                self.check_results(name, self.run_workers(name))
+
+    def test_snapshots_keep_other_processes_changes(self):
+        for name in BACKENDS:
+            with self.subTest(backend=name):
+                self.check_results(name, self.run_workers(name, snapshots={0, 2}))
+
+    def test_colliding_add_is_renumbered(self):
+        # Both stores hand out id 1; the second write moves its transaction to a free id.
+        for name in BACKENDS:
+            with self.subTest(backend=name):
+                first, second = get_backend(name).load(), get_backend(name).load()
+                first_saver = SaveManager(get_backend(name), quiet_period=0)
+                second_saver = SaveManager(get_backend(name), quiet_period=60)
+                first_ids = add_many(first, first_saver, [('income', 'salary', 100, '2024-01-01')])
+                second_ids = add_many(second, second_saver, [('expense', 'rent', 50, '2024-01-02')])
+                self.assertEqual(first_ids, [1])
+                self.assertNotEqual(second_ids, first_ids)
+                self.assertEqual(second_saver.pending(), 0)
+                rows = _rows(get_backend(name).load())
+                self.assertEqual(rows[first_ids[0]], ('income', 'salary', 100.0, '2024-01-01'))
+                self.assertEqual(rows[second_ids[0]], ('expense', 'rent', 50.0, '2024-01-02'))
+                self.assertEqual(second.get(second_ids[0]), rows[second_ids[0]])
+
+    def test_renumbered_pending_changes_follow_the_new_id(self):
+        for name in BACKENDS:
+            with self.subTest(backend=name):
+                ours, theirs = get_backend(name).load(), get_backend(name).load()
+                saver = SaveManager(get_backend(name), quiet_period=60)
+                add_many(ours, saver, [('expense', 'food', 10, '2024-02-01')], flush=False)
+                update_many(ours, saver, [(1, 'expense', 'food', 12, '2024-02-01')])
+                add_many(theirs, SaveManager(get_backend(name), quiet_period=0),
+                         [('income', 'gift', 30, '2024-02-02')])
+                saver.flush()
+                rows = _rows(get_backend(name).load())
+                self.assertEqual(sorted(rows.values()), [('expense', 'food', 12.0, '2024-02-01'),
+                                                         ('income', 'gift', 30.0, '2024-02-02')])
+                self.assertEqual(rows[1], ('income', 'gift', 30.0, '2024-02-02'))
+
+    def test_deleted_ids_are_not_handed_out_again(self):
+        # The newest transaction is deleted before another process loads the files.
+        for name in BACKENDS:
+            for snapshot in (False, True):
+                with self.subTest(backend=name, snapshot=snapshot):
+                    os.chdir(tempfile.mkdtemp(dir=self.directory))
+                    storage = get_backend(name)
+                    store = storage.load()
+                    saver = SaveManager(get_backend(name), quiet_period=0)
+                    ids = add_many(store, saver, [('income', 'salary', amount, '2024-01-01') for amount in (1, 2)])
+                    delete_many(store, saver, ids[-1:])
+                    if snapshot:
+                        with saver.lock:
+                            saver.save(store)
+                            saver.flush()
+                    other = get_backend(name).load()
+                    new_ids = add_many(other, SaveManager(get_backend(name), quiet_period=0),
+                                       [('expense', 'rent', 3, '2024-01-02')])
+                    self.assertGreater(new_ids[0], max(ids))
+                    self.assertNotIn(ids[-1], _rows(get_backend(name).load()))
+
+    def test_snapshot_merges_a_foreign_write(self):
+        for name in BACKENDS:
+            with self.subTest(backend=name):
+                storage = get_backend(name)
+                add_many(storage.load(), SaveManager(storage, quiet_period=0),
+                         [('income', 'salary', amount, '2024-01-01') for amount in (1, 2, 3, 4)])
+                ours = storage.load()
+                saver = SaveManager(get_backend(name), quiet_period=60)
+                theirs = storage.load()
+                their_saver = SaveManager(get_backend(name), quiet_period=0)
+                add_many(theirs, their_saver, [('expense', 'rent', 500, '2024-02-01')])
+                delete_many(theirs, their_saver, [2])
+                update_many(theirs, their_saver, [(3, 'expense', 'food', 7, '2024-01-03')])
+                add_many(ours, saver, [('expense', 'fun', 1, '2024-03-01')], flush=False)
+                delete_many(ours, saver, [4])
+                with saver.lock:
+                    saver.save(ours)
+                    saver.flush()
+                rows = _rows(get_backend(name).load())
+                self.assertEqual(rows, _rows(ours))
+                self.assertEqual(sorted(rows.values()), [('expense', 'food', 7.0, '2024-01-03'),
+                                                         ('expense', 'fun', 1.0, '2024-03-01'),
+                                                         ('expense', 'rent', 500.0, '2024-02-01'),
+                                                         ('income', 'salary', 1.0, '2024-01-01')])
+
+    def test_lock_is_reentrant_and_held_until_the_outermost_release(self):
+        lock = file_lock(os.path.join(self.directory, 'transactions.json.lock'))
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(1) as pool:
+            with lock:
+                with lock:
+                    self.assertFalse(pool.apply(_try_lock, (lock.path,)))
+                self.assertFalse(pool.apply(_try_lock, (lock.path,)))
+            self.assertTrue(pool.apply(_try_lock, (lock.path,)))
+        self.assertEqual(lock.acquisitions, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import os
+import random
+import sqlite3
+import tempfile
+import unittest
+
+from storage_backends import SqliteBackend
+from transaction_store import TransactionStore
+
+# Searching the SQLite table without loading it into a store:
+#   python -m unittest test_sqlite_backend
+
+# The table as versions before the date_ordinal column created it.
+OLD_SCHEMA = """CREATE TABLE transactions (
+                    id INTEGER PRIMARY KEY,
+                    type TEXT NOT NULL,
+                    category TEXT NOT NULL,
+                    amount REAL NOT NULL,
+                    date TEXT NOT NULL)"""
+
+
+class SqliteSearchTests(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.backend = SqliteBackend(os.path.join(directory.name, 'transactions.db'))
+
+    def query_plan(self, query, parameters):
+        connection = self.backend.connect()
+        try:
+            return ' '.join(row[-1] for row in connection.execute("EXPLAIN QUERY PLAN " + query, parameters))
+        finally:
+            connection.close()
+
+    def test_search_matches_the_store(self):
+        generator = random.Random(3)
+        store = TransactionStore()
+        store.add_many([(generator.choice(['income', 'expense']), 'misc', generator.choice([1, 5, 20]),
+                         generator.choice(['2024-01-05', '2024-02-29', '2024-03-01', '2024-1-5', 'someday']))
+                        for _ in range(200)])
+        self.backend.save(store)
+        for search in ({'transaction_type': 'Income'}, {'date_from': '2024-02-01'},
+                       {'date_to': '2024-02-29', 'transaction_type': 'expense'},
+                       {'date_from': '2024-01-01', 'date_to': '2024-12-31', 'amount_min': 5}):
+            with self.subTest(**search):
+                self.assertEqual(self.backend.search(**search),
+                                 [store.row(row) for row in store.search(**search)])
+
+    def test_old_tables_are_migrated(self):
+        connection = sqlite3.connect(self.backend.path)
+        with connection:
+            connection.execute(OLD_SCHEMA)
+            connection.execute("CREATE INDEX idx_transactions_date ON transactions (date)")
+            connection.executemany("INSERT INTO transactions (type, category, amount, date, id) VALUES (?, ?, ?, ?, ?)",
+                                   [('Income', 'salary', 100, '2024-01-05', 1),
+                                    ('expense', 'food', 7, '2024-1-5', 2),
+                                    ('EXPENSE', 'rent', 50, '2024-02-01', 3)])
+        connection.close()
+        self.assertEqual(self.backend.search('expense', '2024-01-01'), [('expense', 'rent', 50.0, '2024-02-01')])
+        self.assertEqual(self.backend.search('income'), [('income', 'salary', 100.0, '2024-01-05')])
+        self.assertEqual(self.backend.summary(), {'expense': (57.0, 2), 'income': (100.0, 1)})
+        self.assertIn('idx_transactions_date_ordinal',
+                      self.query_plan("SELECT id FROM transactions WHERE date_ordinal >= ? AND date_ordinal <= ?",
+                                      (738000, 738010)))
+        self.assertIn('idx_transactions_type_category',
+                      self.query_plan("SELECT id FROM transactions WHERE type = ?", ('income',)))
+
+
+if __name__ == "__main__":
+    unittest.main()
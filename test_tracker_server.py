@@ -0,0 +1,79 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from storage_backends import BACKENDS, get_backend
+from tracker_server import HttpError, TrackerService
+
+# TrackerService driven directly on an event loop, without sockets:
+#   python -m unittest test_tracker_server
+
+
+class TrackerServiceTests(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(directory.name)
+        self.directory = directory.name
+
+    def run_service(self, service, scenario):
+        #Run scenario(service) with the writer task going, then shut the service down.
+        async def main():
+            writer = asyncio.create_task(service.run_writer())
+            await asyncio.sleep(0)
+            try:
+                return await scenario(service)
+            finally:
+                writer.cancel()
+                await service.close()
+        return asyncio.run(main())
+
+    def test_search_rejects_amount_bounds_that_are_not_numbers(self):
+        storage = get_backend('json')
+        service = TrackerService(storage, storage.load())
+
+        async def scenario(service):
+            await service.add([('expense', 'food', 12, '2024-01-01')])
+            for value in ('nan', 'inf', '-inf', 'abc', ''):
+                with self.subTest(value=value):
+                    with self.assertRaises(HttpError) as raised:
+                        await service.handle_search({'min': value}, None)
+                    self.assertEqual(raised.exception.status, 400)
+            return await service.handle_search({'min': '10', 'max': '20'}, None)
+
+        found = self.run_service(service, scenario)
+        self.assertEqual([row['amount'] for row in found], [12.0])
+
+    def test_failed_write_is_rolled_back(self):
+        for name in BACKENDS:
+            with self.subTest(backend=name):
+                os.chdir(tempfile.mkdtemp(dir=self.directory))
+                storage = get_backend(name)
+                service = TrackerService(storage, storage.load())
+                record = storage.record
+                failures = [OSError("disk full")]
+
+                def failing_record(store, records):
+                    if failures:
+                        raise failures.pop()
+                    return record(store, records)
+                storage.record = failing_record
+
+                async def scenario(service):
+                    with self.assertRaises(HttpError) as raised:
+                        await service.add([('income', 'salary', 5, '2024-01-01')])
+                    self.assertEqual(raised.exception.status, 500)
+                    self.assertEqual(len(service.store), 0)
+                    # The client retries; the transaction is stored once.
+                    return await service.add([('income', 'salary', 5, '2024-01-01')])
+
+                ids = self.run_service(service, scenario)
+                self.assertEqual(service.saver.pending(), 0)
+                loaded = get_backend(name).load()
+                self.assertEqual(list(loaded.ids[row] for row in loaded.live_rows()), ids)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import os
+import tempfile
+import unittest
+
+from transaction_journal import add_records, append_records, read_journal, replay_journal
+from transaction_store import TransactionStore
+
+# The change journal on its own:
+#   python -m unittest test_transaction_journal
+
+
+def _add(amount, transaction_id):
+    return {"op": "add", "type": "expense", "category": "food", "amount": amount,
+            "date": "2024-01-01", "id": transaction_id}
+
+
+class JournalTests(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.journal = os.path.join(directory.name, 'transactions.journal')
+
+    def replayed(self):
+        store = TransactionStore()
+        replay_journal(store, self.journal)
+        return {store.ids[row]: store.row(row) for row in store.live_rows()}
+
+    def test_replay_applies_adds_updates_and_deletes(self):
+        append_records([_add(1, 1), _add(2, 2), _add(3, 3)], self.journal)
+        append_records([{"op": "update", "id": 2, "new_type": "income", "new_category": "gift",
+                         "amount": 20, "date": "2024-02-01"},
+                        {"op": "delete", "id": 3}], self.journal)
+        self.assertEqual(self.replayed(), {1: ('expense', 'food', 1.0, '2024-01-01'),
+                                           2: ('income', 'gift', 20.0, '2024-02-01')})
+
+    def test_append_after_a_torn_write_keeps_later_records(self):
+        append_records([_add(1, 1)], self.journal)
+        with open(self.journal, 'ab') as file:
+            file.write(b'{"op": "add", "type": "exp')
+        append_records([_add(2, 2), _add(3, 3)], self.journal)
+        append_records([_add(4, 4)], self.journal)
+        self.assertEqual(sorted(self.replayed()), [1, 2, 3, 4])
+        records, offset = read_journal(self.journal)
+        self.assertEqual([record['id'] for record in records], [1, 2, 3, 4])
+        self.assertEqual(offset, os.path.getsize(self.journal))
+
+    def test_torn_first_line_is_cut_off(self):
+        with open(self.journal, 'wb') as file:
+            file.write(b'{"op": "ad')
+        append_records([_add(5, 1)], self.journal)
+        self.assertEqual(list(self.replayed()), [1])
+
+    def test_replay_keeps_records_glued_to_a_fragment(self):
+        # Written by versions that appended straight after a torn line.
+        with open(self.journal, 'w') as file:
+            file.write('{"op": "add", "type": "expense", "category": "food", "amount": 1, "date": "2024-01-01", "id": 1}\n')
+            file.write('{"op": "add", "type": "exp{"op": "delete", "id": 1}\n')
+            file.write('not json at all\n')
+            file.write('{"op": "add", "type": "income", "category": "gift", "amount": 2, "date": "2024-01-02", "id": 2}\n')
+        self.assertEqual(self.replayed(), {2: ('income', 'gift', 2.0, '2024-01-02')})
+
+    def test_add_records_round_trip(self):
+        store = TransactionStore()
+        store.add_many([('expense', 'food', 1.5, '2024-01-01'), ('income', 'salary', 100, 'someday')])
+        append_records(add_records(store, store.live_rows()), self.journal)
+        self.assertEqual(self.replayed(), {store.ids[row]: store.row(row) for row in store.live_rows()})
+
+
+if __name__ == "__main__":
+    unittest.main()
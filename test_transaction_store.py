@@ -0,0 +1,289 @@
+import math
+import random
+import unittest
+from array import array
+
+from transaction_store import COMPACT_MIN_DEAD, IdPositions, SortedIndex, TransactionStore
+
+# The in-memory store on its own, without any storage backend:
+#   python -m unittest test_transaction_store
+
+DATES = ['2024-01-05', '2024-01-31', '2024-02-01', '2024-02-29', '2024-03-15', 'someday']
+
+
+def _random_rows(generator, count):
+    #(type, category, amount, date) rows drawn from a few types, categories and dates.
+    return [(generator.choice(['income', 'expense']), generator.choice(['food', 'rent', 'gift']),
+             generator.choice([0.1, 2.5, 7, 19.99, 100, 1e6 + 0.07]), generator.choice(DATES))
+            for _ in range(count)]
+
+
+def _edited_store(seed, count=300):
+    #A store after a random mix of adds, updates and deletes.
+    generator = random.Random(seed)
+    store = TransactionStore()
+    ids = store.add_many(_random_rows(generator, count))
+    generator.shuffle(ids)
+    for transaction_id, row in zip(ids[:count // 4], _random_rows(generator, count // 4)):
+        store.update(transaction_id, *row)
+    store.delete_many(ids[count // 4:count // 2])
+    return store
+
+
+def _live(store):
+    #{id: (type, category, amount, date)} for every live transaction.
+    return {store.ids[row]: store.row(row) for row in store.live_rows()}
+
+
+class IdPositionsTests(unittest.TestCase):
+    def test_dense_ids_live_in_the_array(self):
+        positions = IdPositions()
+        positions.add_range(1, 0, 100)
+        positions[101] = 100
+        self.assertEqual(len(positions), 101)
+        self.assertEqual(positions[1], 0)
+        self.assertEqual(positions[101], 100)
+        self.assertEqual(positions._far, {})
+
+    def test_missing_ids(self):
+        positions = IdPositions.from_ids([1, 2, 3])
+        for transaction_id in (0, -1, 4, 10 ** 9, None, 'x'):
+            self.assertNotIn(transaction_id, positions)
+            self.assertIsNone(positions.get(transaction_id))
+        with self.assertRaises(KeyError):
+            positions[4]
+
+    def test_far_id_is_found_after_the_array_grows_past_it(self):
+        # Loading in type/category order can meet a high id before the ids below it.
+        positions = IdPositions()
+        for row, transaction_id in enumerate(list(range(1, 11)) + [2000] + list(range(11, 2000))):
+            positions[transaction_id] = row
+        positions[2001] = 2000
+        self.assertEqual(positions[2000], 10)
+        self.assertEqual(positions._far, {})
+        self.assertEqual(len(positions), 2001)
+        positions.pop(2000)
+        self.assertNotIn(2000, positions)
+        self.assertEqual(len(positions), 2000)
+
+    def test_far_id_is_found_after_a_range_covers_it(self):
+        positions = IdPositions()
+        positions[5000] = 0
+        positions.add_range(1, 1, 6000)
+        self.assertEqual(positions[5000], 0)
+        self.assertEqual(len(positions), 6001)
+
+    def test_from_ids_rejects_repeats(self):
+        for ids in ([1, 2, 2], [1, 10 ** 6, 10 ** 6]):
+            with self.assertRaises(ValueError):
+                IdPositions.from_ids(ids)
+
+    def test_reloaded_store_keeps_a_late_high_id(self):
+        store = TransactionStore()
+        store.add_many([('expense', 'food', 1, '2024-01-01')] * 10 +
+                       [('income', 'salary', 2, '2024-01-02')] * 1989 +
+                       [('expense', 'food', 3, '2024-01-03')])
+        # Rows come back grouped by type and category, as from transactions.json.
+        reloaded = TransactionStore()
+        reloaded.extend_rows([store.row(row) + (store.ids[row],) for row in store.ordered_rows()])
+        reloaded.add('income', 'gift', 4, '2024-01-04')
+        self.assertTrue(reloaded.has_id(2000))
+        reloaded.delete(2000)
+        self.assertFalse(reloaded.has_id(2000))
+
+
+class SortedIndexTests(unittest.TestCase):
+    def test_ranges_are_inclusive_and_ties_keep_row_order(self):
+        column = array('i', [5, 3, 5, 1, 9, 5])
+        index = SortedIndex(column, 'i')
+        self.assertEqual(list(index.range(3, 5)), [1, 0, 2, 5])
+        self.assertEqual(list(index.range(None, 1)), [3])
+        self.assertEqual(list(index.range(6)), [4])
+        self.assertEqual(index.size(6, 8), 0)
+        self.assertEqual(index.size(9, 1), 0)
+
+    def test_row_changes_keep_the_index_sorted(self):
+        column = array('i', [5, 3, 5, 1])
+        index = SortedIndex(column, 'i')
+        index.ensure()
+        index.remove(0)
+        column[0] = 2
+        index.insert(0)
+        column.append(5)
+        index.insert(4)
+        self.assertEqual(list(index.rows), [3, 0, 1, 2, 4])
+        self.assertEqual(list(index.keys), sorted(column))
+
+    def test_store_indexes_follow_updates_and_deletes(self):
+        store = _edited_store(1)
+        for index, column in ((store._date_index, store.dates), (store._amount_index, store.amounts)):
+            index.ensure()
+            self.assertEqual(sorted(index.rows), list(range(len(column))))
+            self.assertEqual(list(index.keys), [column[row] for row in index.rows])
+            self.assertEqual(list(index.keys), sorted(column))
+
+
+class RunningTotalsTests(unittest.TestCase):
+    def check_totals(self, store):
+        rows = _live(store).values()
+        for transaction_type in ('income', 'expense'):
+            amounts = [amount for kind, _, amount, _ in rows if kind == transaction_type]
+            self.assertAlmostEqual(store.totals_by_type().get(transaction_type, 0.0), math.fsum(amounts), places=6)
+            self.assertEqual(store.counts_by_type().get(transaction_type, 0), len(amounts))
+            for category, (total, count) in store.category_totals(transaction_type).items():
+                amounts = [amount for kind, name, amount, _ in rows if (kind, name) == (transaction_type, category)]
+                self.assertAlmostEqual(total, math.fsum(amounts), places=6)
+                self.assertEqual(count, len(amounts))
+        self.assertEqual(store.verify_totals(), [])
+
+    def test_totals_follow_adds_updates_and_deletes(self):
+        for seed in range(3):
+            with self.subTest(seed=seed):
+                self.check_totals(_edited_store(seed))
+
+    def test_emptied_group_is_dropped(self):
+        store = TransactionStore()
+        ids = store.add_many([('expense', 'food', 0.1, '2024-01-01'), ('expense', 'food', 0.2, '2024-01-01')])
+        store.delete_many(ids)
+        self.assertEqual(store.totals_by_type(), {})
+        self.assertEqual(store.category_totals('expense'), {})
+
+    def test_rebuild_totals_matches_an_exact_recount(self):
+        store = _edited_store(4)
+        store.rebuild_totals()
+        self.assertEqual(store.verify_totals(tolerance=0), [])
+        self.check_totals(store)
+
+
+class SearchTests(unittest.TestCase):
+    def test_search_matches_a_full_scan(self):
+        store = _edited_store(5)
+        rows = _live(store)
+        filters = [{}, {'transaction_type': 'INCOME'}, {'transaction_type': 'transfer'},
+                   {'date_from': '2024-02-01'}, {'date_to': '2024-01-31'},
+                   {'date_from': '2024-01-06', 'date_to': '2024-02-29', 'transaction_type': 'expense'},
+                   {'amount': 7}, {'amount_min': 2.5, 'amount_max': 100},
+                   {'amount_min': 100, 'date_from': '2024-03-01'}]
+
+        def matches(row, transaction_type=None, date_from=None, date_to=None,
+                    amount=None, amount_min=None, amount_max=None):
+            kind, _, value, date = row
+            if amount is not None:
+                amount_min = amount_max = amount
+            if date == 'someday' and (date_from or date_to):
+                return False
+            return ((not transaction_type or kind == transaction_type.lower()) and
+                    (not date_from or date >= date_from) and (not date_to or date <= date_to) and
+                    (amount_min is None or value >= amount_min) and (amount_max is None or value <= amount_max))
+
+        for search in filters:
+            with self.subTest(**search):
+                found = store.search(**search)
+                self.assertEqual(list(found), sorted(found))
+                self.assertEqual([store.ids[row] for row in found],
+                                 [transaction_id for transaction_id, row in rows.items() if matches(row, **search)])
+
+    def test_only_the_smallest_candidate_set_is_read(self):
+        store = TransactionStore()
+        store.add_many([('expense', 'food', 10, '2024-01-01')] * 200 + [('income', 'salary', 10, '2024-01-02')])
+        read = []
+        for index in store._indexes:
+            index.range = lambda low=None, high=None, range=index.range: read.append(1) or range(low, high)
+        found = store.search(transaction_type='income', date_from='2024-01-01', amount_min=5)
+        self.assertEqual([store.row(row)[0] for row in found], ['income'])
+        self.assertEqual(read, [])
+
+    def test_bad_date_bound(self):
+        with self.assertRaises(ValueError):
+            TransactionStore().search(date_from='2024-13-01')
+
+
+class RollupTests(unittest.TestCase):
+    def expected_rollups(self, store):
+        cells = {}
+        for kind, category, amount, date in _live(store).values():
+            month = date[:7] if date != 'someday' else 'undated'
+            cells.setdefault((month, kind, category), []).append(amount)
+        return sorted(((month, kind, category, math.fsum(amounts), len(amounts), min(amounts), max(amounts))
+                       for (month, kind, category), amounts in cells.items()),
+                      key=lambda line: (line[0] == 'undated',) + line[:3])
+
+    def assertRollupsEqual(self, store):
+        actual = store.rollups()
+        expected = self.expected_rollups(store)
+        self.assertEqual([line[:3] + line[4:] for line in actual], [line[:3] + line[4:] for line in expected])
+        for line, wanted in zip(actual, expected):
+            self.assertAlmostEqual(line[3], wanted[3], places=6)
+
+    def test_min_and_max_are_worked_out_again_after_removals(self):
+        store = TransactionStore()
+        ids = store.add_many([('expense', 'food', amount, '2024-01-10') for amount in (5, 1, 9, 3)])
+        store.rollups()
+        store.delete(ids[1])
+        self.assertEqual(store.rollups(), [('2024-01', 'expense', 'food', 17.0, 3, 3.0, 9.0)])
+        store.update(ids[2], 'expense', 'food', 4, '2024-01-11')
+        self.assertEqual(store.rollups(), [('2024-01', 'expense', 'food', 12.0, 3, 3.0, 5.0)])
+        store.update(ids[0], 'expense', 'food', 5, '2024-02-01')
+        self.assertEqual(store.rollups(), [('2024-01', 'expense', 'food', 7.0, 2, 3.0, 4.0),
+                                           ('2024-02', 'expense', 'food', 5.0, 1, 5.0, 5.0)])
+
+    def test_maintained_rollups_match_a_recount(self):
+        for seed in range(3):
+            with self.subTest(seed=seed):
+                generator = random.Random(seed)
+                store = TransactionStore()
+                store.rollups()
+                ids = store.add_many(_random_rows(generator, 200))
+                for transaction_id, row in zip(ids[::3], _random_rows(generator, 67)):
+                    store.update(transaction_id, *row)
+                    self.assertRollupsEqual(store)
+                store.delete_many(ids[1::3])
+                self.assertRollupsEqual(store)
+                self.assertEqual(store.verify_totals(), [])
+
+    def test_month_bounds_leave_out_undated_rows(self):
+        store = _edited_store(6)
+        months = {line[0] for line in store.rollups(month_from='2024-01', month_to='2024-02')}
+        self.assertEqual(months, {'2024-01', '2024-02'})
+        self.assertEqual(store.rollups('transfer'), [])
+
+
+class CompactionTests(unittest.TestCase):
+    def test_deletes_compact_the_columns_and_keep_ids(self):
+        store = TransactionStore()
+        ids = store.add_many(_random_rows(random.Random(7), 2 * COMPACT_MIN_DEAD))
+        kept = _live(store)
+        doomed = ids[::2][:COMPACT_MIN_DEAD]
+        for transaction_id in doomed:
+            del kept[transaction_id]
+        store.delete_many(doomed[:-1])
+        self.assertEqual(store.dead, COMPACT_MIN_DEAD - 1)
+        store.delete(doomed[-1])
+        self.assertEqual(store.dead, 0)
+        self.assertEqual(len(store.amounts), len(kept))
+        self.assertEqual(_live(store), kept)
+        for transaction_id, row in kept.items():
+            self.assertEqual(store.get(transaction_id), row)
+        self.assertEqual(store.verify_totals(), [])
+        self.assertEqual(sorted(store.ids[row] for row in store.search(date_from='2024-02-01')),
+                         sorted(transaction_id for transaction_id, row in kept.items()
+                                if 'someday' != row[3] >= '2024-02-01'))
+        self.assertEqual(store.add('income', 'gift', 1, '2024-01-01'), len(kept))
+        self.assertEqual(store.ids[-1], ids[-1] + 1)
+        for transaction_id in doomed:
+            self.assertFalse(store.has_id(transaction_id))
+
+    def test_deleted_ids_stay_gone_until_compaction(self):
+        store = TransactionStore()
+        ids = store.add_many([('expense', 'food', 1, '2024-01-01')] * 10)
+        store.delete_many(ids[:3])
+        self.assertEqual(store.dead, 3)
+        self.assertEqual(len(store), 7)
+        with self.assertRaises(KeyError):
+            store.delete(ids[0])
+        store.compact()
+        self.assertEqual([store.ids[row] for row in store.live_rows()], ids[3:])
+
+
+if __name__ == "__main__":
+    unittest.main()
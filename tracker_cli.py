@@ -0,0 +1,177 @@
+import argparse
+import contextlib
+import json
+import sys
+
+import instrumentation
+from bulk_import import import_transactions, print_import_summary
+from save_manager import SaveManager, atomic_write
+from storage_backends import get_backend
+from transaction_batch import BatchError, add_many
+
+# Non-interactive commands for scripts and cron jobs, e.g.
+#   python tracker_cli.py add expense rent 950 2024-05-01
+#   python tracker_cli.py summary --json
+# Each run is a short-lived process, so only what a command needs is loaded: summaries and
+# searches go to the backend when it can answer them without reading every transaction,
+# and nothing here imports tkinter.
+
+EXPORT_FORMATS = ('csv', 'json')
+
+
+def summary_fields(summary):
+    #The summary --json object for a {type: (total, count)} summary.
+    income = summary.get('income', (0, 0))[0]
+    expense = summary.get('expense', (0, 0))[0]
+    return {"income": income, "expense": expense, "net": income - expense,
+            "counts": {name: count for name, (_, count) in summary.items()}}
+
+
+def write_export(store, export_format, file):
+    if export_format == 'json':
+        json.dump(store.to_nested(), file, indent=4)
+        file.write('\n')
+    else:
+        # The "type,category,amount,date" lines the import command reads back.
+        for row in store.ordered_rows():
+            transaction_type, category, amount, date = store.row(row)
+            file.write(f"{transaction_type},{category},{amount},{date}\n")
+
+
+def load(storage):
+    with instrumentation.measure("load") as sample:
+        store = storage.load()
+        sample.rows = len(store)
+    return store
+
+
+def command_add(storage, options):
+    store = load(storage)
+    saver = SaveManager(storage, quiet_period=0)
+    try:
+        ids = add_many(store, saver, [(options.type, options.category, options.amount, options.date)])
+    except BatchError as e:
+        print(e.problems[0][1], file=sys.stderr)
+        return 1
+    saver.flush()
+    print(f"Added transaction {ids[0]}.")
+    return 0
+
+
+def command_import(storage, options):
+    store = load(storage)
+    saver = SaveManager(storage, quiet_period=0)
+    first_row = len(store.amounts)
+    try:
+        result = import_transactions(options.file, store, options.parallel, options.workers)
+    except FileNotFoundError:
+        print(f"File not found: {options.file}", file=sys.stderr)
+        return 1
+    print_import_summary(result)
+    if result["imported"]:
+        saver.commit_rows(store, first_row)
+    return 0 if not result["rejected"] else 1
+
+
+@instrumentation.timed("summary")
+def command_summary(storage, options):
+    if storage.queries_without_loading:
+        # Answered from a manifest, SQL or a mapped file without loading every transaction.
+        summary = storage.summary()
+    else:
+        store = load(storage)
+        counts = store.counts_by_type()
+        summary = {name: (total, counts[name]) for name, total in store.totals_by_type().items()}
+    fields = summary_fields(summary)
+    if options.json:
+        print(json.dumps(fields))
+    else:
+        print("Total Income:", fields["income"])
+        print("Total Expense:", fields["expense"])
+        print("Net Total:", fields["net"])
+    return 0
+
+
+def command_search(storage, options):
+    filters = (options.type, options.date_from, options.date_to, options.amount, options.min, options.max)
+    try:
+        with instrumentation.measure("search (backend)") as sample:
+            matches = storage.search(*filters)
+            sample.rows = len(matches)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    if options.json:
+        print(json.dumps([{"type": row_type, "category": category, "amount": amount, "date": date}
+                          for row_type, category, amount, date in matches]))
+        return 0
+    for row_type, category, amount, date in matches:
+        print(f"{date}  {row_type.capitalize()}  {category}  Amount: {amount}")
+    print(f"{len(matches)} matching transaction(s).")
+    return 0
+
+
+def command_export(storage, options):
+    store = load(storage)
+    with (atomic_write(options.output) if options.output else contextlib.nullcontext(sys.stdout)) as file:
+        write_export(store, options.format, file)
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="tracker_cli.py",
+                                     description="Add, import, summarise, search and export transactions "
+                                                 "without the interactive menu.")
+    parser.add_argument('--backend', help="storage backend (default: $FINANCE_TRACKER_BACKEND or json)")
+    commands = parser.add_subparsers(dest='command', required=True, metavar='command')
+
+    add = commands.add_parser('add', help="add one transaction")
+    add.add_argument('type', help="income or expense")
+    add.add_argument('category')
+    add.add_argument('amount')
+    add.add_argument('date', help="YYYY-MM-DD")
+    add.set_defaults(run=command_add)
+
+    bulk = commands.add_parser('import', help="import a type,category,amount,date file")
+    bulk.add_argument('file')
+    mode = bulk.add_mutually_exclusive_group()
+    mode.add_argument('--parallel', action='store_true', default=None, help="always use worker processes")
+    mode.add_argument('--serial', dest='parallel', action='store_false', help="never use worker processes")
+    bulk.add_argument('--workers', type=int)
+    bulk.set_defaults(run=command_import)
+
+    summary = commands.add_parser('summary', help="total income, expense and net")
+    summary.add_argument('--json', action='store_true', help="print JSON instead of text")
+    summary.set_defaults(run=command_summary)
+
+    search = commands.add_parser('search', help="list matching transactions")
+    search.add_argument('--type')
+    search.add_argument('--from', dest='date_from', metavar='YYYY-MM-DD')
+    search.add_argument('--to', dest='date_to', metavar='YYYY-MM-DD')
+    search.add_argument('--amount', type=float)
+    search.add_argument('--min', type=float)
+    search.add_argument('--max', type=float)
+    search.add_argument('--json', action='store_true', help="print JSON instead of text")
+    search.set_defaults(run=command_search)
+
+    export = commands.add_parser('export', help="write every transaction as CSV or JSON")
+    export.add_argument('--format', choices=EXPORT_FORMATS, default='csv')
+    export.add_argument('--output', help="file to write (default: standard output)")
+    export.set_defaults(run=command_export)
+    return parser
+
+
+def main(argv=None):
+    argv = instrumentation.configure_from_environment(sys.argv[1:] if argv is None else argv)
+    options = build_parser().parse_args(argv)
+    try:
+        storage = get_backend(options.backend)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    instrumentation.add_section("Locking", storage.lock.report)
+    return options.run(storage, options)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
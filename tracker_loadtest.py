@@ -0,0 +1,252 @@
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmark import generate_transactions, write_json_dataset
+
+# Load test for tracker_server.py on this machine, e.g.
+#   python tracker_server.py &
+#   python tracker_loadtest.py --connections 32 --requests 5000 --mix add=1,search=2,summary=1
+#   python tracker_loadtest.py --spawn --backend sqlite --seed-size 100000
+# Every connection is a keep-alive client with one request in flight, so --connections is
+# how many requests the server is handling at once.
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tracker_server.py')
+
+ENDPOINTS = ('add', 'batch', 'search', 'summary', 'export')
+DEFAULT_MIX = 'add=2,batch=1,search=4,summary=3'
+PERCENTILES = (50, 99)
+
+# Transactions generated for request bodies and to seed a spawned server.
+SAMPLE_DAYS = 365
+
+
+def parse_mix(text):
+    #{endpoint: weight} from "add=2,search=4,...".
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"Unknown endpoint '{name}'. Choose from: {', '.join(ENDPOINTS)}.")
+        try:
+            mix[name] = float(weight) if weight else 1.0
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Invalid weight '{weight}' for {name}.")
+    if not any(weight > 0 for weight in mix.values()):
+        raise argparse.ArgumentTypeError("At least one endpoint needs a positive weight.")
+    return mix
+
+
+def percentile(values, percent):
+    #Linear interpolation between closest ranks of sorted values.
+    position = (len(values) - 1) * percent / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+class RequestMaker:
+    #Builds (method, target, body) for each kind of request from a pool of synthetic rows.
+    def __init__(self, rows, batch_size, rng):
+        self.rows = rows
+        self.batch_size = batch_size
+        self.rng = rng
+        self.first_day = datetime.date.fromisoformat(rows[0][3]).toordinal()
+        self.last_day = datetime.date.fromisoformat(rows[-1][3]).toordinal()
+
+    def transaction(self):
+        transaction_type, category, amount, date = self.rng.choice(self.rows)
+        return {"type": transaction_type, "category": category, "amount": amount, "date": date}
+
+    def make(self, kind):
+        if kind == 'add':
+            return 'POST', '/transactions', json.dumps(self.transaction()).encode('utf-8')
+        if kind == 'batch':
+            body = {"transactions": [self.transaction() for _ in range(self.batch_size)]}
+            return 'POST', '/transactions/batch', json.dumps(body).encode('utf-8')
+        if kind == 'search':
+            # A month of expenses within an amount band, like the GUI's search panel.
+            start = self.rng.randint(self.first_day, max(self.first_day, self.last_day - 30))
+            date_from = datetime.date.fromordinal(start).isoformat()
+            date_to = datetime.date.fromordinal(start + 30).isoformat()
+            return 'GET', f'/transactions?type=expense&from={date_from}&to={date_to}&min=10&max=500', b''
+        if kind == 'summary':
+            return 'GET', '/summary', b''
+        return 'GET', '/export?format=csv', b''
+
+
+async def send(reader, writer, host, method, target, body):
+    #Send one request on an open connection and return the response status.
+    head = (f"{method} {target} HTTP/1.1\r\nHost: {host}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n")
+    writer.write(head.encode('latin-1') + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    await reader.readexactly(length)
+    return status
+
+
+async def run_client(host, port, plan, maker, latencies, errors):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while plan:
+            kind = plan.pop()
+            method, target, body = maker.make(kind)
+            started = time.perf_counter()
+            try:
+                status = await send(reader, writer, host, method, target, body)
+            except (ConnectionError, asyncio.IncompleteReadError, ValueError, IndexError):
+                errors[kind] = errors.get(kind, 0) + 1
+                writer.close()
+                reader, writer = await asyncio.open_connection(host, port)
+                continue
+            latencies.setdefault(kind, []).append(time.perf_counter() - started)
+            if status != 200:
+                errors[kind] = errors.get(kind, 0) + 1
+    finally:
+        writer.close()
+
+
+async def run_load(host, port, connections, plan, maker):
+    latencies = {}
+    errors = {}
+    started = time.perf_counter()
+    await asyncio.gather(*(run_client(host, port, plan, maker, latencies, errors) for _ in range(connections)))
+    return time.perf_counter() - started, latencies, errors
+
+
+def summarise(seconds, latencies, errors):
+    #One result per endpoint plus an "all" row: requests, errors, req/s and latency percentiles.
+    results = []
+    everything = []
+    for kind in ENDPOINTS:
+        if kind not in latencies and kind not in errors:
+            continue
+        values = sorted(latencies.get(kind, []))
+        everything.extend(values)
+        results.append(result_row(kind, values, errors.get(kind, 0), seconds))
+    results.append(result_row('all', sorted(everything), sum(errors.values()), seconds))
+    return results
+
+
+def result_row(kind, values, errors, seconds):
+    row = {"endpoint": kind, "requests": len(values), "errors": errors,
+           "requests_per_second": len(values) / seconds if seconds else 0.0}
+    for percent in PERCENTILES:
+        row[f"p{percent}_ms"] = percentile(values, percent) * 1000 if values else None
+    return row
+
+
+def print_results(results, seconds):
+    print(f"{'endpoint':<9} {'requests':>9} {'errors':>7} {'req/s':>10} {'p50 ms':>9} {'p99 ms':>9}")
+    for row in results:
+        p50 = f"{row['p50_ms']:>9.2f}" if row['p50_ms'] is not None else f"{'-':>9}"
+        p99 = f"{row['p99_ms']:>9.2f}" if row['p99_ms'] is not None else f"{'-':>9}"
+        print(f"{row['endpoint']:<9} {row['requests']:>9} {row['errors']:>7} "
+              f"{row['requests_per_second']:>10.1f} {p50} {p99}")
+    print(f"Elapsed: {seconds:.2f} s")
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def spawn_server(directory, backend, rows):
+    #Start tracker_server.py in directory over rows; returns (process, port) once it listens.
+    write_json_dataset(rows, os.path.join(directory, 'transactions.json'))
+    if backend != 'json':
+        from storage_backends import get_backend, migrate_from_json
+        previous = os.getcwd()
+        os.chdir(directory)
+        try:
+            migrate_from_json(get_backend(backend))
+        finally:
+            os.chdir(previous)
+    port = free_port()
+    process = subprocess.Popen([sys.executable, SERVER_SCRIPT, '--backend', backend, '--port', str(port)],
+                               cwd=directory, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    if not line.startswith('Serving'):
+        process.kill()
+        raise RuntimeError("tracker_server.py did not start.")
+    return process, port
+
+
+def stop_server(process):
+    # The server writes anything still queued when it is terminated.
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure tracker_server.py throughput and latency.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--connections', type=int, default=16, help="requests in flight at once")
+    parser.add_argument('--requests', type=int, default=2000, help="requests to send in total")
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"endpoint weights (default: {DEFAULT_MIX})")
+    parser.add_argument('--batch-size', type=int, default=50, help="transactions per batch request")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--spawn', action='store_true',
+                        help="start a server on a free port in a temporary directory for the run")
+    parser.add_argument('--backend', default='json', help="storage backend of a spawned server")
+    parser.add_argument('--seed-size', type=int, default=10000, help="transactions a spawned server starts with")
+    parser.add_argument('--json', action='store_true', help="print JSON instead of a table")
+    options = parser.parse_args(argv)
+
+    rng = random.Random(options.seed)
+    rows = generate_transactions(max(options.seed_size, 1000), days=SAMPLE_DAYS, seed=options.seed)
+    kinds = list(options.mix)
+    plan = rng.choices(kinds, weights=[options.mix[kind] for kind in kinds], k=options.requests)
+    maker = RequestMaker(rows, options.batch_size, rng)
+
+    with tempfile.TemporaryDirectory() as directory:
+        process = None
+        host, port = options.host, options.port
+        if options.spawn:
+            process, port = spawn_server(directory, options.backend, rows[:options.seed_size])
+            host = '127.0.0.1'
+        try:
+            seconds, latencies, errors = asyncio.run(run_load(host, port, options.connections, plan, maker))
+        except ConnectionRefusedError:
+            print(f"Nothing is listening on {host}:{port}. Start tracker_server.py or pass --spawn.",
+                  file=sys.stderr)
+            return 1
+        finally:
+            if process is not None:
+                stop_server(process)
+
+    results = summarise(seconds, latencies, errors)
+    if options.json:
+        print(json.dumps({"connections": options.connections, "seconds": seconds, "results": results}, indent=4))
+    else:
+        print_results(results, seconds)
+    return 1 if sum(errors.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
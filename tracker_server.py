@@ -0,0 +1,360 @@
+import argparse
+import asyncio
+import concurrent.futures
+import io
+import contextlib
+import json
+import signal
+import sys
+import time
+import urllib.parse
+
+import instrumentation
+from save_manager import SaveManager
+from storage_backends import get_backend
+from tracker_cli import EXPORT_FORMATS, summary_fields, write_export
+from transaction_batch import BatchError, add_many
+from transaction_journal import add_records
+from transaction_validation import parse_amount
+
+# Local HTTP/JSON service over one loaded store, for dashboards and import bots:
+#   POST /transactions          {"type", "category", "amount", "date"}  -> {"id"}
+#   POST /transactions/batch    {"transactions": [{...}, ...]}          -> {"ids"}
+#   GET  /transactions?type=&from=&to=&amount=&min=&max=                -> [{"id", "type", ...}, ...]
+#   GET  /summary                                                       -> {"income", "expense", "net", "counts"}
+#   GET  /export?format=csv|json
+# Every mutation goes through one writer task, which applies the requests waiting for it as
+# a group and persists the group in one write. Reads are answered on the event loop from
+# the store's indexes between groups, so they never see a half-applied change. The write
+# runs on a writer thread so reads keep being answered meanwhile; merging in what other
+# processes wrote changes the store, so that part is handed back to the event loop.
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# Most add requests the writer folds into one write.
+WRITE_GROUP_LIMIT = 256
+MAX_BODY_BYTES = 64 * 1024 * 1024
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class WriteMetrics:
+    #How the writer task has grouped add requests so far.
+    def __init__(self):
+        self.groups = 0
+        self.requests = 0
+        self.largest = 0
+
+    def report(self):
+        average = self.requests / self.groups if self.groups else 0.0
+        return [f"Write groups: {self.groups} ({self.requests} request(s), "
+                f"average {average:.1f}, largest {self.largest})"]
+
+
+class TextBody:
+    #A response that is not a JSON value, e.g. a CSV export.
+    def __init__(self, text, content_type):
+        self.text = text
+        self.content_type = content_type
+
+
+def transaction_row(entry):
+    #(type, category, amount, date) from a request's transaction object.
+    if not isinstance(entry, dict):
+        return None
+    return (entry.get('type'), entry.get('category'), entry.get('amount'), entry.get('date'))
+
+
+class TrackerService:
+    def __init__(self, storage, store):
+        self.storage = storage
+        self.store = store
+        # The writer decides when to write, so nothing waits for a quiet period.
+        self.saver = SaveManager(storage, quiet_period=0)
+        self.saver.merge_runner = self._on_loop
+        self.metrics = WriteMetrics()
+        self._queue = None
+        self._loop = None
+        # One thread makes every write, in order.
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='writer')
+
+    async def run_writer(self):
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        while True:
+            group = [await self._queue.get()]
+            while len(group) < WRITE_GROUP_LIMIT and not self._queue.empty():
+                group.append(self._queue.get_nowait())
+            try:
+                await self._commit(group)
+            except Exception as e:
+                # Keep the writer alive for the next group; this one's requests get the error.
+                for _, future in group:
+                    if not future.done():
+                        future.set_exception(HttpError(500, str(e)))
+
+    async def _commit(self, group):
+        # One request's invalid entry only rejects that request, not the rest of the group.
+        applied = []
+        for rows, future in group:
+            try:
+                ids = add_many(self.store, None, rows)
+            except BatchError as e:
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            applied.append((ids, future))
+        if not applied:
+            return
+        self.metrics.groups += 1
+        self.metrics.requests += len(applied)
+        self.metrics.largest = max(self.metrics.largest, len(applied))
+        records = add_records(self.store, [self.store.position(transaction_id)
+                                           for ids, _ in applied for transaction_id in ids])
+        try:
+            await self._loop.run_in_executor(self._executor, self.saver.record, self.store, records)
+        except Exception as e:
+            # Nothing of the group was written, so it comes back out of the store and the saver's
+            # queue; a client retrying the 500 must not end up with the rows twice.
+            self.saver.discard(records)
+            self.store.delete_many([record['id'] for record in records])
+            for _, future in applied:
+                if not future.done():
+                    future.set_exception(HttpError(500, f"Could not save: {e}"))
+            return
+        # Saving may have renumbered ids another process took first.
+        position = 0
+        for ids, future in applied:
+            if not future.done():
+                future.set_result([record['id'] for record in records[position:position + len(ids)]])
+            position += len(ids)
+
+    def _on_loop(self, function, *args, **kwargs):
+        #Call function on the event loop and return its result; the writer thread waits for it.
+        try:
+            on_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop or self._loop is None or self._loop.is_closed():
+            return function(*args, **kwargs)
+
+        async def call():
+            return function(*args, **kwargs)
+        return asyncio.run_coroutine_threadsafe(call(), self._loop).result()
+
+    async def close(self):
+        #Write anything still queued, after any write in progress, and stop the writer thread.
+        await asyncio.get_running_loop().run_in_executor(self._executor, self.saver.flush)
+        self._executor.shutdown()
+
+    async def add(self, rows):
+        #Queue rows for the writer and wait until they are saved; returns their ids.
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((rows, future))
+        return await future
+
+    async def handle_add(self, query, body):
+        ids = await self.add([transaction_row(body)])
+        return {"id": ids[0]}
+
+    async def handle_batch_add(self, query, body):
+        entries = body.get('transactions') if isinstance(body, dict) else None
+        if not isinstance(entries, list):
+            raise HttpError(400, 'Expected {"transactions": [...]}.')
+        ids = await self.add([transaction_row(entry) for entry in entries]) if entries else []
+        return {"ids": ids}
+
+    async def handle_search(self, query, body):
+        filters = [query.get('type'), query.get('from'), query.get('to')]
+        for name in ('amount', 'min', 'max'):
+            if name not in query:
+                filters.append(None)
+                continue
+            # Same rules as an entered amount, so nan and inf are rejected too.
+            amount, message = parse_amount(query[name])
+            if amount is None:
+                raise HttpError(400, f"Invalid {name} '{query[name]}': {message}")
+            filters.append(amount)
+        try:
+            rows = self.store.search(*filters)
+        except ValueError as e:
+            raise HttpError(400, str(e))
+        store = self.store
+        return [dict(zip(("type", "category", "amount", "date"), store.row(row)), id=store.ids[row])
+                for row in rows]
+
+    async def handle_summary(self, query, body):
+        counts = self.store.counts_by_type()
+        return summary_fields({name: (total, counts[name])
+                               for name, total in self.store.totals_by_type().items()})
+
+    async def handle_export(self, query, body):
+        export_format = query.get('format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            raise HttpError(400, f"Unknown export format '{export_format}'. Choose one of: "
+                                 f"{', '.join(EXPORT_FORMATS)}.")
+        file = io.StringIO()
+        write_export(self.store, export_format, file)
+        return TextBody(file.getvalue(), 'application/json' if export_format == 'json' else 'text/csv')
+
+    ROUTES = {
+        ('POST', '/transactions'): ('api add', handle_add),
+        ('POST', '/transactions/batch'): ('api batch add', handle_batch_add),
+        ('GET', '/transactions'): ('api search', handle_search),
+        ('GET', '/summary'): ('api summary', handle_summary),
+        ('GET', '/export'): ('api export', handle_export),
+    }
+
+    async def dispatch(self, method, target, body):
+        url = urllib.parse.urlsplit(target)
+        route = self.ROUTES.get((method, url.path))
+        if route is None:
+            if any(path == url.path for _, path in self.ROUTES):
+                raise HttpError(405, f"{method} is not supported on {url.path}.")
+            raise HttpError(404, f"No such endpoint: {url.path}.")
+        name, handler = route
+        query = {key: values[-1] for key, values in urllib.parse.parse_qs(url.query).items()}
+        if method == 'POST':
+            try:
+                body = json.loads(body or b'null')
+            except ValueError:
+                raise HttpError(400, "Request body is not valid JSON.")
+        started = time.perf_counter()
+        try:
+            return await handler(self, query, body)
+        finally:
+            instrumentation.record(name, time.perf_counter() - started)
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except HttpError as e:
+                    # The rest of the stream cannot be trusted to start at a request.
+                    writer.write(encode_response(e.status, {"error": str(e)}, False))
+                    break
+                if request is None:
+                    break
+                method, target, keep_alive, body = request
+                status = 200
+                try:
+                    payload = await self.dispatch(method, target, body)
+                except HttpError as e:
+                    status, payload = e.status, {"error": str(e)}
+                except BatchError as e:
+                    status, payload = 400, {"error": str(e), "problems": [
+                        {"entry": position, "message": message} for position, message in e.problems]}
+                writer.write(encode_response(status, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+async def read_request(reader):
+    #(method, target, keep_alive, body) for the next request on a connection, or None once
+    #the client has closed it.
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, version = line.decode('latin-1').split()
+    except ValueError:
+        raise HttpError(400, "Malformed request line.")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip().lower()
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise HttpError(400, "Invalid Content-Length.")
+    if length > MAX_BODY_BYTES:
+        raise HttpError(413, f"Request body is larger than {MAX_BODY_BYTES} bytes.")
+    body = await reader.readexactly(length) if length else b''
+    if version == 'HTTP/1.0':
+        keep_alive = headers.get('connection') == 'keep-alive'
+    else:
+        keep_alive = headers.get('connection') != 'close'
+    return method.upper(), target, keep_alive, body
+
+
+def encode_response(status, payload, keep_alive):
+    if isinstance(payload, TextBody):
+        content_type = payload.content_type
+        data = payload.text.encode('utf-8')
+    else:
+        content_type = 'application/json'
+        data = json.dumps(payload).encode('utf-8')
+    head = (f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: {content_type}; charset=utf-8\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    return head.encode('latin-1') + data
+
+
+async def serve(service, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    writer_task = asyncio.create_task(service.run_writer())
+    server = await asyncio.start_server(service.handle_connection, host, port)
+    print(f"Serving {len(service.store)} transaction(s) from {service.storage.name} storage "
+          f"on http://{host}:{port}", flush=True)
+    stopping = asyncio.Event()
+    with contextlib.suppress(NotImplementedError):
+        # Windows has no loop signal handlers; Ctrl+C still stops the server there.
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stopping.set)
+    try:
+        async with server:
+            await stopping.wait()
+    finally:
+        writer_task.cancel()
+        await service.close()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="tracker_server.py",
+                                     description="Serve the transactions as a local HTTP/JSON API.")
+    parser.add_argument('--backend', help="storage backend (default: $FINANCE_TRACKER_BACKEND or json)")
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    return parser
+
+
+def main(argv=None):
+    argv = instrumentation.configure_from_environment(sys.argv[1:] if argv is None else argv)
+    options = build_parser().parse_args(argv)
+    try:
+        storage = get_backend(options.backend)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    with instrumentation.measure("load") as sample:
+        store = storage.load()
+        sample.rows = len(store)
+    service = TrackerService(storage, store)
+    instrumentation.add_section("Saving", service.saver.metrics.report)
+    instrumentation.add_section("Writer", service.metrics.report)
+    instrumentation.add_section("Locking", storage.lock.report)
+    try:
+        asyncio.run(serve(service, options.host, options.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+import contextlib
+
+from instrumentation import timed
+from transaction_validation import parse_transaction
+
+
+class BatchError(ValueError):
+    #A batch was rejected without changing anything. problems lists (position in the batch,
+    #message) for every entry that was not valid, not just the first.
+    def __init__(self, problems):
+        self.problems = problems
+        position, message = problems[0]
+        more = f" (and {len(problems) - 1} more)" if len(problems) > 1 else ""
+        super().__init__(f"Entry {position}: {message}{more}")
+
+
+def _locked(saver):
+    # Changes go into the store under the save lock so a background write never sees half a batch.
+    return saver.lock if saver is not None else contextlib.nullcontext()
+
+
+def _parse_rows(rows, problems, offset=0):
+    parsed = []
+    for position, row in enumerate(rows):
+        try:
+            transaction, message = parse_transaction(*row[offset:])
+        except TypeError:
+            transaction, message = None, "Expected type, category, amount and date."
+        if transaction is None:
+            problems.append((position, message))
+        parsed.append(transaction)
+    return parsed
+
+
+def _check_ids(store, transaction_ids, problems):
+    seen = set()
+    for position, transaction_id in enumerate(transaction_ids):
+        if type(transaction_id) is not int or not store.has_id(transaction_id):
+            problems.append((position, f"No transaction with id {transaction_id}."))
+        elif transaction_id in seen:
+            problems.append((position, f"Transaction {transaction_id} appears more than once."))
+        else:
+            seen.add(transaction_id)
+
+
+def _replaced(store, transaction_id):
+    # The record names where the replaced transaction was stored (e.g. which month's shard).
+    transaction_type, category, _, date = store.get(transaction_id)
+    return {"type": transaction_type, "category": category, "id": transaction_id, "old_date": date}
+
+
+@timed("batch add", rows=lambda result, store, saver, rows, **kwargs: len(rows))
+def add_many(store, saver, rows, flush=True):
+    #Validate (type, category, amount, date) rows and add them all as one batch, queued for
+    #the backend as one change. Returns the new ids.
+    #Nothing is applied unless every entry is valid. saver may be None to change only the store.
+    #Ids are final only once the batch is written, since saving renumbers ids another process
+    #took first, so the saver is flushed before they are returned. flush=False leaves the write
+    #to the saver's quiet period and returns None for callers that do not need the ids.
+    problems = []
+    parsed = _parse_rows(rows, problems)
+    if problems:
+        raise BatchError(problems)
+    with _locked(saver):
+        ids = store.add_many(parsed)
+        if saver is not None and ids:
+            records = [{"op": "add", "type": transaction_type, "category": category, "amount": amount,
+                        "date": date, "id": transaction_id}
+                       for (transaction_type, category, amount, date), transaction_id in zip(parsed, ids)]
+            saver.record(store, records)
+            if not flush:
+                return None
+            if saver.pending():
+                saver.flush()
+            ids = [record['id'] for record in records]
+    return ids
+
+
+@timed("batch update", rows=lambda result, *args, **kwargs: result)
+def update_many(store, saver, changes):
+    #Validate (id, type, category, amount, date) changes and apply them as one batch.
+    #Returns the number of transactions updated.
+    problems = []
+    with _locked(saver):
+        _check_ids(store, [change[0] if change else None for change in changes], problems)
+        parsed = _parse_rows(changes, problems, offset=1)
+        if problems:
+            raise BatchError(sorted(problems))
+        records = []
+        for change, (new_type, new_category, amount, date) in zip(changes, parsed):
+            records.append(dict(op="update", **_replaced(store, change[0]), new_type=new_type,
+                                new_category=new_category, amount=amount, date=date))
+        store.update_many([(change[0],) + transaction for change, transaction in zip(changes, parsed)])
+        if saver is not None and records:
+            saver.record(store, records)
+    return len(records)
+
+
+@timed("batch delete", rows=lambda result, *args, **kwargs: result)
+def delete_many(store, saver, transaction_ids):
+    #Delete every listed transaction as one batch; returns how many were deleted.
+    problems = []
+    with _locked(saver):
+        _check_ids(store, transaction_ids, problems)
+        if problems:
+            raise BatchError(problems)
+        records = [dict(op="delete", **_replaced(store, transaction_id)) for transaction_id in transaction_ids]
+        store.delete_many(transaction_ids)
+        if saver is not None and records:
+            saver.record(store, records)
+    return len(records)
@@ -0,0 +1,211 @@
+import datetime
+import itertools
+import json
+import math
+import mmap
+import struct
+import sys
+from array import array
+
+from transaction_store import TransactionStore, parse_date_bound
+
+# Layout of a transactions.bin file (all little-endian):
+#   header   magic, format version, row count, string table offset and length
+#   columns  transaction id (uint64), amount (float64), date (int32), type code (uint16),
+#            category code (uint32), each block padded to 8 bytes
+#   strings  UTF-8 JSON with the type names, category names, non-canonical date strings and
+#            the next id to hand out (ids of deleted transactions are not reused)
+# Rows are written grouped by type and category, in the order the nested view lists them.
+# Amounts are stored exactly as the store holds them, so sub-cent amounts survive a round trip.
+# Versions 1 and 2 stored whole cents (int64) and version 1 has no id column; their rows
+# are numbered in order and their amounts converted when read.
+MAGIC = b'FTRB'
+FORMAT_VERSION = 3
+HEADER = struct.Struct('<4sHxxQQQ')
+
+COLUMNS = [('ids', 'Q'), ('amounts', 'd'), ('dates', 'i'), ('type_codes', 'H'), ('category_codes', 'I')]
+CENTS_COLUMNS = [('ids', 'Q'), ('amount_cents', 'q')] + COLUMNS[2:]
+COLUMNS_BY_VERSION = {1: CENTS_COLUMNS[1:], 2: CENTS_COLUMNS, 3: COLUMNS}
+
+
+def _padded(size):
+    return (size + 7) & ~7
+
+
+def _column_offsets(count, columns=COLUMNS):
+    #Byte offset of each column block for a file holding count rows.
+    offsets = {}
+    offset = HEADER.size
+    for name, typecode in columns:
+        offsets[name] = offset
+        offset += _padded(count * array(typecode).itemsize)
+    return offsets, offset
+
+
+def write_binary(store, file):
+    #Write every transaction in the store to a binary file object in the binary layout.
+    rows = list(store.ordered_rows())
+    columns = {
+        'ids': array('Q', (store.ids[row] for row in rows)),
+        'amounts': array('d', (store.amounts[row] for row in rows)),
+        'dates': array('i', (store.dates[row] for row in rows)),
+        'type_codes': array('H', (store.type_codes[row] for row in rows)),
+        'category_codes': array('I', (store.category_codes[row] for row in rows)),
+    }
+    strings = json.dumps({"types": store.type_names, "categories": store.category_names,
+                          "raw_dates": store.raw_dates, "next_id": store.next_id}).encode('utf-8')
+    offsets, strings_offset = _column_offsets(len(rows))
+    file.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(rows), strings_offset, len(strings)))
+    for name, _ in COLUMNS:
+        column = columns[name]
+        if sys.byteorder != 'little':
+            column.byteswap()
+        data = column.tobytes()
+        file.write(data)
+        file.write(b'\0' * (_padded(len(data)) - len(data)))
+    file.write(strings)
+
+
+class MappedTransactions:
+    #Read-only view of a transactions.bin file. The columns are memoryviews straight into the
+    #mapped file, so opening one costs the same however many rows it holds.
+    def __init__(self, filepath):
+        self._file = open(filepath, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # An empty file cannot be mapped.
+            self._file.close()
+            raise ValueError(f"{filepath} is not a transactions file.")
+        self._views = []
+        try:
+            self._open(filepath)
+        except Exception:
+            self.close()
+            raise
+
+    def _open(self, filepath):
+        if len(self._map) < HEADER.size:
+            raise ValueError(f"{filepath} is not a transactions file.")
+        magic, version, count, strings_offset, strings_length = HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise ValueError(f"{filepath} is not a transactions file.")
+        if version not in COLUMNS_BY_VERSION:
+            raise ValueError(f"{filepath} uses unsupported format version {version}.")
+        columns = COLUMNS_BY_VERSION[version]
+        offsets, expected_strings_offset = _column_offsets(count, columns)
+        if strings_offset != expected_strings_offset or strings_offset + strings_length > len(self._map):
+            raise ValueError(f"{filepath} is truncated.")
+        self.count = count
+        self.ids = None
+        buffer = memoryview(self._map)
+        self._views.append(buffer)
+        for name, typecode in columns:
+            start = offsets[name]
+            raw = buffer[start:start + count * array(typecode).itemsize]
+            self._views.append(raw)
+            setattr(self, name, self._column(raw, typecode))
+        if version < 3:
+            self.amounts = array('d', (cents / 100 for cents in self.amount_cents))
+        tables = json.loads(bytes(buffer[strings_offset:strings_offset + strings_length]).decode('utf-8'))
+        self.type_names = tables["types"]
+        self.category_names = tables["categories"]
+        self.raw_dates = tables["raw_dates"]
+        # Files written before it was stored start after their highest id.
+        self.next_id = tables.get("next_id", 1)
+
+    def _column(self, raw, typecode):
+        if sys.byteorder == 'little':
+            view = raw.cast(typecode)
+            self._views.append(view)
+            return view
+        # Big-endian machines need a swapped copy.
+        column = array(typecode, raw.tobytes())
+        column.byteswap()
+        return column
+
+    def close(self):
+        # Views into the map have to be released before the map itself can be closed.
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def row(self, row):
+        date = self.dates[row]
+        return (self.type_names[self.type_codes[row]],
+                self.category_names[self.category_codes[row]],
+                self.amounts[row],
+                datetime.date.fromordinal(date).isoformat() if date > 0 else self.raw_dates[-date - 1])
+
+    def rows(self, start=0, stop=None):
+        #(type, category, amount, date, id) tuples for rows start..stop.
+        stop = self.count if stop is None else min(stop, self.count)
+        if self.ids is None:
+            return [self.row(row) + (row + 1,) for row in range(start, stop)]
+        return [self.row(row) + (self.ids[row],) for row in range(start, stop)]
+
+    def totals_by_type(self):
+        #{type: (total, count)} over the mapped columns, summed exactly like a loaded store's totals.
+        totals = {}
+        for code in sorted(set(self.type_codes)):
+            amounts = list(itertools.compress(self.amounts, (type_code == code for type_code in self.type_codes)))
+            totals[self.type_names[code]] = (math.fsum(amounts), len(amounts))
+        return totals
+
+    def search(self, transaction_type=None, date_from=None, date_to=None,
+               amount=None, amount_min=None, amount_max=None):
+        #Positions of rows matching every given filter, scanning the mapped columns.
+        if amount is not None:
+            amount_min = amount_max = amount
+        rows = range(self.count)
+        if transaction_type:
+            wanted = {code for code, name in enumerate(self.type_names)
+                      if name.lower() == transaction_type.lower()}
+            type_codes = self.type_codes
+            rows = [row for row in rows if type_codes[row] in wanted]
+        if date_from or date_to:
+            # Non-canonical dates are stored as negative codes and never match a range.
+            low = parse_date_bound(date_from) if date_from else 1
+            high = parse_date_bound(date_to) if date_to else sys.maxsize
+            dates = self.dates
+            rows = [row for row in rows if low <= dates[row] <= high]
+        if amount_min is not None or amount_max is not None:
+            amounts = self.amounts
+            rows = [row for row in rows if (amount_min is None or amounts[row] >= amount_min) and
+                                           (amount_max is None or amounts[row] <= amount_max)]
+        return list(rows)
+
+    def to_store(self):
+        #Copy the mapped columns into a mutable TransactionStore.
+        store = TransactionStore.from_columns(_copy(self.amounts, 'd'), _copy(self.dates, 'i'), _copy(self.type_codes, 'H'),
+                                              _copy(self.category_codes, 'I'), self.type_names,
+                                              self.category_names, self.raw_dates,
+                                              None if self.ids is None else _copy(self.ids, 'Q'))
+        store.next_id = max(store.next_id, self.next_id)
+        return store
+
+
+def _copy(column, typecode):
+    # One memcpy out of the mapped file rather than a per-item loop.
+    copied = array(typecode)
+    with memoryview(column) as view, view.cast('B') as raw:
+        copied.frombytes(raw)
+    return copied
+
+
+def read_binary(filepath):
+    #Load a transactions.bin file into a TransactionStore.
+    with MappedTransactions(filepath) as mapped:
+        return mapped.to_store()
+
@@ -0,0 +1,226 @@
+import json
+import os
+
+# Every add/update/delete is appended here as one JSON line instead of
+# rewriting the whole transactions file.
+JOURNAL_FILE = 'transactions.journal'
+
+# Once the journal grows past this many bytes it is folded back into the base file.
+COMPACT_THRESHOLD_BYTES = 1024 * 1024
+
+# Every record is written with "op" as its first key.
+RECORD_START = '{"op"'
+
+
+def append_records(records, journal_file=JOURNAL_FILE):
+    #Append one or more change records to the journal in a single, fsynced write.
+    #Returns the number of bytes written.
+    if not records:
+        return 0
+    lines = ''.join(json.dumps(record) + '\n' for record in records).encode('utf-8')
+    with open(journal_file, 'a+b') as file:
+        _drop_torn_line(file)
+        file.write(lines)
+        file.flush()
+        os.fsync(file.fileno())
+    return len(lines)
+
+
+def _drop_torn_line(file):
+    # A write cut short by a crash leaves a last line without its newline. Appending after it
+    # would glue the next record onto the fragment, so the fragment is cut off first.
+    end = file.seek(0, os.SEEK_END)
+    if not end:
+        return
+    file.seek(end - 1)
+    if file.read(1) == b'\n':
+        return
+    position = end
+    while position > 0:
+        start = max(0, position - 65536)
+        file.seek(start)
+        newline = file.read(position - start).rfind(b'\n')
+        if newline >= 0:
+            file.truncate(start + newline + 1)
+            return
+        position = start
+    file.truncate(0)
+
+
+def parse_record(line):
+    #Decode one journal line. Journals written before torn lines were cut off can hold a
+    #fragment with a complete record appended straight after it; that record is kept.
+    #Raises json.JSONDecodeError if the line holds no complete record.
+    if isinstance(line, bytes):
+        line = line.decode('utf-8', errors='replace')
+    try:
+        return json.loads(line)
+    except json.JSONDecodeError:
+        start = line.rfind(RECORD_START)
+        if start <= 0:
+            raise
+        return json.loads(line[start:])
+
+
+def append_record(record, journal_file=JOURNAL_FILE):
+    #Append a single change record to the journal.
+    return append_records([record], journal_file)
+
+
+def journal_size(journal_file=JOURNAL_FILE):
+    #Return the size of the journal in bytes (0 if it does not exist yet).
+    try:
+        return os.path.getsize(journal_file)
+    except OSError:
+        return 0
+
+
+def needs_compaction(journal_file=JOURNAL_FILE, threshold=COMPACT_THRESHOLD_BYTES):
+    return journal_size(journal_file) > threshold
+
+
+def clear_journal(journal_file=JOURNAL_FILE):
+    #Truncate the journal after its contents were folded into the base file.
+    try:
+        os.remove(journal_file)
+    except FileNotFoundError:
+        pass
+
+
+def add_records(transactions, rows):
+    #"add" records for the given row positions of the store.
+    records = []
+    for row in rows:
+        transaction_type, category, amount, date = transactions.row(row)
+        records.append({"op": "add", "type": transaction_type, "category": category,
+                        "amount": amount, "date": date, "id": transactions.ids[row]})
+    return records
+
+
+def apply_record(transactions, record):
+    #Apply one change record to the transaction store.
+    #Updates and deletes name the transaction by "id"; journals written before transactions
+    #had ids name it by type, category and position instead.
+    op = record['op']
+    if op == 'add':
+        transactions.add(record['type'], record['category'], record['amount'], record['date'], record.get('id'))
+    elif op == 'delete' and 'id' in record:
+        transactions.delete(record['id'])
+    elif op == 'delete':
+        transactions.delete_at(record['type'], record['category'], record['index'])
+    elif op == 'update' and 'id' in record:
+        transactions.update(record['id'], record['new_type'], record['new_category'],
+                            record['amount'], record['date'])
+    elif op == 'update':
+        transactions.update_at(record['type'], record['category'], record['index'],
+                               record['new_type'], record['new_category'],
+                               record['amount'], record['date'])
+    elif op == 'reserve':
+        # Ids below next_id were handed out before, even if those transactions are gone now.
+        transactions.next_id = max(transactions.next_id, record['next_id'])
+    else:
+        raise ValueError(f"Unknown journal operation: {op}")
+
+
+def read_journal(journal_file=JOURNAL_FILE, offset=0):
+    #Records appended to the journal from byte offset onwards, and the offset just past the
+    #last complete line read.
+    records = []
+    try:
+        with open(journal_file, 'rb') as file:
+            file.seek(offset)
+            for line in file:
+                if not line.endswith(b'\n'):
+                    # Still being written, or torn; it is read again next time.
+                    break
+                offset += len(line)
+                if line.strip():
+                    try:
+                        records.append(parse_record(line))
+                    except json.JSONDecodeError:
+                        continue
+    except FileNotFoundError:
+        pass
+    return records, offset
+
+
+def _apply_if_possible(transactions, record):
+    # The transaction a change names may be gone by now (another process deleted it).
+    try:
+        apply_record(transactions, record)
+    except (KeyError, IndexError, ValueError):
+        pass
+
+
+def _rename_in_records(records, old_id, new_id):
+    for record in records:
+        if record.get('id') == old_id:
+            record['id'] = new_id
+
+
+def renumber_pending(transactions, records, old_id, new_id):
+    #Move a transaction we added but have not written yet to a new id, in the store and in records.
+    transactions.renumber(old_id, new_id)
+    _rename_in_records(records, old_id, new_id)
+
+
+def merge_records(transactions, foreign, pending):
+    #Apply records another process appended to the journal to a store that already holds our
+    #pending (not yet written) records. Ours will be journalled after theirs, so ours win:
+    #their updates to transactions we also changed are skipped, and transactions we added
+    #under an id they took move to a new id, in the store and in pending.
+    added = {record['id'] for record in pending if record['op'] == 'add'}
+    changed = {record['id'] for record in pending if record['op'] != 'add' and 'id' in record}
+    for record in foreign:
+        transaction_id = record.get('id')
+        if record['op'] == 'add' and transaction_id in added:
+            new_id = transactions.next_id
+            renumber_pending(transactions, pending, transaction_id, new_id)
+            added.discard(transaction_id)
+            added.add(new_id)
+            if transaction_id in changed:
+                changed.discard(transaction_id)
+                changed.add(new_id)
+        elif record['op'] == 'update' and transaction_id in changed:
+            continue
+        _apply_if_possible(transactions, record)
+
+
+def reapply_records(transactions, records):
+    #Apply our pending records on top of a store freshly loaded from disk. Transactions we
+    #added under an id another process has handed out since (one below the store's next_id,
+    #even if it was deleted again) move to an id neither the store nor records use.
+    spare_id = max([transactions.next_id] + [record['id'] + 1 for record in records
+                                             if type(record.get('id')) is int])
+    for record in records:
+        if (record['op'] == 'add' and type(record.get('id')) is int
+                and record['id'] < transactions.next_id):
+            _rename_in_records(records, record['id'], spare_id)
+            spare_id += 1
+        _apply_if_possible(transactions, record)
+
+
+def replay_journal(transactions, journal_file=JOURNAL_FILE):
+    #Re-apply every journalled change on top of the loaded base file.
+    #Returns the number of records applied.
+    applied = 0
+    try:
+        with open(journal_file, 'r') as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                try:
+                    record = parse_record(line)
+                except json.JSONDecodeError:
+                    # A torn line from an interrupted write; the records after it are intact.
+                    print("Ignoring incomplete journal entry.")
+                    continue
+                try:
+                    apply_record(transactions, record)
+                except (KeyError, IndexError, ValueError) as e:
+                    print(f"Skipping journal entry that could not be applied: {e}")
+                    continue
+                applied += 1
+    except FileNotFoundError:
+        pass
+    return applied
@@ -0,0 +1,1056 @@
+import datetime
+import itertools
+import json
+import math
+import os
+import re
+from array import array
+from bisect import bisect_left, bisect_right, insort
+
+from instrumentation import timed
+from transaction_validation import date_ordinal
+
+
+# Rows handed over per batch when loading in the background.
+LOAD_BATCH_SIZE = 20000
+
+# Characters read from transactions.json at a time by the streaming loader.
+READ_CHUNK_SIZE = 1024 * 1024
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+# Deleted rows are compacted away once there are at least this many and they make up half the rows.
+COMPACT_MIN_DEAD = 1024
+
+# Batches of more rows than this mark the sorted indexes stale rather than updating them row by row.
+BATCH_REINDEX_ROWS = 1000
+
+# Month that rollups file rows under when their date is not a canonical YYYY-MM-DD date.
+UNDATED_MONTH = 'undated'
+
+
+def iter_nested_rows(data):
+    #Yield (type, category, amount, date, id) for each transaction in the nested transactions.json layout.
+    #id is None for files written before transactions had ids.
+    #Entries missing an amount or a date are yielded as None so callers can count them.
+    for transaction_type, categories in data.items():
+        if isinstance(categories, list):
+            # Very old files kept a flat list under each type.
+            categories = {"uncategorized": categories}
+        for category, transaction_list in categories.items():
+            for transaction in transaction_list:
+                if not all(key in transaction for key in ['date', 'amount']):
+                    yield None
+                    continue
+                yield (transaction_type, category, transaction['amount'], transaction['date'],
+                       transaction.get('id'))
+
+
+class JsonRowStream:
+    #Walks a transactions.json file a chunk at a time and yields the same rows as
+    #iter_nested_rows, so only the current chunk and one transaction are ever decoded at once.
+    def __init__(self, file, chunk_size=READ_CHUNK_SIZE):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        # Characters dropped from the front of the buffer, for error positions and progress.
+        self.offset = 0
+        self.decoder = json.JSONDecoder()
+
+    def consumed(self):
+        return self.offset + self.pos
+
+    def _fill(self):
+        chunk = self.file.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return
+        self.offset += self.pos
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+
+    def _error(self, message):
+        return ValueError(f"{message} at character {self.consumed()} of the transactions file.")
+
+    def _peek(self):
+        #Next non-whitespace character, or '' at the end of the file.
+        while True:
+            pos = self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if pos < len(self.buffer):
+                return self.buffer[pos]
+            if self.eof:
+                return ''
+            self._fill()
+
+    def _expect(self, characters):
+        character = self._peek()
+        if not character or character not in characters:
+            raise self._error(f"Expected {' or '.join(repr(c) for c in characters)}")
+        self.pos += 1
+        return character
+
+    def _value(self):
+        #Decode one complete JSON value, reading more of the file if it runs past the buffer.
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise self._error("Malformed JSON")
+                self._fill()
+                continue
+            if end == len(self.buffer) and not self.eof:
+                # A number cut off by the chunk boundary still decodes, so make sure it is complete.
+                self._fill()
+                continue
+            self.pos = end
+            return value
+
+    def _key(self):
+        if self._peek() != '"':
+            raise self._error("Expected a name")
+        key = self._value()
+        self._expect(':')
+        return key
+
+    def _transactions(self, transaction_type, category):
+        self._expect('[')
+        if self._peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            transaction = self._value()
+            if isinstance(transaction, dict) and 'date' in transaction and 'amount' in transaction:
+                yield (transaction_type, category, transaction['amount'], transaction['date'],
+                       transaction.get('id'))
+            else:
+                yield None
+            if self._expect(',]') == ']':
+                return
+
+    def rows(self):
+        if self._peek() != '{':
+            raise ValueError("Data loaded is not a dictionary.")
+        self.pos += 1
+        if self._peek() == '}':
+            return
+        while True:
+            transaction_type = self._key()
+            character = self._peek()
+            if character == '[':
+                # Very old files kept a flat list under each type.
+                yield from self._transactions(transaction_type, "uncategorized")
+            elif character == '{':
+                self.pos += 1
+                if self._peek() == '}':
+                    self.pos += 1
+                else:
+                    while True:
+                        category = self._key()
+                        yield from self._transactions(transaction_type, category)
+                        if self._expect(',}') == '}':
+                            break
+            else:
+                raise self._error(f"Expected the categories of '{transaction_type}'")
+            if self._expect(',}') == '}':
+                return
+
+
+def read_transaction_batches(filepath, batch_size=LOAD_BATCH_SIZE):
+    #Yield (rows, progress) from a transactions.json file, where rows is a list of
+    #(type, category, amount, date, id) tuples and progress runs from 0 to 1.
+    #The file is streamed, so memory stays bounded by one chunk plus one batch.
+    #Touches no shared state, so it can run on a background thread.
+    size = max(os.path.getsize(filepath), 1)
+    skipped = 0
+    with open(filepath, 'r') as file:
+        stream = JsonRowStream(file)
+        rows = stream.rows()
+        batch = list(itertools.islice(rows, batch_size))
+        while batch:
+            progress = min(stream.consumed() / size, 1.0)
+            # Read one batch ahead so the last batch can report exactly 1.0.
+            following = list(itertools.islice(rows, batch_size))
+            valid = [row for row in batch if row is not None]
+            skipped += len(batch) - len(valid)
+            yield valid, progress if following else 1.0
+            batch = following
+    if skipped:
+        print(f"Skipped {skipped} malformed transaction(s).")
+
+
+def parse_date_bound(date_text):
+    #Turn a YYYY-MM-DD search bound into a date ordinal.
+    ordinal = date_ordinal(date_text)
+    if ordinal is None:
+        raise ValueError(f"Invalid date '{date_text}'. Please use the (YYYY-MM-DD) format.")
+    return ordinal
+
+
+def parse_month_bound(month_text):
+    #Check a YYYY-MM report bound and return it in canonical form.
+    try:
+        return datetime.date.fromisoformat(month_text + '-01').isoformat()[:7]
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid month '{month_text}'. Please use the (YYYY-MM) format.")
+
+
+class SortedIndex:
+    #Row positions ordered by the value in one column, for O(log n + k) range lookups.
+    #The index is built from the column the first time it is queried and kept up to
+    #date row by row after that; bulk changes just mark it stale again.
+    def __init__(self, column, typecode):
+        self.column = column
+        self.typecode = typecode
+        self.keys = array(typecode)
+        self.rows = array('I')
+        self.stale = True
+
+    def invalidate(self):
+        self.stale = True
+        self.keys = array(self.typecode)
+        self.rows = array('I')
+
+    def ensure(self):
+        if not self.stale:
+            return
+        column = self.column
+        order = sorted(range(len(column)), key=column.__getitem__)
+        self.rows = array('I', order)
+        self.keys = array(self.typecode, (column[row] for row in order))
+        self.stale = False
+
+    def insert(self, row):
+        #Index a new or changed row; rows with an equal key stay in position order.
+        if self.stale:
+            return
+        key = self.column[row]
+        position = bisect_left(self.rows, row, bisect_left(self.keys, key), bisect_right(self.keys, key))
+        self.keys.insert(position, key)
+        self.rows.insert(position, row)
+
+    def remove(self, row):
+        #Drop a row whose key is about to change. Deleted rows stay indexed as tombstones
+        #until the store is compacted, which rebuilds the index anyway.
+        if self.stale:
+            return
+        key = self.column[row]
+        position = self.rows.index(row, bisect_left(self.keys, key), bisect_right(self.keys, key))
+        del self.keys[position]
+        del self.rows[position]
+
+    def bounds(self, low=None, high=None):
+        #Slice positions covering low <= key <= high (either end may be open).
+        self.ensure()
+        start = 0 if low is None else bisect_left(self.keys, low)
+        stop = len(self.keys) if high is None else bisect_right(self.keys, high)
+        return start, max(start, stop)
+
+    def size(self, low=None, high=None):
+        start, stop = self.bounds(low, high)
+        return stop - start
+
+    def range(self, low=None, high=None):
+        start, stop = self.bounds(low, high)
+        return self.rows[start:stop]
+
+
+class IdPositions:
+    #id -> row position of every live transaction. Ids are handed out densely from 1, so the
+    #positions sit in an array indexed by id - 1 (-1 for a free id): 8 bytes per id rather than
+    #a dict entry and two boxed ints. An id far beyond the rest (e.g. from a hand-edited file)
+    #goes in a small dict instead of stretching the array.
+    def __init__(self):
+        self._slots = array('q')
+        self._far = {}
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def _slot(self, transaction_id):
+        # Index into _slots, or None for anything that cannot be stored there.
+        if type(transaction_id) is not int or transaction_id <= 0:
+            return None
+        slot = transaction_id - 1
+        return slot if slot < len(self._slots) else None
+
+    def get(self, transaction_id, default=None):
+        slot = self._slot(transaction_id)
+        if slot is not None:
+            row = self._slots[slot]
+            return default if row < 0 else row
+        return self._far.get(transaction_id, default) if type(transaction_id) is int else default
+
+    def __contains__(self, transaction_id):
+        return self.get(transaction_id) is not None
+
+    def __getitem__(self, transaction_id):
+        row = self.get(transaction_id)
+        if row is None:
+            raise KeyError(transaction_id)
+        return row
+
+    def _grow(self, size):
+        # Extend _slots to size slots, free unless a far id now falls inside them.
+        self._slots.extend(array('q', [-1]) * (size - len(self._slots)))
+        self._absorb_far()
+
+    def _absorb_far(self):
+        # Far ids the array has grown to cover move into it, where get() looks for them.
+        size = len(self._slots)
+        for transaction_id in [far for far in self._far if far <= size]:
+            self._slots[transaction_id - 1] = self._far.pop(transaction_id)
+
+    def __setitem__(self, transaction_id, row):
+        slot = transaction_id - 1
+        if slot >= len(self._slots) and slot < 2 * len(self._slots) + 1024:
+            self._grow(slot + 1)
+        if slot < len(self._slots):
+            self._count += self._slots[slot] < 0
+            self._slots[slot] = row
+        else:
+            self._count += transaction_id not in self._far
+            self._far[transaction_id] = row
+
+    def pop(self, transaction_id):
+        row = self[transaction_id]
+        slot = self._slot(transaction_id)
+        if slot is not None:
+            self._slots[slot] = -1
+        else:
+            del self._far[transaction_id]
+        self._count -= 1
+        return row
+
+    def __delitem__(self, transaction_id):
+        self.pop(transaction_id)
+
+    def add_range(self, first_id, first_row, count):
+        #Map first_id.. to first_row.. for count new, consecutive ids.
+        if first_id - 1 == len(self._slots):
+            self._slots.extend(range(first_row, first_row + count))
+            self._count += count
+            self._absorb_far()
+        else:
+            for offset in range(count):
+                self[first_id + offset] = first_row + offset
+
+    @classmethod
+    def from_ids(cls, ids):
+        #Positions for an ids column (row i holds ids[i]); ValueError if an id repeats.
+        positions = cls()
+        top = max(ids, default=0)
+        if top <= 2 * len(ids) + 1024:
+            slots = positions._slots = array('q', [-1]) * top
+            for row, transaction_id in enumerate(ids):
+                if slots[transaction_id - 1] >= 0:
+                    raise ValueError("Transaction ids are not unique.")
+                slots[transaction_id - 1] = row
+            positions._count = len(ids)
+            return positions
+        for row, transaction_id in enumerate(ids):
+            if transaction_id in positions:
+                raise ValueError("Transaction ids are not unique.")
+            positions[transaction_id] = row
+        return positions
+
+
+class TransactionStore:
+    #Columnar transaction storage.
+    #Row i of the store is ids[i], amounts[i], dates[i], type_codes[i] and category_codes[i];
+    #type and category names are interned once and referenced by code.
+    #Every transaction has a stable id. Updates and deletes address rows by id: a delete only
+    #marks its row dead (a tombstone) and the columns are compacted once enough rows are
+    #dead, so row positions only ever change in compact().
+    def __init__(self):
+        self.ids = array('Q')
+        self.amounts = array('d')
+        # Date ordinals. Strings that are not canonical YYYY-MM-DD dates are kept
+        # verbatim in raw_dates and stored here as -(position + 1).
+        self.dates = array('i')
+        self.type_codes = array('H')
+        self.category_codes = array('I')
+
+        self.type_names = []
+        self.category_names = []
+        self.raw_dates = []
+        self._type_lookup = {}
+        self._category_lookup = {}
+        self._raw_date_lookup = {}
+
+        # id -> row position of every live transaction.
+        self._positions = IdPositions()
+        self.next_id = 1
+        # 1 per live row, 0 per tombstone.
+        self.alive = bytearray()
+        self.dead = 0
+
+        # (type code, category code) -> row positions in insertion order (tombstones included).
+        self._groups = {}
+
+        # Running totals kept up to date by every mutation so summaries never scan rows.
+        # (type code, category code) -> [sum, count] and type code -> [sum, count].
+        self._group_totals = {}
+        self._type_totals = {}
+        # Monthly rollups, maintained the same way for budgeting reports:
+        # (month, type code, category code) -> [sum, count, min, max]. min and max are set to
+        # None when the row holding one of them is removed and worked out again on next read.
+        # Like the sorted indexes, loading marks the whole thing stale (None) instead.
+        self._rollups = {}
+        # Date ordinal -> month, since many rows share a day.
+        self._months = {}
+
+        self._date_index = SortedIndex(self.dates, 'i')
+        self._amount_index = SortedIndex(self.amounts, 'd')
+        self._indexes = [self._date_index, self._amount_index]
+
+        # Bumped by every mutation; cached results remember the version they were built for.
+        self.version = 0
+        # field -> (version, rows in ascending order, position of each row in that order)
+        self._sort_cache = {}
+        # Set by the storage backend: which state of the files on disk this store was last
+        # brought up to date with, so a later write can tell what other processes changed.
+        self.disk_version = None
+
+    def __len__(self):
+        #Live transactions. Positions run up to len(self.amounts), which includes tombstones.
+        return len(self.amounts) - self.dead
+
+    def __bool__(self):
+        return len(self.amounts) > self.dead
+
+    def __contains__(self, transaction_type):
+        code = self._type_lookup.get(transaction_type)
+        return code in self._type_totals
+
+    def _type_code(self, transaction_type):
+        code = self._type_lookup.get(transaction_type)
+        if code is None:
+            code = len(self.type_names)
+            self.type_names.append(transaction_type)
+            self._type_lookup[transaction_type] = code
+        return code
+
+    def _category_code(self, category):
+        code = self._category_lookup.get(category)
+        if code is None:
+            code = len(self.category_names)
+            self.category_names.append(category)
+            self._category_lookup[category] = code
+        return code
+
+    def encode_date(self, date_text):
+        #Turn a date string into the integer stored in the dates column.
+        ordinal = date_ordinal(date_text)
+        if ordinal is not None:
+            return ordinal
+        code = self._raw_date_lookup.get(date_text)
+        if code is None:
+            self.raw_dates.append(date_text)
+            code = -len(self.raw_dates)
+            self._raw_date_lookup[date_text] = code
+        return code
+
+    def decode_date(self, value):
+        if value > 0:
+            return datetime.date.fromordinal(value).isoformat()
+        return self.raw_dates[-value - 1]
+
+    def date(self, row):
+        return self.decode_date(self.dates[row])
+
+    def position(self, transaction_id):
+        #Row position of a live transaction; KeyError if there is no such id.
+        return self._positions[transaction_id]
+
+    def has_id(self, transaction_id):
+        return transaction_id in self._positions
+
+    def get(self, transaction_id):
+        #Return (type, category, amount, date) for a transaction id.
+        return self.row(self._positions[transaction_id])
+
+    def id_at(self, transaction_type, category, index):
+        #Id of the index-th live transaction of a type/category, as listed by group_rows.
+        return self.ids[self.group_rows(transaction_type, category)[index]]
+
+    def live_rows(self):
+        #Every live row position in position order.
+        if not self.dead:
+            return range(len(self.amounts))
+        alive = self.alive
+        return [row for row in range(len(self.amounts)) if alive[row]]
+
+    def _live(self, rows):
+        # Drop tombstones from a list of row positions.
+        if not self.dead:
+            return rows
+        alive = self.alive
+        return array('I', (row for row in rows if alive[row]))
+
+    def row(self, row):
+        #Return (type, category, amount, date) for a row position.
+        return (self.type_names[self.type_codes[row]],
+                self.category_names[self.category_codes[row]],
+                self.amounts[row],
+                self.date(row))
+
+    def types(self):
+        #Transaction types that currently have rows, in first-seen order.
+        seen = []
+        for type_code, _ in self._group_totals:
+            if type_code not in seen:
+                seen.append(type_code)
+        return [self.type_names[code] for code in seen]
+
+    def categories(self, transaction_type):
+        #Categories that currently have rows under a type, in first-seen order.
+        code = self._type_lookup.get(transaction_type)
+        return [self.category_names[category_code]
+                for type_code, category_code in self._group_totals if type_code == code]
+
+    def has_category(self, transaction_type, category):
+        return self._group_key(transaction_type, category) in self._group_totals
+
+    def group_rows(self, transaction_type, category):
+        #Live row positions of one type/category, in the order they were added.
+        return self._live(self._groups.get(self._group_key(transaction_type, category), array('I')))
+
+    def count(self, transaction_type, category):
+        totals = self._group_totals.get(self._group_key(transaction_type, category))
+        return totals[1] if totals else 0
+
+    def ordered_rows(self):
+        #All live row positions grouped by type and category, as the nested view lists them.
+        alive = self.alive
+        for rows in self._groups.values():
+            if self.dead:
+                yield from (row for row in rows if alive[row])
+            else:
+                yield from rows
+
+    def rows_in_date_range(self, date_from=None, date_to=None):
+        #Rows dated between two inclusive YYYY-MM-DD bounds, in date order.
+        #Rows whose stored date is not a valid date never match a date filter.
+        low = parse_date_bound(date_from) if date_from else 1
+        high = parse_date_bound(date_to) if date_to else None
+        return self._live(self._date_index.range(low, high))
+
+    @timed("search", rows=lambda result, *args, **kwargs: len(result))
+    def search(self, transaction_type=None, date_from=None, date_to=None,
+               amount=None, amount_min=None, amount_max=None):
+        #Rows matching every given filter, in the order they were added.
+        #Dates are inclusive YYYY-MM-DD bounds, amounts are numbers and type matching ignores case.
+        #Each filter knows how many rows it matches from its index alone; only the smallest
+        #of those candidate sets is materialised and the other filters are checked per row.
+        if amount is not None:
+            amount_min = amount_max = amount
+        candidates = []
+
+        if date_from or date_to:
+            low = parse_date_bound(date_from) if date_from else 1
+            high = parse_date_bound(date_to) if date_to else None
+            dates = self.dates
+            candidates.append((self._date_index.size(low, high),
+                               lambda low=low, high=high: self._date_index.range(low, high),
+                               lambda row, low=low, high=high:
+                                   low <= dates[row] and (high is None or dates[row] <= high)))
+
+        if amount_min is not None or amount_max is not None:
+            amounts = self.amounts
+            candidates.append((self._amount_index.size(amount_min, amount_max),
+                               lambda: self._amount_index.range(amount_min, amount_max),
+                               lambda row: (amount_min is None or amounts[row] >= amount_min) and
+                                           (amount_max is None or amounts[row] <= amount_max)))
+
+        if transaction_type:
+            wanted = {code for code, name in enumerate(self.type_names)
+                      if name.lower() == transaction_type.lower()}
+            type_codes = self.type_codes
+            candidates.append((sum(self._type_totals[code][1] for code in wanted if code in self._type_totals),
+                               lambda: [row for key, rows in self._groups.items() if key[0] in wanted
+                                        for row in rows],
+                               lambda row: type_codes[row] in wanted))
+
+        if not candidates:
+            return list(self.live_rows())
+        candidates.sort(key=lambda candidate: candidate[0])
+        rows = candidates[0][1]()
+        for _, _, matches in candidates[1:]:
+            rows = [row for row in rows if matches(row)]
+        return sorted(self._live(rows))
+
+    @timed("sort", rows=lambda result, *args, **kwargs: len(result))
+    def sort_rows(self, rows, field, reverse=False):
+        #Order rows by 'date', 'type', 'category' or 'amount' using a cached full-store ordering.
+        #Ties keep insertion order; reverse=True is the exact reverse of the ascending order.
+        order, position = self._sort_order(field)
+        if len(rows) == len(self.amounts):
+            # The rows are every row in the store, so the cached ordering is the answer.
+            result = array('I', order)
+        else:
+            result = array('I', sorted(rows, key=position.__getitem__))
+        if reverse:
+            result.reverse()
+        return result
+
+    def _sort_order(self, field):
+        cached = self._sort_cache.get(field)
+        if cached is not None and cached[0] == self.version:
+            return cached[1], cached[2]
+
+        if field in ('date', 'amount'):
+            index = self._date_index if field == 'date' else self._amount_index
+            index.ensure()
+            order = array('I', index.rows)
+        elif field in ('type', 'category'):
+            names, codes = ((self.type_names, self.type_codes) if field == 'type'
+                            else (self.category_names, self.category_codes))
+            # Bucket rows by name code, then emit the buckets in the order the names display in.
+            buckets = [array('I') for _ in names]
+            for row, code in enumerate(codes):
+                buckets[code].append(row)
+            order = array('I')
+            for code in sorted(range(len(names)), key=lambda code: names[code].capitalize()):
+                order.extend(buckets[code])
+        else:
+            raise ValueError(f"Cannot sort by {field}")
+
+        position = array('I', bytes(4 * len(order)))
+        for rank, row in enumerate(order):
+            position[row] = rank
+        self._sort_cache[field] = (self.version, order, position)
+        return order, position
+
+    def _group_key(self, transaction_type, category):
+        return (self._type_lookup.get(transaction_type), self._category_lookup.get(category))
+
+    def totals_by_type(self):
+        #Sum of amounts per transaction type, read from the running totals.
+        return {self.type_names[code]: totals[0] for code, totals in self._type_totals.items()}
+
+    def counts_by_type(self):
+        return {self.type_names[code]: totals[1] for code, totals in self._type_totals.items()}
+
+    def category_totals(self, transaction_type):
+        #{category: (sum, count)} for one type, read from the running totals.
+        code = self._type_lookup.get(transaction_type)
+        return {self.category_names[category_code]: tuple(totals)
+                for (type_code, category_code), totals in self._group_totals.items()
+                if type_code == code}
+
+    def month(self, row):
+        #"YYYY-MM" a row is rolled up under, or UNDATED_MONTH.
+        return self._months.get(self.dates[row]) or self._month_of(self.dates[row])
+
+    def _month_of(self, value):
+        month = self.decode_date(value)[:7] if value > 0 else UNDATED_MONTH
+        self._months[value] = month
+        return month
+
+    def rollups(self, transaction_type=None, month_from=None, month_to=None):
+        #[(month, type, category, sum, count, min, max)] ordered by month, type and category,
+        #read from the maintained rollups without touching individual rows.
+        #Months are inclusive YYYY-MM bounds; undated rows only show up when no bound is given.
+        low = parse_month_bound(month_from) if month_from else None
+        high = parse_month_bound(month_to) if month_to else None
+        if self._rollups is None:
+            self._rollups = self._recount_rollups()
+        type_code = self._type_lookup.get(transaction_type) if transaction_type else None
+        if transaction_type and type_code is None:
+            return []
+        report = []
+        for key in list(self._rollups):
+            month, key_type, category_code = key
+            if type_code is not None and key_type != type_code:
+                continue
+            if (low or high) and (month == UNDATED_MONTH or (low and month < low) or (high and month > high)):
+                continue
+            total, count, smallest, largest = self._rollup_cell(key)
+            report.append((month, self.type_names[key_type], self.category_names[category_code],
+                           total, count, smallest, largest))
+        report.sort(key=lambda line: (line[0] == UNDATED_MONTH, line[0], line[1], line[2]))
+        return report
+
+    def _month_rows(self, month):
+        #Row positions dated in a rollup month (tombstones included), found through the date index.
+        if month == UNDATED_MONTH:
+            return self._date_index.range(None, -1)
+        year, number = map(int, month.split('-'))
+        first = datetime.date(year, number, 1).toordinal()
+        following = datetime.date(year + number // 12, number % 12 + 1, 1).toordinal()
+        return self._date_index.range(first, following - 1)
+
+    def _rollup_cell(self, key):
+        cell = self._rollups[key]
+        if cell[2] is None:
+            # Only after a removal, and only the cell's month is visited, not its whole group.
+            month, type_code, category_code = key
+            type_codes, category_codes = self.type_codes, self.category_codes
+            amounts = [self.amounts[row] for row in self._live(self._month_rows(month))
+                       if type_codes[row] == type_code and category_codes[row] == category_code]
+            cell[2] = min(amounts)
+            cell[3] = max(amounts)
+        return cell
+
+    def _roll_up(self, row, key, amount, direction):
+        if self._rollups is None:
+            return
+        cell_key = (self.month(row), key[0], key[1])
+        cell = self._rollups.get(cell_key)
+        if cell is None:
+            cell = self._rollups[cell_key] = [0.0, 0, amount, amount]
+        cell[1] += direction
+        if cell[1] == 0:
+            del self._rollups[cell_key]
+            return
+        cell[0] += direction * amount
+        if direction < 0:
+            if amount == cell[2] or amount == cell[3]:
+                cell[2] = cell[3] = None
+        elif cell[2] is not None:
+            cell[2] = min(cell[2], amount)
+            cell[3] = max(cell[3], amount)
+
+    def _count_row(self, row, direction):
+        # direction is 1 when a row is added and -1 when it is removed.
+        key = (self.type_codes[row], self.category_codes[row])
+        amount = self.amounts[row]
+        self._roll_up(row, key, amount, direction)
+        for totals_map, totals_key in ((self._group_totals, key), (self._type_totals, key[0])):
+            totals = totals_map.get(totals_key)
+            if totals is None:
+                totals = totals_map[totals_key] = [0.0, 0]
+            totals[1] += direction
+            if totals[1] == 0:
+                # Nothing left to sum, so drop it rather than keep rounding residue around.
+                del totals_map[totals_key]
+            else:
+                totals[0] += direction * amount
+
+    def _recount(self):
+        #Exact totals recomputed from the columns, in the same shape as the running totals.
+        group_totals = {}
+        type_totals = {}
+        amounts = self.amounts
+        for key, rows in self._groups.items():
+            rows = self._live(rows)
+            if not rows:
+                continue
+            total = math.fsum(amounts[row] for row in rows)
+            group_totals[key] = [total, len(rows)]
+            type_total = type_totals.setdefault(key[0], [[], 0])
+            type_total[0].append(total)
+            type_total[1] += len(rows)
+        type_totals = {code: [math.fsum(sums), count] for code, (sums, count) in type_totals.items()}
+        return group_totals, type_totals
+
+    def _recount_rollups(self):
+        months = self._months
+        cells = {}
+        for value, type_code, category_code, amount, alive in zip(self.dates, self.type_codes,
+                                                                  self.category_codes, self.amounts, self.alive):
+            if not alive:
+                continue
+            month = months.get(value) or self._month_of(value)
+            cells.setdefault((month, type_code, category_code), []).append(amount)
+        return {cell_key: [math.fsum(values), len(values), min(values), max(values)]
+                for cell_key, values in cells.items()}
+
+    def rebuild_totals(self):
+        #Replace the running totals with an exact recount (done once after loading).
+        #The rollups are recounted too, the next time they are read.
+        self._group_totals, self._type_totals = self._recount()
+        self._rollups = None
+
+    def verify_totals(self, tolerance=0.005):
+        #Recount every total from scratch and describe any running total that drifted from it.
+        group_totals, type_totals = self._recount()
+        problems = []
+        checks = [(group_totals, self._group_totals,
+                   lambda key: f"{self.type_names[key[0]]}/{self.category_names[key[1]]}"),
+                  (type_totals, self._type_totals, lambda code: self.type_names[code])]
+        if self._rollups is not None:
+            checks.append((self._recount_rollups(), self._rollups,
+                           lambda key: f"{key[0]} {self.type_names[key[1]]}/{self.category_names[key[2]]}"))
+        for expected_map, actual_map, describe in checks:
+            for key in expected_map.keys() | actual_map.keys():
+                expected = expected_map.get(key, [0.0, 0])
+                actual = actual_map.get(key, [0.0, 0])
+                if expected[1] != actual[1] or abs(expected[0] - actual[0]) > tolerance:
+                    problems.append(f"{describe(key)}: running total {actual[0]} over {actual[1]} row(s), "
+                                    f"recount {expected[0]} over {expected[1]} row(s)")
+        return problems
+
+    def to_nested(self, rows=None):
+        #Build the {type: {category: [{"amount", "date", "id"}, ...]}} layout used by transactions.json,
+        #from every live row or only the given row positions.
+        nested = {}
+        for row in (self.ordered_rows() if rows is None else sorted(rows)):
+            categories = nested.setdefault(self.type_names[self.type_codes[row]], {})
+            categories.setdefault(self.category_names[self.category_codes[row]], []).append(
+                {"amount": self.amounts[row], "date": self.date(row), "id": self.ids[row]})
+        return nested
+
+    def add(self, transaction_type, category, amount, date, transaction_id=None):
+        #Append a transaction and return its row position. It gets the next free id unless it
+        #brings its own (read back from a file or a journal); a clashing id is replaced.
+        if type(transaction_id) is not int or transaction_id <= 0 or transaction_id in self._positions:
+            transaction_id = self.next_id
+        self.next_id = max(self.next_id, transaction_id + 1)
+        type_code = self._type_code(transaction_type)
+        category_code = self._category_code(category)
+        row = len(self.amounts)
+        self.ids.append(transaction_id)
+        self.alive.append(1)
+        self._positions[transaction_id] = row
+        self.amounts.append(amount)
+        self.dates.append(self.encode_date(date))
+        self.type_codes.append(type_code)
+        self.category_codes.append(category_code)
+        key = (type_code, category_code)
+        if key not in self._groups:
+            self._groups[key] = array('I')
+        self._groups[key].append(row)
+        self._count_row(row, 1)
+        for index in self._indexes:
+            index.insert(row)
+        self.version += 1
+        return row
+
+    def extend_encoded(self, amounts, type_codes, type_names, category_codes, category_names,
+                       date_codes, date_texts, group_rows, group_sums):
+        #Append a batch of rows whose names and dates are coded against the batch's own tables,
+        #as bulk_import.encode_rows packs them. group_rows and group_sums hold each batch-local
+        #(type code, category code) group's row offsets and sum, so groups and totals are merged
+        #a group at a time. Gives the same rows as calling add() for each row in order; the
+        #totals can differ from a row-by-row sum in the last bits until rebuild_totals(), and
+        #the rollups are recounted on next read.
+        type_map = [self._type_code(name) for name in type_names]
+        category_map = [self._category_code(name) for name in category_names]
+        date_map = [self.encode_date(text) for text in date_texts]
+        first_row = len(self.amounts)
+        first_id = self.next_id
+        self.next_id += len(amounts)
+        self.ids.extend(range(first_id, self.next_id))
+        self.alive.extend(bytes([1]) * len(amounts))
+        self._positions.add_range(first_id, first_row, len(amounts))
+        self.amounts.extend(amounts)
+        self.dates.extend(map(date_map.__getitem__, date_codes))
+        self.type_codes.extend(map(type_map.__getitem__, type_codes))
+        self.category_codes.extend(map(category_map.__getitem__, category_codes))
+        for index in self._indexes:
+            index.invalidate()
+        self._rollups = None
+        self.version += 1
+        groups = self._groups
+        for (type_code, category_code), rows in group_rows.items():
+            key = (type_map[type_code], category_map[category_code])
+            if key not in groups:
+                groups[key] = array('I')
+            groups[key].extend(array('I', map(first_row.__add__, rows)))
+            for totals_map, totals_key in ((self._group_totals, key), (self._type_totals, key[0])):
+                totals = totals_map.setdefault(totals_key, [0.0, 0])
+                totals[0] += group_sums[(type_code, category_code)]
+                totals[1] += len(rows)
+
+    def delete(self, transaction_id):
+        #Delete a transaction by id. Its row becomes a tombstone, so nothing moves.
+        row = self._positions[transaction_id]
+        self._count_row(row, -1)
+        del self._positions[transaction_id]
+        self.alive[row] = 0
+        self.dead += 1
+        self.version += 1
+        if self.dead >= COMPACT_MIN_DEAD and self.dead * 2 >= len(self.amounts):
+            self.compact()
+
+    def update(self, transaction_id, new_type, new_category, amount, date):
+        #Replace a transaction's fields by id. It keeps its id and its row position.
+        row = self._positions[transaction_id]
+        self._count_row(row, -1)
+        for index in self._indexes:
+            index.remove(row)
+        old_key = (self.type_codes[row], self.category_codes[row])
+        key = (self._type_code(new_type), self._category_code(new_category))
+        self.amounts[row] = amount
+        self.dates[row] = self.encode_date(date)
+        self.type_codes[row], self.category_codes[row] = key
+        if key != old_key:
+            old_rows = self._groups[old_key]
+            del old_rows[bisect_left(old_rows, row)]
+            insort(self._groups.setdefault(key, array('I')), row)
+        self._count_row(row, 1)
+        for index in self._indexes:
+            index.insert(row)
+        self.version += 1
+        return row
+
+    def renumber(self, transaction_id, new_id):
+        #Give a transaction a different, unused id (another process wrote one with the same id first).
+        if new_id in self._positions:
+            raise ValueError(f"Transaction id {new_id} is already in use.")
+        row = self._positions.pop(transaction_id)
+        self._positions[new_id] = row
+        self.ids[row] = new_id
+        self.next_id = max(self.next_id, new_id + 1)
+        self.version += 1
+
+    def replace_with(self, other):
+        #Take over another store's contents in place, so everything holding this store object
+        #sees them (used when the files were rewritten by another process).
+        version = self.version
+        self.__dict__.update(other.__dict__)
+        self.version = max(version, other.version) + 1
+
+    def add_many(self, rows):
+        #Append many (type, category, amount, date) rows and return their ids in order.
+        self._start_batch(len(rows))
+        ids = self.ids
+        return [ids[self.add(*row)] for row in rows]
+
+    def update_many(self, changes):
+        #Apply many (id, new_type, new_category, amount, date) updates. Every id is checked
+        #first, so an unknown id raises KeyError with the store untouched.
+        self._check_ids([change[0] for change in changes])
+        self._start_batch(len(changes))
+        for change in changes:
+            self.update(*change)
+
+    def delete_many(self, transaction_ids):
+        #Delete many transactions by id, all or (on an unknown id) none of them.
+        self._check_ids(transaction_ids)
+        self._start_batch(len(transaction_ids))
+        for transaction_id in transaction_ids:
+            self.delete(transaction_id)
+
+    def _check_ids(self, transaction_ids):
+        missing = [transaction_id for transaction_id in transaction_ids if transaction_id not in self._positions]
+        if missing:
+            raise KeyError(f"No transaction with id {missing[0]}")
+        if len(set(transaction_ids)) != len(transaction_ids):
+            raise ValueError("The same transaction id appears more than once in the batch.")
+
+    def _start_batch(self, size):
+        if size > BATCH_REINDEX_ROWS:
+            for index in self._indexes:
+                index.invalidate()
+
+    def delete_at(self, transaction_type, category, index):
+        #Delete the index-th transaction of a type/category (journals written before ids).
+        if not self.has_category(transaction_type, category):
+            raise KeyError(f"{transaction_type}/{category}")
+        self.delete(self.id_at(transaction_type, category, index))
+
+    def update_at(self, transaction_type, category, index, new_type, new_category, amount, date):
+        #Replace the index-th transaction of a type/category (journals written before ids).
+        #As it always did, the new row goes to the end of its group.
+        self.delete_at(transaction_type, category, index)
+        return self.add(new_type, new_category, amount, date)
+
+    def truncate(self, length):
+        #Drop every row from position length onwards (used to roll back a failed import).
+        if length >= len(self.amounts):
+            return
+        for row in range(length, len(self.amounts)):
+            if self.alive[row]:
+                self._count_row(row, -1)
+                del self._positions[self.ids[row]]
+            else:
+                self.dead -= 1
+        del self.ids[length:]
+        del self.alive[length:]
+        del self.amounts[length:]
+        del self.dates[length:]
+        del self.type_codes[length:]
+        del self.category_codes[length:]
+        for index in self._indexes:
+            index.invalidate()
+        self.version += 1
+        self._rebuild_groups()
+
+    def compact(self):
+        #Drop the tombstones left by deletes. Live rows move up, so row positions change; ids do not.
+        if not self.dead:
+            return
+        keep = self.live_rows()
+        for column in (self.ids, self.amounts, self.dates, self.type_codes, self.category_codes):
+            # Assigned in place: the sorted indexes hold on to the column arrays.
+            column[:] = array(column.typecode, (column[row] for row in keep))
+        self.alive = bytearray(bytes([1]) * len(keep))
+        self.dead = 0
+        self._positions = IdPositions.from_ids(self.ids)
+        self._rebuild_groups()
+        for index in self._indexes:
+            index.invalidate()
+        self.version += 1
+
+    def _rebuild_groups(self):
+        # Positions shift after a truncate or compaction, so regroup in one pass while keeping group order.
+        groups = {key: array('I') for key in self._groups}
+        for row, key in enumerate(zip(self.type_codes, self.category_codes)):
+            if key not in groups:
+                groups[key] = array('I')
+            groups[key].append(row)
+        self._groups = {key: rows for key, rows in groups.items() if rows}
+
+    def extend_rows(self, rows):
+        #Append many (type, category, amount, date[, id]) rows; the sorted indexes are rebuilt on next use
+        #instead of taking one insert per row.
+        for index in self._indexes:
+            index.invalidate()
+        self._rollups = None
+        for row in rows:
+            self.add(*row)
+
+    @classmethod
+    def from_columns(cls, amounts, dates, type_codes, category_codes, type_names, category_names, raw_dates,
+                     ids=None):
+        #Build a store around columns that are already encoded the way the store keeps them
+        #(e.g. read back from a binary file), without going through add() row by row.
+        #Without ids the rows are numbered from 1 in order.
+        if ids is None:
+            ids = array('Q', range(1, len(amounts) + 1))
+        if len({len(ids), len(amounts), len(dates), len(type_codes), len(category_codes)}) != 1:
+            raise ValueError("Columns have different lengths.")
+        if amounts and (max(type_codes) >= len(type_names) or max(category_codes) >= len(category_names)
+                        or min(dates) < -len(raw_dates) or 0 in dates):
+            raise ValueError("Columns refer to names or dates that are not in the tables.")
+        store = cls()
+        if 0 in ids:
+            raise ValueError("Transaction id 0 is not valid.")
+        store._positions = IdPositions.from_ids(ids)
+        store.ids.extend(ids)
+        store.next_id = max(ids, default=0) + 1
+        store.alive = bytearray(bytes([1]) * len(ids))
+        store.amounts.extend(amounts)
+        store.dates.extend(dates)
+        store.type_codes.extend(type_codes)
+        store.category_codes.extend(category_codes)
+        for name in type_names:
+            store._type_code(name)
+        for name in category_names:
+            store._category_code(name)
+        for date_text in raw_dates:
+            store.encode_date(date_text)
+        store._rebuild_groups()
+        store.rebuild_totals()
+        return store
+
+    @classmethod
+    def from_nested(cls, data):
+        #Build a store from the nested layout loaded from transactions.json.
+        store = cls()
+        skipped = 0
+        for row in iter_nested_rows(data):
+            if row is None:
+                skipped += 1
+                continue
+            store.add(*row)
+        if skipped:
+            print(f"Skipped {skipped} malformed transaction(s).")
+        return store
@@ -0,0 +1,120 @@
+import datetime
+import math
+import time
+
+TRANSACTION_TYPES = ['income', 'expense']
+
+# Date strings seen so far -> date ordinal, or None when the text is not a canonical
+# YYYY-MM-DD date. Bank exports repeat the same few hundred dates, so almost every
+# lookup is a dictionary hit; the cache is simply emptied if it ever grows this large.
+DATE_CACHE_LIMIT = 100000
+_date_ordinals = {}
+
+# Today's ordinal, and the time.time() at which it has to be worked out again (next midnight).
+_today_ordinal = 0
+_today_expires = 0.0
+
+INVALID_DATE_MESSAGE = "Invalid date or format. Please enter the date in (YYYY-MM-DD) format."
+
+
+def date_ordinal(date_text):
+    #Ordinal of a canonical YYYY-MM-DD date, or None for anything else. This is the one place
+    #date strings are parsed: prompts, bulk import, search bounds and the store all use it.
+    ordinal = _date_ordinals.get(date_text, False)
+    if ordinal is False:
+        try:
+            day = datetime.date.fromisoformat(date_text)
+            # fromisoformat also takes forms such as 20240105 that we do not store as dates.
+            ordinal = day.toordinal() if day.isoformat() == date_text else None
+        except (TypeError, ValueError):
+            ordinal = None
+        if len(_date_ordinals) >= DATE_CACHE_LIMIT:
+            _date_ordinals.clear()
+        _date_ordinals[date_text] = ordinal
+    return ordinal
+
+
+def today_ordinal():
+    global _today_ordinal, _today_expires
+    now = time.time()
+    if now >= _today_expires:
+        today = datetime.date.today()
+        _today_ordinal = today.toordinal()
+        _today_expires = datetime.datetime.combine(today + datetime.timedelta(days=1), datetime.time()).timestamp()
+    return _today_ordinal
+
+
+def parse_date(date_text):
+    #Return (YYYY-MM-DD, "") for a valid date that is not in the future, or (None, message).
+    #Dates without zero padding (2024-1-5) are accepted and returned padded.
+    ordinal = date_ordinal(date_text)
+    if ordinal is None:
+        try:
+            ordinal = datetime.datetime.strptime(date_text, '%Y-%m-%d').toordinal()
+        except (TypeError, ValueError):
+            return None, INVALID_DATE_MESSAGE
+        date_text = datetime.date.fromordinal(ordinal).isoformat()
+    if ordinal > today_ordinal():
+        # Future dates are not allowed.
+        return None, "Date cannot be in the future."
+    return date_text, ""
+
+
+def validate_date(date_text):
+    date_text, message = parse_date(date_text)
+    return date_text is not None, message
+
+
+def validate_transaction_type(transaction_type):
+    if not transaction_type:
+        return False, "Transaction type cannot be empty."
+    if transaction_type not in TRANSACTION_TYPES:
+        return False, "Invalid transaction type. Please enter 'Income' or 'Expense'."
+    return True, ""
+
+
+def validate_category(category):
+    if not category:
+        return False, "Category cannot be empty."
+    if not category.isalpha():
+        return False, "Category name must consist of alphabetic characters only."
+    return True, ""
+
+
+def parse_amount(input_str):
+    #Return (amount, "") for a valid amount, or (None, message) explaining why it was rejected.
+    if not input_str:
+        return None, "Amount cannot be empty."
+    try:
+        amount = float(input_str)
+    except ValueError:
+        return None, "Invalid amount. Please enter a numerical value."
+    if not math.isfinite(amount):
+        return None, "Invalid amount. Please enter a numerical value."
+    if amount <= 0:
+        return None, "Amount must be greater than 0. Please try again."
+    return amount, ""
+
+
+def parse_transaction(transaction_type, category, amount, date):
+    #Return ((type, category, amount, date), "") with every field checked and normalised the way
+    #the prompts do it, or (None, message) for the first field that is not valid.
+    #amount may be text or a number.
+    transaction_type = str(transaction_type).lower().strip()
+    is_valid, message = validate_transaction_type(transaction_type)
+    if not is_valid:
+        return None, message
+    category = str(category).lower().strip()
+    is_valid, message = validate_category(category)
+    if not is_valid:
+        return None, message
+    amount, message = parse_amount(amount.strip() if isinstance(amount, str) else str(amount))
+    if amount is None:
+        return None, message
+    date = str(date).strip()
+    if not date:
+        return None, "Date cannot be empty."
+    date, message = parse_date(date)
+    if date is None:
+        return None, message
+    return (transaction_type, category, amount, date), ""